@@ -0,0 +1,200 @@
+"""
+Batch story generation for offline content prep (starter libraries,
+regression corpora).
+
+Reads a JSONL file of jobs, one object per line:
+
+    {"id": "fox-1", "grade_level": "3-5", "genre": "fantasy", "story_so_far": ""}
+
+(gradeLevel / storySoFar and request_id are accepted too; lines without an
+id are numbered). Each job runs the pipeline from N2G/dag.py, or just the
+tasks given with --tasks plus what they depend on, with a bounded number of
+jobs in flight and LLM calls spaced to a requests-per-minute limit. Rate
+limit and other transient errors are retried, honouring Retry-After.
+
+Results are appended to the output JSONL as each job finishes, and that file
+is the checkpoint: a rerun skips jobs it already holds with status "ok" and
+retries the rest. A job rerun after an error gets a second line, so readers
+should keep the last line per id.
+"""
+import json
+import logging
+import sys
+import threading
+import time
+from concurrent.futures import ALL_COMPLETED, FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from N2G.dag import DagExecutor, task_graph
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimiter:
+    """Spaces calls out evenly so they stay under rpm per minute, across threads."""
+
+    def __init__(self, rpm):
+        self.interval = 60.0 / rpm
+        self._lock = threading.Lock()
+        self._next = time.monotonic()
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+def retry_after(error):
+    """Seconds the upstream asked us to wait, if it said."""
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def rate_limited(runner, limiter=None, retries=3):
+    """Wrap a DAG runner so each call waits its turn and transient failures are retried."""
+    from resilience import backoff, is_transient
+
+    def run(task_name, inputs, context):
+        for attempt in range(retries + 1):
+            if limiter is not None:
+                limiter.acquire()
+            try:
+                return runner(task_name, inputs, context)
+            except Exception as e:
+                if attempt >= retries or not is_transient(e):
+                    raise
+                delay = retry_after(e) or backoff(attempt + 2)
+                logger.warning("%s failed (%s); retry %d in %.1fs", task_name, e, attempt + 1, delay)
+                time.sleep(delay)
+    return run
+
+
+def read_jobs(path, grade_level="3-5", genre="adventure"):
+    """Yield (job_id, inputs) from a JSONL file, skipping blank and malformed lines."""
+    with open(path, "r", encoding="utf-8") as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                job = json.loads(line)
+            except json.JSONDecodeError as e:
+                logger.error("Skipping line %d of %s: %s", number, path, e)
+                continue
+            job_id = str(job.get("id") or job.get("request_id") or f"line-{number}")
+            yield job_id, {
+                "grade_level": job.get("grade_level") or job.get("gradeLevel") or grade_level,
+                "genre": job.get("genre") or genre,
+                "story_so_far": job.get("story_so_far") or job.get("storySoFar") or "",
+            }
+
+
+def completed_ids(path):
+    """Ids already finished successfully in an output file from an earlier run."""
+    done = set()
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # A line cut off by a crash; the job is simply run again
+                    continue
+                if record.get("status") == "ok":
+                    done.add(record["id"])
+                else:
+                    done.discard(record.get("id"))
+    except FileNotFoundError:
+        pass
+    return done
+
+
+def run_job(executor, job_id, inputs, tasks):
+    start = time.perf_counter()
+    results = executor.run(inputs, only=tasks)
+    errors = [r.error for r in results.values() if r.error is not None]
+    return {
+        "id": job_id,
+        "status": "error" if errors else "ok",
+        "input": inputs,
+        "results": {name: r._asdict() for name, r in results.items()},
+        "seconds": round(time.perf_counter() - start, 3),
+    }
+
+
+def run_batch(jobs_path, output_path, runner, tasks=None, concurrency=4, rpm=None, retries=3,
+              grade_level="3-5", genre="adventure"):
+    """Run every job not already done in output_path; returns (ok, failed, skipped) counts."""
+    task_graph(only=tasks)  # fail on an unknown task before any job runs
+    limiter = RateLimiter(rpm) if rpm else None
+    executor = DagExecutor(rate_limited(runner, limiter, retries))
+    done = completed_ids(output_path)
+    counts = {"ok": 0, "error": 0, "skipped": 0}
+
+    with open(output_path, "a", encoding="utf-8") as out, \
+            ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="batch") as pool:
+        running = set()
+
+        def drain(return_when):
+            finished, _ = wait(running, return_when=return_when)
+            for future in finished:
+                running.discard(future)
+                record = future.result()
+                # One line per job, flushed as it lands, so a crash loses at most the jobs in flight
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                out.flush()
+                counts[record["status"]] += 1
+                total = counts["ok"] + counts["error"]
+                if total % 10 == 0:
+                    logger.info("%d jobs done (%d failed)", total, counts["error"])
+
+        for job_id, inputs in read_jobs(jobs_path, grade_level, genre):
+            if job_id in done:
+                counts["skipped"] += 1
+                continue
+            done.add(job_id)
+            # Read jobs lazily, keeping at most `concurrency` of them in flight
+            if len(running) >= concurrency:
+                drain(FIRST_COMPLETED)
+            running.add(pool.submit(run_job, executor, job_id, inputs, tasks))
+        if running:
+            drain(ALL_COMPLETED)
+
+    return counts["ok"], counts["error"], counts["skipped"]
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        prog="python N2G/main.py batch",
+        description="Generate stories for every job in a JSONL file (see N2G/batch.py).",
+    )
+    parser.add_argument("jobs", help="JSONL file of jobs")
+    parser.add_argument("-o", "--output", required=True, help="JSONL file results are appended to (and resumed from)")
+    parser.add_argument("--tasks", help="Comma-separated tasks to run (default: the whole pipeline)")
+    parser.add_argument("--engine", choices=("crew", "direct"), default="direct")
+    parser.add_argument("--model", help="Model for every task (default CREW_MODEL / direct DEFAULT_MODEL)")
+    parser.add_argument("--concurrency", type=int, default=4, help="Jobs in flight at once")
+    parser.add_argument("--rpm", type=float, default=None, help="Max LLM requests per minute")
+    parser.add_argument("--retries", type=int, default=3, help="Retries per task on transient errors")
+    parser.add_argument("--grade-level", default="3-5", help="Grade level for jobs that do not set one")
+    parser.add_argument("--genre", default="adventure", help="Genre for jobs that do not set one")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s", stream=sys.stderr)
+    from N2G.dag import crew_runner, direct_runner
+    from N2G.main import direct_client
+
+    runner = direct_runner(direct_client(), args.model) if args.engine == "direct" else crew_runner(args.model)
+    tasks = [t.strip() for t in args.tasks.split(",")] if args.tasks else None
+    ok, failed, skipped = run_batch(
+        args.jobs, args.output, runner, tasks=tasks, concurrency=args.concurrency, rpm=args.rpm,
+        retries=args.retries, grade_level=args.grade_level, genre=args.genre,
+    )
+    logger.info("Batch finished: %d ok, %d failed, %d already done", ok, failed, skipped)
+    return 1 if failed else 0
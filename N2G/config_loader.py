@@ -0,0 +1,21 @@
+import os
+from functools import lru_cache
+import yaml
+
+CONFIG_DIR = os.path.join(os.path.dirname(__file__), "config")
+AGENTS_PATH = os.path.join(CONFIG_DIR, "agents.yaml")
+TASKS_PATH = os.path.join(CONFIG_DIR, "tasks.yaml")
+
+# --- YAML Helpers ---
+def load_yaml(path):
+    return _load_yaml_cached(path, os.path.getmtime(path))
+
+@lru_cache(maxsize=16)
+def _load_yaml_cached(path, mtime):
+    # mtime is part of the cache key so an edited file is re-read on next use
+    with open(path, "r") as f:
+        return yaml.safe_load(f)
+
+def config_version():
+    """Return a token that changes whenever agents.yaml or tasks.yaml is edited."""
+    return tuple(os.path.getmtime(p) for p in (AGENTS_PATH, TASKS_PATH))
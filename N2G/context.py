@@ -0,0 +1,178 @@
+"""
+Sliding-window compaction of the story sent to the continuation prompt.
+
+Long games used to embed the whole story in every continue_task prompt, so
+prompt tokens (and latency) grew with each turn. Once a story goes over the
+token budget, ContextCompactor keeps the most recent sentences verbatim and
+replaces everything older with a running summary. Summaries are cached per
+session and extended incrementally: only sentences that have aged out since
+the last summary are sent to the summarizer, and only once enough of them
+have piled up. Calls without a session id are cached by the exact story
+prefix that was summarized, so games that open with the same pooled starter
+never share or evict each other's summaries. If the summarizer fails, the prompt falls back to the most
+recent sentences that fit the budget.
+
+    CONTEXT_TOKEN_BUDGET     approx. tokens of story allowed in the prompt (default 600)
+    CONTEXT_KEEP_SENTENCES   recent sentences always kept verbatim (default 8)
+    CONTEXT_SUMMARY_CHUNK    aged-out sentences to collect before re-summarizing (default 6)
+    CONTEXT_MAX_SESSIONS     sessions whose summaries are cached (default 1000)
+    CONTEXT_SUMMARY_TIMEOUT  seconds per summarizer attempt (default 10)
+"""
+import hashlib
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+_SENTENCE_SPLIT = re.compile(r'(?<=[.!?])["\'”’)\]]*\s+|\n+')
+
+@lru_cache(maxsize=None)
+def _encoding():
+    # Loaded on first use: the BPE table is slow to load (and may be downloaded)
+    try:
+        import tiktoken
+        return tiktoken.get_encoding("cl100k_base")
+    except ImportError:
+        return None
+
+
+def count_tokens(text):
+    encoding = _encoding()
+    if encoding is None:
+        # Roughly four characters per token for English prose
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text))
+
+
+def split_sentences(text):
+    return [s.strip() for s in _SENTENCE_SPLIT.split(text) if s and s.strip()]
+
+
+def _prefix_digests(sentences):
+    """Digest of sentences[:count] (joined by newlines) for every count from 0 to len(sentences)."""
+    running = hashlib.sha256()
+    digests = [running.hexdigest()]
+    for i, sentence in enumerate(sentences):
+        running.update((("\n" if i else "") + sentence).encode("utf-8"))
+        digests.append(running.hexdigest())
+    return digests
+
+
+def make_openai_summarizer(client, model="gpt-3.5-turbo", on_response=None, upstream=None, timeout=None):
+    """
+    Summarizer backed by a chat-completions client; on_response(response) sees each reply.
+
+    With an upstream (resilience.Upstream) the call goes through its breaker,
+    retries and deadline; each attempt gets at most timeout seconds.
+    """
+    summary_timeout = float(timeout or os.getenv("CONTEXT_SUMMARY_TIMEOUT", "10"))
+
+    def create(timeout=summary_timeout, **kwargs):
+        # upstream.call passes what is left of its deadline; never wait longer than summary_timeout
+        return client.chat.completions.create(timeout=min(timeout, summary_timeout), **kwargs)
+
+    def summarize(previous_summary, new_text):
+        prompt = (
+            "Summarize this children's story so far in at most 120 words. Keep every character name, "
+            "the setting and the key events in order. Do not add anything new.\n\n"
+        )
+        if previous_summary:
+            prompt += f"Summary of the earlier story:\n{previous_summary}\n\n"
+        prompt += f"What happened next:\n{new_text}"
+        call = upstream.call if upstream is not None else (lambda fn, **kwargs: fn(**kwargs))
+        response = call(
+            create,
+            model=model,
+            messages=[{"role": "user", "content": prompt}],
+            max_tokens=200,
+            temperature=0.2,
+        )
+        if on_response is not None:
+            on_response(response)
+        return response.choices[0].message.content.strip()
+    return summarize
+
+
+class ContextCompactor:
+    """Per-session sliding window plus incrementally maintained summary."""
+
+    def __init__(self, summarize, token_budget=None, keep_sentences=None, summary_chunk=None, max_sessions=None):
+        self._summarize = summarize
+        self.token_budget = int(token_budget or os.getenv("CONTEXT_TOKEN_BUDGET", "600"))
+        self.keep_sentences = int(keep_sentences or os.getenv("CONTEXT_KEEP_SENTENCES", "8"))
+        self.summary_chunk = int(summary_chunk or os.getenv("CONTEXT_SUMMARY_CHUNK", "6"))
+        self.max_sessions = int(max_sessions or os.getenv("CONTEXT_MAX_SESSIONS", "1000"))
+        self._lock = threading.Lock()
+        # session id, or "story:" + digest of the summarized prefix -> (sentences summarized, their digest, summary)
+        self._summaries = OrderedDict()
+        self.summary_calls = 0
+
+    def _cached(self, older, digests, session_id):
+        """(sentences summarized, summary) of the longest cached summary of a prefix of older."""
+        with self._lock:
+            if session_id:
+                state = self._summaries.get(str(session_id))
+                if state is not None and state[0] <= len(older) and digests[state[0]] == state[1]:
+                    return state[0], state[2]
+                return 0, None
+            # No session: the summary of any prefix of this very story will do
+            for count in range(len(older), 0, -1):
+                state = self._summaries.get("story:" + digests[count])
+                if state is not None:
+                    return count, state[2]
+        return 0, None
+
+    def compact(self, story, session_id=None):
+        """Return the story text to put in the prompt, within the token budget where possible."""
+        if count_tokens(story) <= self.token_budget:
+            return story
+
+        sentences = split_sentences(story)
+        keep = min(self.keep_sentences, len(sentences))
+        older, recent = sentences[:-keep] if keep else sentences, sentences[-keep:] if keep else []
+        if not older:
+            return story
+
+        digests = _prefix_digests(older)
+        summarized, summary = self._cached(older, digests, session_id)
+
+        pending = older[summarized:]
+        if summary is None or len(pending) >= self.summary_chunk:
+            try:
+                summary = self._summarize(summary, " ".join(pending))
+            except Exception as e:
+                logger.error("Story summarization failed, sending the latest sentences only: %s", e)
+                return self.truncate(sentences)
+            self.summary_calls += 1
+            summarized, pending = len(older), []
+            key = str(session_id) if session_id else "story:" + digests[summarized]
+            with self._lock:
+                self._summaries[key] = (summarized, digests[summarized], summary)
+                self._summaries.move_to_end(key)
+                while len(self._summaries) > self.max_sessions:
+                    self._summaries.popitem(last=False)
+
+        # Sentences aged out since the last summary stay verbatim until the next chunk
+        verbatim = pending + recent
+        return (
+            f"(Summary of the earlier story: {summary})\n\n"
+            + " ".join(verbatim)
+        )
+
+    def truncate(self, sentences):
+        """The most recent sentences that fit the token budget (at least the last one)."""
+        kept, tokens = [], 0
+        for sentence in reversed(sentences):
+            tokens += count_tokens(sentence) + 1
+            if kept and tokens > self.token_budget:
+                break
+            kept.append(sentence)
+        return " ".join(reversed(kept))
+
+    def forget(self, session_id):
+        with self._lock:
+            self._summaries.pop(str(session_id), None)
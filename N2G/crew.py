@@ -1,19 +1,46 @@
 import os
-import yaml
+import threading
+import time
+from functools import lru_cache
 from dotenv import load_dotenv
-from crewai import Agent, Task, Crew, Process
-from langchain_openai import ChatOpenAI
-from crewai_tools import SerperDevTool
+from N2G.config_loader import AGENTS_PATH, TASKS_PATH, load_yaml, config_version
 
 load_dotenv()
 
-# --- YAML Helpers ---
-def load_yaml(path):
-    with open(path, "r") as f:
-        return yaml.safe_load(f)
+# Model for story crews, and the cheaper one used once a usage budget is spent (see usage.py)
+CREW_MODEL = os.getenv("CREW_MODEL", "gpt-4-turbo")
+BUDGET_MODEL = os.getenv("BUDGET_MODEL", "gpt-3.5-turbo")
+
+# crewai, langchain_openai and crewai_tools take seconds to import, so they are
+# imported where a crew is first built rather than when this module loads;
+# server.py imports this module on every worker start.
+
+# --- Shared Clients ---
+# The LLM client and search tool hold no per-run state, so one instance of each
+# is shared by every agent in the process.
+@lru_cache(maxsize=None)
+def get_llm(model="gpt-4-turbo"):
+    from N2G import mock_backend
+    if mock_backend.is_enabled():
+        return mock_backend.build_mock_chat_model(model)
+    from langchain_openai import ChatOpenAI
+    return ChatOpenAI(
+        model=model,
+        temperature=0.7,
+        openai_api_key=os.getenv("OPENAI_API_KEY"),
+        # Same per-attempt timeout and retry bound as direct chat calls (see resilience.py)
+        timeout=float(os.getenv("UPSTREAM_CHAT_TIMEOUT", "30")),
+        max_retries=int(os.getenv("UPSTREAM_CHAT_RETRIES", "2"))
+    )
+
+@lru_cache(maxsize=None)
+def get_search_tool():
+    from crewai_tools import SerperDevTool
+    return SerperDevTool()
 
 # --- Agent Loader ---
 def load_agents(path, llm):
+    from crewai import Agent
     raw = load_yaml(path)
     agents = {}
     for name, config in raw.items():
@@ -22,13 +49,14 @@ def load_agents(path, llm):
             goal=config["goal"],
             backstory=config["backstory"],
             llm=llm,
-            tools=[SerperDevTool()],
+            tools=[get_search_tool()],
             verbose=True
         )
     return agents
 
 # --- Task Loader ---
 def load_tasks(path, agents):
+    from crewai import Task
     raw = load_yaml(path)
     tasks = []
     for name, config in raw.items():
@@ -40,20 +68,10 @@ def load_tasks(path, agents):
     return tasks
 
 # --- Full Crew Builder ---
-def build_full_crew():
-    base = os.path.dirname(__file__)
-    config_dir = os.path.join(base, "config")
-    agents_path = os.path.join(config_dir, "agents.yaml")
-    tasks_path = os.path.join(config_dir, "tasks.yaml")
-
-    llm = ChatOpenAI(
-        model="gpt-4-turbo",
-        temperature=0.7,
-        openai_api_key=os.getenv("OPENAI_API_KEY")
-    )
-
-    agents = load_agents(agents_path, llm)
-    tasks = load_tasks(tasks_path, agents)
+def build_full_crew(model=CREW_MODEL):
+    from crewai import Crew, Process
+    agents = load_agents(AGENTS_PATH, get_llm(model))
+    tasks = load_tasks(TASKS_PATH, agents)
 
     return Crew(
         agents=list(agents.values()),
@@ -62,19 +80,41 @@ def build_full_crew():
         verbose=True
     )
 
-# --- Prompt-only Crew Builder ---
-def build_prompt_only_crew():
-    base = os.path.dirname(__file__)
-    config_dir = os.path.join(base, "config")
-    agents_path = os.path.join(config_dir, "agents.yaml")
+# --- Single-task Crew Builder ---
+# One node of the parallel pipeline (N2G/dag.py). The outputs of the tasks it
+# depends on arrive in the `dag_context` input.
+def build_task_crew(task_name, model=CREW_MODEL):
+    from crewai import Agent, Task, Crew, Process
+    config = load_yaml(TASKS_PATH)[task_name]
+    agent_config = load_yaml(AGENTS_PATH)[config["agent"]]
+    agent = Agent(
+        role=agent_config["role"],
+        goal=agent_config["goal"],
+        backstory=agent_config["backstory"],
+        llm=get_llm(model),
+        tools=[get_search_tool()],
+        verbose=True
+    )
+    description = config["description"]
+    if config.get("depends_on"):
+        description += "\n\nThis is the context you're working with:\n{dag_context}"
+    task = Task(
+        description=description,
+        expected_output=config["expected_output"],
+        agent=agent,
+    )
 
-    llm = ChatOpenAI(
-        model="gpt-4-turbo",
-        temperature=0.7,
-        openai_api_key=os.getenv("OPENAI_API_KEY")
+    return Crew(
+        agents=[agent],
+        tasks=[task],
+        process=Process.sequential,
+        verbose=True
     )
 
-    agents = load_agents(agents_path, llm)
+# --- Prompt-only Crew Builder ---
+def build_prompt_only_crew(model=CREW_MODEL):
+    from crewai import Task, Crew, Process
+    agents = load_agents(AGENTS_PATH, get_llm(model))
     creative_writer = agents["creative_writer"]
 
     prompt_task = Task(
@@ -96,33 +136,10 @@ def build_prompt_only_crew():
         verbose=True
     )
 
-def build_continue_only_crew():
-    import os
-    from crewai import Agent, Task, Crew
-    from langchain_openai import ChatOpenAI
-    from crewai_tools import SerperDevTool
-    import yaml
-
-    # Load LLM
-    llm = ChatOpenAI(
-        model="gpt-4-turbo",
-        temperature=0.7,
-        openai_api_key=os.getenv("OPENAI_API_KEY")
-    )
-
-    # Load agents from YAML
-    config_dir = os.path.join(os.path.dirname(__file__), "config")
-    with open(os.path.join(config_dir, "agents.yaml"), "r") as f:
-        agents_config = yaml.safe_load(f)
-
-    story_partner = Agent(
-        role=agents_config["story_partner"]["role"],
-        goal=agents_config["story_partner"]["goal"],
-        backstory=agents_config["story_partner"]["backstory"],
-        llm=llm,
-        tools=[SerperDevTool()],
-        verbose=True
-    )
+def build_continue_only_crew(model=CREW_MODEL):
+    from crewai import Task, Crew
+    agents = load_agents(AGENTS_PATH, get_llm(model))
+    story_partner = agents["story_partner"]
 
     # Define task with dynamic formatting handled during kickoff
     continue_task = Task(
@@ -152,3 +169,59 @@ def build_continue_only_crew():
         verbose=True
     )
 
+
+# --- Crew Pools ---
+class CrewPool:
+    """
+    Keeps built crews around between requests.
+
+    A Crew records task outputs while it runs, so one instance must not serve two
+    kickoffs at once. Each request takes an idle crew (building one if none is
+    free) and hands it back afterwards. Idle crews are dropped when the YAML
+    config changes so the next request picks up the edit. on_build, if set, is
+    called with the seconds each new crew took to build.
+    """
+
+    def __init__(self, builder, model=CREW_MODEL, max_idle=None, on_build=None):
+        self._builder = builder
+        self.model = model
+        self.on_build = on_build
+        self._max_idle = max_idle or int(os.getenv("CREW_POOL_SIZE", "8"))
+        self._lock = threading.Lock()
+        self._idle = []
+        self._leased = {}
+        self._version = None
+
+    def acquire(self):
+        version = config_version()
+        with self._lock:
+            if version != self._version:
+                self._idle.clear()
+                self._version = version
+            crew = self._idle.pop() if self._idle else None
+        if crew is None:
+            start = time.perf_counter()
+            crew = self._builder(self.model)
+            if self.on_build is not None:
+                self.on_build(time.perf_counter() - start)
+        with self._lock:
+            self._leased[id(crew)] = version
+        return crew
+
+    def release(self, crew):
+        with self._lock:
+            version = self._leased.pop(id(crew), None)
+            if version == self._version and len(self._idle) < self._max_idle:
+                self._idle.append(crew)
+
+    def prewarm(self, count=1):
+        crews = [self.acquire() for _ in range(count)]
+        for crew in crews:
+            self.release(crew)
+
+
+prompt_crews = CrewPool(build_prompt_only_crew)
+continue_crews = CrewPool(build_continue_only_crew)
+# Crews on BUDGET_MODEL, for turns that are over their usage budget
+budget_prompt_crews = CrewPool(build_prompt_only_crew, model=BUDGET_MODEL)
+budget_continue_crews = CrewPool(build_continue_only_crew, model=BUDGET_MODEL)
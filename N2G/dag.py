@@ -0,0 +1,141 @@
+"""
+Dependency-aware execution of the multi-agent story pipeline.
+
+Each task in tasks.yaml lists the tasks whose output it needs under
+`depends_on`. DagExecutor starts every task as soon as its dependencies have
+finished, running independent tasks (feedback, scaffolding, moderation and
+progress tracking all only need the continuation) concurrently on a thread
+pool, so the pipeline takes about as long as its critical path rather than
+the sum of all six tasks. Each task gets its dependencies' outputs as
+context, the way a sequential crew passes earlier outputs along.
+
+A node is run by a runner: run(task_name, inputs, context) -> text.
+crew_runner() runs each task as a one-agent crew; direct_runner() as one
+chat-completions call (N2G/direct.py).
+"""
+import os
+import time
+from collections import OrderedDict, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from functools import partial
+
+from N2G.config_loader import TASKS_PATH, load_yaml
+
+TaskResult = namedtuple("TaskResult", ["task", "agent", "output", "seconds", "error"])
+
+
+def task_graph(tasks_config=None, only=None):
+    """
+    Ordered {task: [dependencies]} from tasks.yaml, checked for unknown tasks and cycles.
+
+    only limits the graph to those tasks plus everything they depend on.
+    """
+    tasks_config = tasks_config or load_yaml(TASKS_PATH)
+    graph = OrderedDict((name, list(config.get("depends_on") or [])) for name, config in tasks_config.items())
+    for name, deps in graph.items():
+        unknown = [d for d in deps if d not in graph]
+        if unknown:
+            raise ValueError(f"Task '{name}' depends on unknown task(s): {', '.join(unknown)}")
+    if only:
+        needed = set()
+        stack = list(only)
+        while stack:
+            name = stack.pop()
+            if name not in graph:
+                raise ValueError(f"Unknown task '{name}'")
+            if name not in needed:
+                needed.add(name)
+                stack.extend(graph[name])
+        graph = OrderedDict((name, deps) for name, deps in graph.items() if name in needed)
+    levels(graph)
+    return graph
+
+
+def levels(graph):
+    """Group tasks into stages that can run together; raises ValueError on a cycle."""
+    done = set()
+    stages = []
+    remaining = OrderedDict(graph)
+    while remaining:
+        ready = [name for name, deps in remaining.items() if all(d in done for d in deps)]
+        if not ready:
+            raise ValueError(f"Dependency cycle among tasks: {', '.join(remaining)}")
+        stages.append(ready)
+        done.update(ready)
+        for name in ready:
+            del remaining[name]
+    return stages
+
+
+def format_context(results, deps):
+    return "\n\n".join(f"{results[d].task}:\n{results[d].output}" for d in deps)
+
+
+class DagExecutor:
+    """Runs the tasks of a pipeline as their dependencies complete."""
+
+    def __init__(self, runner, max_workers=None, tasks_config=None):
+        self.runner = runner
+        self.max_workers = max_workers or int(os.getenv("PIPELINE_THREADS", "6"))
+        self.tasks_config = tasks_config
+
+    def run(self, inputs, only=None):
+        """
+        Run the pipeline; returns {task: TaskResult} in tasks.yaml order.
+
+        A task that raises gets its error in the result and the tasks that
+        depend on it are skipped; unrelated tasks still run.
+        """
+        tasks_config = self.tasks_config or load_yaml(TASKS_PATH)
+        graph = task_graph(tasks_config, only)
+        results = {}
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="dag") as pool:
+            while len(results) < len(graph):
+                for name, deps in graph.items():
+                    if name in results or name in running or not all(d in results for d in deps):
+                        continue
+                    failed = [d for d in deps if results[d].error is not None]
+                    if failed:
+                        results[name] = TaskResult(name, tasks_config[name].get("agent"), None, 0.0,
+                                                   f"skipped: {', '.join(failed)} failed")
+                        continue
+                    running[name] = pool.submit(self._run_task, name, tasks_config[name].get("agent"),
+                                                inputs, format_context(results, deps))
+                if not running:
+                    continue
+                finished, _ = wait(running.values(), return_when=FIRST_COMPLETED)
+                for name in [n for n, f in running.items() if f in finished]:
+                    results[name] = running.pop(name).result()
+        return OrderedDict((name, results[name]) for name in graph)
+
+    def _run_task(self, name, agent, inputs, context):
+        start = time.perf_counter()
+        try:
+            output = self.runner(name, inputs, context)
+        except Exception as e:
+            return TaskResult(name, agent, None, time.perf_counter() - start, str(e))
+        return TaskResult(name, agent, str(output).strip(), time.perf_counter() - start, None)
+
+
+# --- Runners ---
+def _run_crew_task(model, task_name, inputs, context):
+    from N2G.crew import build_task_crew
+    crew = build_task_crew(task_name, model)
+    return crew.kickoff(inputs=dict(inputs, dag_context=context or ""))
+
+
+def crew_runner(model=None):
+    from N2G.crew import CREW_MODEL
+    return partial(_run_crew_task, model or CREW_MODEL)
+
+
+def _run_direct_task(client, model, task_name, inputs, context):
+    from N2G.direct import run_task
+    text, _ = run_task(client, task_name, inputs, model=model, context=context)
+    return text
+
+
+def direct_runner(client, model=None):
+    from N2G.direct import DEFAULT_MODEL
+    return partial(_run_direct_task, client, model or DEFAULT_MODEL)
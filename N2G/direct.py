@@ -0,0 +1,241 @@
+"""
+Direct chat-completions calls for single-agent story tasks.
+
+Renders an agent from agents.yaml and a task from tasks.yaml into a plain
+chat-completions request, so single-agent tasks (and callers that need token
+streaming) do not have to go through a CrewAI crew: one request per turn, no
+agent reasoning loop, tools or verbose console output.
+"""
+import os
+import re
+
+from N2G.config_loader import AGENTS_PATH, TASKS_PATH, load_yaml
+from N2G.context import count_tokens
+
+# Same setting as the crews (N2G/crew.py), so both engines run on one model
+DEFAULT_MODEL = os.getenv("CREW_MODEL", "gpt-4-turbo")
+
+# A sentence ends at ., ! or ? (optionally followed by closing quotes or
+# brackets) once the next character is whitespace.
+SENTENCE_END = re.compile(r'[.!?]+["\'”’)\]]*(?=\s)')
+# Where a sentence budget may cut: as above, but only once the next word has
+# started and is not lowercase, so '"Wait!" she said.' stays one sentence.
+SENTENCE_STOP = re.compile(r'[.!?]+["\'”’)\]]*(?=\s+[^\sa-z])')
+
+
+class _KeepMissing(dict):
+    def __missing__(self, key):
+        return "{" + key + "}"
+
+
+def render_messages(task_name, inputs, context=None):
+    """Build the system/user messages CrewAI would send for a one-task crew."""
+    task = load_yaml(TASKS_PATH)[task_name]
+    agent = load_yaml(AGENTS_PATH)[task["agent"]]
+    values = _KeepMissing({k: "" if v is None else v for k, v in inputs.items()})
+
+    system = (
+        f"You are {agent['role'].strip()}. {agent['backstory'].strip()}\n"
+        f"Your personal goal is: {agent['goal'].strip()}"
+    )
+    user = (
+        f"{task['description'].format_map(values).strip()}\n\n"
+        f"This is the expected criteria for your final answer: "
+        f"{task['expected_output'].format_map(values).strip()}\n"
+        "Reply with the final answer only."
+    )
+    if context:
+        # Outputs of the tasks this one depends on, worded as CrewAI passes them
+        user += f"\n\nThis is the context you're working with:\n{context}"
+    return [
+        {"role": "system", "content": system},
+        {"role": "user", "content": user},
+    ]
+
+
+def estimate_usage(task_name, inputs, completion):
+    """(prompt, completion) token estimate for a streamed call, which reports no usage."""
+    return estimate_messages_usage(render_messages(task_name, inputs), completion)
+
+
+def estimate_messages_usage(messages, completion):
+    """estimate_usage() for a call built from messages rather than a task."""
+    return sum(count_tokens(m["content"]) for m in messages), count_tokens(completion)
+
+
+def run_task(client, task_name, inputs, model=DEFAULT_MODEL, context=None, **params):
+    """Run a task as one chat-completions call; returns (text, response)."""
+    params.setdefault("temperature", 0.7)
+    response = client.chat.completions.create(
+        model=model,
+        messages=render_messages(task_name, inputs, context),
+        **params
+    )
+    return (response.choices[0].message.content or "").strip(), response
+
+
+async def arun_task(client, task_name, inputs, model=DEFAULT_MODEL, context=None, **params):
+    """Async counterpart of run_task for AsyncOpenAI clients."""
+    params.setdefault("temperature", 0.7)
+    response = await client.chat.completions.create(
+        model=model,
+        messages=render_messages(task_name, inputs, context),
+        **params
+    )
+    return (response.choices[0].message.content or "").strip(), response
+
+
+def stream_task(client, task_name, inputs, model=DEFAULT_MODEL, **params):
+    """Yield text deltas for a task as the model generates them."""
+    yield from stream_messages(client, render_messages(task_name, inputs), model, **params)
+
+
+def stream_messages(client, messages, model=DEFAULT_MODEL, **params):
+    """Yield text deltas for a chat-completions call as the model generates them."""
+    params.setdefault("temperature", 0.7)
+    stream = client.chat.completions.create(
+        model=model,
+        messages=messages,
+        stream=True,
+        **params
+    )
+    try:
+        for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                yield delta
+    finally:
+        # Closing the stream drops the HTTP connection, which stops generation
+        # upstream if the caller bails out early.
+        close = getattr(stream, "close", None)
+        if close:
+            close()
+
+
+async def astream_task(client, task_name, inputs, model=DEFAULT_MODEL, **params):
+    """Async counterpart of stream_task for AsyncOpenAI clients."""
+    tokens = astream_messages(client, render_messages(task_name, inputs), model, **params)
+    try:
+        async for token in tokens:
+            yield token
+    finally:
+        await tokens.aclose()
+
+
+async def astream_messages(client, messages, model=DEFAULT_MODEL, **params):
+    """Async counterpart of stream_messages for AsyncOpenAI clients."""
+    params.setdefault("temperature", 0.7)
+    stream = await client.chat.completions.create(
+        model=model,
+        messages=messages,
+        stream=True,
+        **params
+    )
+    try:
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                yield delta
+    finally:
+        close = getattr(stream, "close", None) or getattr(stream, "aclose", None)
+        if close:
+            await close()
+
+
+def first_sentences(tokens, max_sentences):
+    """
+    Yield text deltas from tokens up to the end of its max_sentences-th
+    sentence, then close tokens. For a stream from stream_messages() that
+    cancels the request, so the model stops generating (and billing) text
+    that would only be cut off afterwards.
+    """
+    budget = _SentenceBudget(max_sentences)
+    try:
+        for token in tokens:
+            token = budget.take(token)
+            if token:
+                yield token
+            if budget.spent:
+                return
+    finally:
+        close = getattr(tokens, "close", None)
+        if close:
+            close()
+
+
+async def afirst_sentences(tokens, max_sentences):
+    """Async counterpart of first_sentences()."""
+    budget = _SentenceBudget(max_sentences)
+    try:
+        async for token in tokens:
+            token = budget.take(token)
+            if token:
+                yield token
+            if budget.spent:
+                return
+    finally:
+        await tokens.aclose()
+
+
+def trim_sentences(text, max_sentences):
+    """text cut after its max_sentences-th sentence, by the same rule as first_sentences()."""
+    return "".join(first_sentences([text], max_sentences)).strip()
+
+
+def complete_sentences(client, messages, max_sentences, model=DEFAULT_MODEL, **params):
+    """Stream a chat completion until it has max_sentences sentences; returns the text."""
+    return "".join(first_sentences(stream_messages(client, messages, model, **params), max_sentences)).strip()
+
+
+async def acomplete_sentences(client, messages, max_sentences, model=DEFAULT_MODEL, **params):
+    """Async counterpart of complete_sentences()."""
+    tokens = afirst_sentences(astream_messages(client, messages, model, **params), max_sentences)
+    return "".join([token async for token in tokens]).strip()
+
+
+class _SentenceBudget:
+    """Counts the sentences in streamed text and cuts the delta that completes the last one allowed."""
+
+    def __init__(self, max_sentences):
+        self.max_sentences = max_sentences
+        self.text = ""
+        self.scanned = 0
+        self.count = 0
+        self.spent = False
+
+    def take(self, token):
+        self.text += token
+        for match in SENTENCE_STOP.finditer(self.text, self.scanned):
+            self.scanned = match.end()
+            self.count += 1
+            if self.count >= self.max_sentences:
+                self.spent = True
+                # Everything before this delta has been passed on already
+                return token[:max(0, match.end() - (len(self.text) - len(token)))]
+        return token
+
+
+class SentenceBuffer:
+    """Accumulates streamed text and hands back each sentence once it is complete."""
+
+    def __init__(self):
+        self._pending = ""
+
+    def feed(self, text):
+        self._pending += text
+        sentences = []
+        while True:
+            match = SENTENCE_END.search(self._pending)
+            if not match:
+                break
+            sentences.append(self._pending[:match.end()])
+            self._pending = self._pending[match.end():]
+        return sentences
+
+    def flush(self):
+        rest, self._pending = self._pending, ""
+        return rest
@@ -1,37 +1,97 @@
-from crew import build_crew
+import os
+import sys
+
+# Allow running as a script (python N2G/main.py) as well as importing N2G.main
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from N2G.config_loader import TASKS_PATH, load_yaml
+from N2G.dag import DagExecutor, crew_runner, direct_runner
 
 # Define a wrapper function to trigger the full pipeline
-def kickoff(grade_level: str, genre: str, story_so_far: str = "") -> str:
+def kickoff(grade_level: str, genre: str, story_so_far: str = "", parallel: bool = True,
+            structured: bool = False, engine: str = "crew"):
     """
     Launch the collaborative story building process.
-    
+
     Parameters:
     - grade_level (str): Grade level of the student (e.g., 'K-2', '3-5', '6-8', '9-12')
     - genre (str): Genre of the story (e.g., 'fantasy', 'adventure', 'sci-fi')
     - story_so_far (str): Student's story text so far (optional)
-    
+    - parallel (bool): Run independent agents concurrently (see N2G/dag.py) instead of
+      one sequential crew
+    - structured (bool): Return a per-agent result instead of one combined string
+    - engine (str): 'crew' runs each parallel task as a CrewAI crew, 'direct' as one
+      chat-completions call
+
     Returns:
-    - str: Combined output of all agent contributions
+    - str: Combined output of all agent contributions, or with structured=True
+      dict: {task: {"agent", "output", "seconds", "error"}} in tasks.yaml order
     """
-    crew = build_crew()
-    
     inputs = {
         "grade_level": grade_level,
         "genre": genre,
         "story_so_far": story_so_far
     }
 
-    result = crew.kickoff(inputs=inputs)
-    return result
+    if parallel:
+        runner = direct_runner(direct_client()) if engine == "direct" else crew_runner()
+        results = {
+            name: result._asdict() for name, result in DagExecutor(runner).run(inputs).items()
+        }
+    else:
+        results = _kickoff_sequential(inputs)
+
+    if structured:
+        return results
+    return "\n\n".join(r["output"] for r in results.values() if r["output"])
 
 
-# For standalone CLI testing
+def _kickoff_sequential(inputs):
+    from N2G.crew import build_full_crew
+    crew = build_full_crew()
+    output = crew.kickoff(inputs=inputs)
+    # The full crew runs the tasks in tasks.yaml order
+    tasks = load_yaml(TASKS_PATH)
+    task_outputs = getattr(output, "tasks_output", None)
+    if not task_outputs:
+        # Older CrewAI versions only return the final output
+        task_outputs = [output]
+        tasks = {"pipeline": {}}
+    return {
+        name: {
+            "task": name,
+            "agent": config.get("agent"),
+            "output": str(getattr(task_output, "raw", task_output)).strip(),
+            "seconds": None,
+            "error": None,
+        }
+        for (name, config), task_output in zip(tasks.items(), task_outputs)
+    }
+
+
+def direct_client():
+    from N2G import mock_backend
+    if mock_backend.is_enabled():
+        return mock_backend.MockOpenAI()
+    from openai import OpenAI
+    return OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+
+
+# For standalone CLI testing; `python N2G/main.py batch jobs.jsonl -o out.jsonl` for batch runs
 if __name__ == "__main__":
+    if sys.argv[1:2] == ["batch"]:
+        from N2G.batch import main as batch_main
+        sys.exit(batch_main(sys.argv[2:]))
+
     print("✨ Starting collaborative story game...\n")
     grade_level = input("Enter grade level (K-2, 3-5, 6-8, 9-12): ")
     genre = input("Enter genre (fantasy, adventure, sci-fi, etc.): ")
     story_so_far = input("Paste your story so far (or leave blank to generate from scratch): ")
 
-    output = kickoff(grade_level, genre, story_so_far)
+    results = kickoff(grade_level, genre, story_so_far, structured=True)
     print("\n🎉 Final Output:\n")
-    print(output)
+    for name, result in results.items():
+        timing = f" ({result['seconds']:.1f}s)" if result["seconds"] is not None else ""
+        print(f"--- {name} [{result['agent']}]{timing} ---")
+        print(result["output"] if result["error"] is None else f"Error: {result['error']}")
+        print()
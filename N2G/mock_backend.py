@@ -0,0 +1,243 @@
+"""
+Local stand-ins for the OpenAI services used by the story servers.
+
+Select them with STORY_QUEST_BACKEND=mock. Every call sleeps for a configurable
+latency and can fail at a configurable rate, so the Flask API can be load
+tested without network access or API spend:
+
+    MOCK_LATENCY_MS             default latency for every upstream
+    MOCK_<UPSTREAM>_LATENCY_MS  override for CHAT, MODERATION or IMAGE
+    MOCK_JITTER                 +/- fraction applied to each latency (0.2)
+    MOCK_FAILURE_RATE           probability that a call raises (0.0)
+    MOCK_FLAG_RATE              probability that moderation flags text (0.0)
+"""
+import asyncio
+import base64
+import os
+import random
+import time
+from types import SimpleNamespace
+
+DEFAULT_LATENCY_MS = {
+    "chat": 800,
+    "moderation": 150,
+    "image": 3000,
+}
+
+MOCK_STARTER = (
+    "Pip the little fox found a glowing acorn under the old oak tree. "
+    "When she picked it up, the forest began to hum a secret song."
+)
+MOCK_CONTINUATION = (
+    "Pip followed the song down a mossy path toward the river. "
+    "There, a family of otters waved at her as if they had been waiting all day."
+)
+
+# 1x1 transparent PNG, served as a data: URL so downloads work offline
+_PNG_BYTES = base64.b64decode(
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAQAAAC1HAwCAAAAC0lEQVR42mNkYAAAAAYAAjCB0C8AAAAASUVORK5CYII="
+)
+MOCK_IMAGE_URL = "data:image/png;base64," + base64.b64encode(_PNG_BYTES).decode("ascii")
+
+
+def is_enabled():
+    return os.getenv("STORY_QUEST_BACKEND", "openai").lower() == "mock"
+
+
+class MockUpstreamError(ConnectionError):
+    """Raised by the mock backend to simulate an upstream failure (a transient one, like a dropped connection)."""
+
+
+class MockProfile:
+    """Latency and failure behaviour for one mocked upstream."""
+
+    def __init__(self, latency_ms, jitter=0.2, failure_rate=0.0, flag_rate=0.0):
+        self.latency_ms = latency_ms
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.flag_rate = flag_rate
+
+    @classmethod
+    def from_env(cls, upstream):
+        default = float(os.getenv("MOCK_LATENCY_MS", DEFAULT_LATENCY_MS[upstream]))
+        return cls(
+            latency_ms=float(os.getenv(f"MOCK_{upstream.upper()}_LATENCY_MS", default)),
+            jitter=float(os.getenv("MOCK_JITTER", "0.2")),
+            failure_rate=float(os.getenv("MOCK_FAILURE_RATE", "0.0")),
+            flag_rate=float(os.getenv("MOCK_FLAG_RATE", "0.0")),
+        )
+
+    def delay(self):
+        spread = self.latency_ms * self.jitter
+        return max(0.0, self.latency_ms + random.uniform(-spread, spread)) / 1000.0
+
+    def call(self, upstream):
+        """Sleep for one simulated round trip, then maybe fail."""
+        time.sleep(self.delay())
+        if random.random() < self.failure_rate:
+            raise MockUpstreamError(f"Mock {upstream} upstream failure")
+
+    async def acall(self, upstream):
+        await asyncio.sleep(self.delay())
+        if random.random() < self.failure_rate:
+            raise MockUpstreamError(f"Mock {upstream} upstream failure")
+
+
+def _story_for(messages):
+    text = " ".join(str(m.get("content", "")) for m in messages if isinstance(m, dict))
+    return MOCK_CONTINUATION if "STORY SO FAR" in text or "Previous story" in text else MOCK_STARTER
+
+
+def _usage(prompt_text, completion_text):
+    prompt_tokens = max(1, len(prompt_text) // 4)
+    completion_tokens = max(1, len(completion_text) // 4)
+    return SimpleNamespace(
+        prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens,
+        total_tokens=prompt_tokens + completion_tokens,
+    )
+
+
+# --- OpenAI client stand-in ---
+class _MockCompletions:
+    def __init__(self, profile):
+        self._profile = profile
+
+    def create(self, model=None, messages=None, stream=False, **kwargs):
+        messages = messages or []
+        story = _story_for(messages)
+        if stream:
+            return self._stream(model, story)
+        self._profile.call("chat")
+        prompt_text = " ".join(str(m.get("content", "")) for m in messages)
+        return SimpleNamespace(
+            model=model,
+            choices=[SimpleNamespace(message=SimpleNamespace(role="assistant", content=story))],
+            usage=_usage(prompt_text, story),
+        )
+
+    def _stream(self, model, story):
+        # Spread the configured latency over the tokens so time-to-first-token
+        # is a fraction of the full call, like the real streaming API.
+        words = story.split(" ")
+        per_token = self._profile.delay() / max(1, len(words))
+        for i, word in enumerate(words):
+            time.sleep(per_token)
+            if i == 0 and random.random() < self._profile.failure_rate:
+                raise MockUpstreamError("Mock chat upstream failure")
+            token = word if i == 0 else " " + word
+            yield SimpleNamespace(
+                model=model,
+                choices=[SimpleNamespace(delta=SimpleNamespace(content=token), finish_reason=None)],
+            )
+
+
+class _MockModerations:
+    def __init__(self, profile):
+        self._profile = profile
+
+    def create(self, input=None, **kwargs):
+        self._profile.call("moderation")
+        return self._response(input)
+
+    def _response(self, input):
+        items = input if isinstance(input, list) else [input]
+        results = []
+        for _ in items:
+            flagged = random.random() < self._profile.flag_rate
+            categories = SimpleNamespace(violence=flagged, sexual=False, hate=False, harassment=False)
+            results.append(SimpleNamespace(flagged=flagged, categories=categories))
+        return SimpleNamespace(results=results)
+
+
+class _MockImages:
+    def __init__(self, profile):
+        self._profile = profile
+
+    def generate(self, **kwargs):
+        self._profile.call("image")
+        return SimpleNamespace(data=[SimpleNamespace(url=MOCK_IMAGE_URL)])
+
+
+class MockOpenAI:
+    """Drop-in for ``openai.OpenAI`` covering chat, moderation and images."""
+
+    def __init__(self, **kwargs):
+        self.chat = SimpleNamespace(completions=_MockCompletions(MockProfile.from_env("chat")))
+        self.moderations = _MockModerations(MockProfile.from_env("moderation"))
+        self.images = _MockImages(MockProfile.from_env("image"))
+
+
+class _MockAsyncCompletions(_MockCompletions):
+    async def create(self, model=None, messages=None, stream=False, **kwargs):
+        messages = messages or []
+        story = _story_for(messages)
+        if stream:
+            return self._astream(model, story)
+        await self._profile.acall("chat")
+        prompt_text = " ".join(str(m.get("content", "")) for m in messages)
+        return SimpleNamespace(
+            model=model,
+            choices=[SimpleNamespace(message=SimpleNamespace(role="assistant", content=story))],
+            usage=_usage(prompt_text, story),
+        )
+
+    async def _astream(self, model, story):
+        words = story.split(" ")
+        per_token = self._profile.delay() / max(1, len(words))
+        for i, word in enumerate(words):
+            await asyncio.sleep(per_token)
+            if i == 0 and random.random() < self._profile.failure_rate:
+                raise MockUpstreamError("Mock chat upstream failure")
+            token = word if i == 0 else " " + word
+            yield SimpleNamespace(
+                model=model,
+                choices=[SimpleNamespace(delta=SimpleNamespace(content=token), finish_reason=None)],
+            )
+
+
+class _MockAsyncModerations(_MockModerations):
+    async def create(self, input=None, **kwargs):
+        await self._profile.acall("moderation")
+        return self._response(input)
+
+
+class _MockAsyncImages(_MockImages):
+    async def generate(self, **kwargs):
+        await self._profile.acall("image")
+        return SimpleNamespace(data=[SimpleNamespace(url=MOCK_IMAGE_URL)])
+
+
+class MockAsyncOpenAI:
+    """Drop-in for ``openai.AsyncOpenAI`` covering chat, moderation and images."""
+
+    def __init__(self, **kwargs):
+        self.chat = SimpleNamespace(completions=_MockAsyncCompletions(MockProfile.from_env("chat")))
+        self.moderations = _MockAsyncModerations(MockProfile.from_env("moderation"))
+        self.images = _MockAsyncImages(MockProfile.from_env("image"))
+
+
+# --- LangChain chat model stand-in (for CrewAI agents) ---
+def build_mock_chat_model(model="gpt-4-turbo"):
+    from langchain_core.language_models.chat_models import BaseChatModel
+    from langchain_core.messages import AIMessage
+    from langchain_core.outputs import ChatGeneration, ChatResult
+
+    profile = MockProfile.from_env("chat")
+
+    class MockChatModel(BaseChatModel):
+        model_name: str = model
+
+        @property
+        def _llm_type(self):
+            return "story-quest-mock"
+
+        def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+            profile.call("chat")
+            prompt = " ".join(str(m.content) for m in messages)
+            story = MOCK_CONTINUATION if "STORY SO FAR" in prompt else MOCK_STARTER
+            # CrewAI agents parse a ReAct-style reply and stop at "Final Answer:"
+            content = f"Thought: I now can give a great answer\nFinal Answer: {story}"
+            return ChatResult(generations=[ChatGeneration(message=AIMessage(content=content))])
+
+    return MockChatModel()
@@ -0,0 +1,800 @@
+"""
+ASGI serving mode for the story API.
+
+Serves the same routes and JSON shapes as server.py, but moderation and image
+generation use the async OpenAI client, so a single process can hold many
+in-flight story turns without a worker thread parked on each network call.
+CrewAI's kickoff is synchronous, so crew runs go to a dedicated thread pool
+sized by CREW_THREADS.
+
+The handlers reuse server.py's request parsing, turn inputs, replies and
+stream state (StreamedTurn, JobWatch); only the awaiting differs. Calls into
+the stores (idempotency, rate limits, sessions, starters, verdicts, image
+jobs) may block on SQLite, so they run on threads, never on the event loop.
+
+    uvicorn asgi:app --host 0.0.0.0 --port 5002
+"""
+import asyncio
+import logging
+import os
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from functools import partial, wraps
+
+from openai import AsyncOpenAI
+from starlette.applications import Starlette
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import FileResponse, JSONResponse, Response, StreamingResponse
+from starlette.routing import Match, Route
+
+from N2G import mock_backend
+from N2G.direct import (
+    acomplete_sentences,
+    afirst_sentences,
+    astream_task,
+    estimate_messages_usage,
+    render_messages,
+    trim_sentences,
+)
+from pipeline import prescreen, run_moderated_turn_async
+from image_store import IMAGES_DIR, IMAGE_MAX_AGE, etag_matches, image_cache, image_etag, prompt_key
+from singleflight import AsyncSingleFlight
+from image_jobs import QueueFull, InvalidWebhook
+from idempotency import IDEMPOTENT_REPLAYS, InProgress, KeyReused, StoredResponse, fingerprint, valid_key
+from metrics import (
+    CONTENT_TYPE as METRICS_CONTENT_TYPE,
+    REQUEST_SECONDS,
+    STAGE_SECONDS,
+    bind_request,
+    in_request_context,
+    render as render_metrics,
+    upstream_error,
+)
+from usage import usage_tracker, crew_tokens
+from fallbacks import generate_fallback_story
+from ratelimit import RateLimited, Saturated, chat_slots, client_ip, image_slots, rate_limiter
+from resilience import (
+    CircuitOpen,
+    chat as chat_upstream,
+    images as images_upstream,
+    moderation as moderation_upstream,
+)
+from server import (
+    DIRECT_TASKS,
+    IMAGE_REQUEST,
+    STORY_MAX_SENTENCES,
+    JobWatch,
+    StreamedTurn,
+    already_stored,
+    build_image_prompt,
+    cache_report,
+    check_reading_level,
+    first_flagged,
+    health_report,
+    idempotency,
+    image_jobs,
+    is_done_event,
+    keep_image,
+    moderation_failed,
+    open_session,
+    readiness_report,
+    record_verdicts,
+    rejection,
+    screen_passages,
+    serves_fallback,
+    session_request,
+    session_starter,
+    session_stream_refusal,
+    session_turn,
+    session_turn_reply,
+    sessions,
+    split_passages,
+    start_background_workers,
+    starter_pool,
+    stop_background_workers,
+    story_context,
+    story_genre,
+    turn_engine,
+    turn_inputs,
+    turn_reply,
+    turn_request,
+    usage_report,
+)
+
+
+logger = logging.getLogger(__name__)
+
+if mock_backend.is_enabled():
+    async_client = mock_backend.MockAsyncOpenAI()
+else:
+    async_client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0)
+
+crew_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("CREW_THREADS", "64")),
+    thread_name_prefix="crew",
+)
+
+
+def observe_kickoff(pool, crew, before, start, session_id, run):
+    # Runs when the crew finishes, even if the request stopped waiting for it
+    STAGE_SECONDS.observe(time.perf_counter() - start, stage="crew_kickoff")
+    if run.cancelled():
+        return
+    if run.exception() is not None and not isinstance(run.exception(), CircuitOpen):
+        upstream_error("crew")
+        return
+    usage_tracker.record_crew(pool.model, before, crew_tokens(crew, run.result()), session_id)
+
+
+async def kickoff_pooled(pool, inputs, session_id=None):
+    """Run a pooled crew on the crew thread pool and return its output, cut as in server.kickoff."""
+    loop = asyncio.get_running_loop()
+    acquiring = loop.run_in_executor(crew_executor, pool.acquire)
+    try:
+        crew = await asyncio.shield(acquiring)
+    except asyncio.CancelledError:
+        # Cancelled (input rejected) while a crew was being built: hand it back once it exists
+        acquiring.add_done_callback(lambda f: f.cancelled() or f.exception() or pool.release(f.result()))
+        raise
+    before = crew_tokens(crew)
+    start = time.perf_counter()
+    run = loop.run_in_executor(
+        crew_executor, in_request_context(partial(chat_upstream.protect, crew.kickoff, inputs=inputs))
+    )
+    run.add_done_callback(partial(observe_kickoff, pool, crew, before, start, session_id))
+    try:
+        result = await asyncio.shield(run)
+    except asyncio.CancelledError:
+        # The crew keeps running in its thread; hand it back only once it is done
+        run.add_done_callback(lambda _: pool.release(crew))
+        raise
+    except Exception:
+        pool.release(crew)
+        raise
+    pool.release(crew)
+    return trim_sentences(str(result), STORY_MAX_SENTENCES)
+
+
+async def direct_completion_async(task_name, inputs, model, session_id=None):
+    """Async counterpart of server.direct_completion."""
+    messages = render_messages(task_name, inputs)
+    try:
+        with STAGE_SECONDS.time(stage="direct_completion"):
+            text = await chat_upstream.acall(
+                acomplete_sentences, async_client, messages, STORY_MAX_SENTENCES, model=model
+            )
+    except CircuitOpen:
+        raise
+    except Exception:
+        upstream_error("chat")
+        raise
+    usage_tracker.record(model, *estimate_messages_usage(messages, text), session_id=session_id)
+    return text
+
+
+
+
+async def story_turn_async(kind, build_inputs, session_id=None, fallback=None):
+    """
+    Async counterpart of server.story_turn: run one story turn within the usage budget.
+
+    build_inputs() runs on a thread (compaction may call the summarizer), and
+    only if the turn is not served by fallback().
+    """
+    engine = turn_engine(kind, session_id)
+    if engine is None:
+        return fallback()
+    engine, target = engine
+    inputs = await asyncio.to_thread(build_inputs)
+    try:
+        if engine == "direct":
+            result = await direct_completion_async(DIRECT_TASKS[kind], inputs, target, session_id)
+        else:
+            result = await kickoff_pooled(target, inputs, session_id)
+    except Exception as e:
+        if not serves_fallback(e):
+            raise
+        return fallback()
+    if result:
+        check_reading_level(result, inputs.get("grade_level"))
+    return result
+
+
+async def moderate_async(passages):
+    """Async counterpart of server.moderate; the verdict cache is read and written on threads."""
+    verdict, verdicts, batches = await asyncio.to_thread(screen_passages, passages)
+    if verdict is not None:
+        return verdict
+    for batch in batches:
+        try:
+            with STAGE_SECONDS.time(stage="moderation"):
+                response = await moderation_upstream.acall(async_client.moderations.create, input=batch)
+        except Exception as e:
+            return moderation_failed(e)
+        await asyncio.to_thread(record_verdicts, batch, response, verdicts)
+    return first_flagged(passages, verdicts)
+
+
+async def moderate_content_async(text):
+    return await moderate_async([text])
+
+
+async def moderate_passages_async(text):
+    """Async counterpart of server.moderate_passages."""
+    return await moderate_async(split_passages(text))
+
+
+def reply(body, status=200, headers=None):
+    """A JSONResponse for one of server.py's (body, status) pairs."""
+    return JSONResponse(body, status_code=status, headers=headers)
+
+
+class ReleaseAfterSend:
+    """Sends response, then calls release(), however sending ended (done, failed or client gone)."""
+
+    def __init__(self, response, release):
+        self.response = response
+        self.release = release
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await self.response(scope, receive, send)
+        finally:
+            self.release()
+
+
+def idempotent(endpoint):
+    """Async counterpart of server.idempotent; shares its store."""
+    @wraps(endpoint)
+    async def wrapper(request):
+        key = request.headers.get('idempotency-key')
+        if not key:
+            return await endpoint(request)
+        if not valid_key(key):
+            return reply({"error": "Invalid Idempotency-Key"}, 400)
+        scoped = f"{request.url.path}:{key}"
+        # Starlette caches the body, so the endpoint can still read it
+        request_fingerprint = fingerprint(request.method, request.url.path, await request.body())
+        try:
+            # Reads the shared store and may wait for a duplicate in flight
+            stored, source = await asyncio.to_thread(idempotency.claim, scoped, request_fingerprint)
+        except KeyReused as e:
+            return reply({"error": str(e)}, 422)
+        except InProgress as e:
+            return reply({"error": str(e)}, 409)
+
+        if stored is not None:
+            IDEMPOTENT_REPLAYS.inc(endpoint=endpoint.__name__, source=source)
+            return Response(stored.body, status_code=stored.status,
+                            headers={'Content-Type': stored.content_type, 'Idempotent-Replayed': 'true'})
+
+        try:
+            response = await endpoint(request)
+        except BaseException:
+            idempotency.abandon(scoped)
+            raise
+        if isinstance(response, StreamingResponse):
+            response.body_iterator = idempotency.arecord_stream(scoped, response.body_iterator, is_done_event)
+            # The body iterator never starts if the client is gone before the first chunk
+            return ReleaseAfterSend(response, idempotency.release_on_close(scoped))
+        await asyncio.to_thread(idempotency.finish, scoped, StoredResponse(
+            response.status_code, response.body, response.headers.get('content-type')))
+        return response
+    return wrapper
+
+
+async def request_user(request):
+    """Async counterpart of server.request_user."""
+    if request.path_params.get('session_id'):
+        return request.path_params['session_id']
+    data = await read_json(request)
+    return data.get('sessionId') if isinstance(data, dict) else None
+
+
+async def release_after(events, slots):
+    try:
+        async for event in events:
+            yield event
+    finally:
+        slots.release()
+
+
+def admitted(kind, slots=None):
+    """Async counterpart of server.admitted."""
+    def decorate(endpoint):
+        @wraps(endpoint)
+        async def wrapper(request):
+            forwarded_for = request.headers.get('x-forwarded-for')
+            ip = client_ip(request.client.host if request.client else None, forwarded_for)
+            try:
+                await rate_limiter.aadmit(kind, user=await request_user(request), ip=ip)
+                if slots is not None:
+                    await slots.aacquire()
+            except (RateLimited, Saturated) as e:
+                return reply(*rejection(e))
+            if slots is None:
+                return await endpoint(request)
+            try:
+                response = await endpoint(request)
+            except BaseException:
+                slots.release()
+                raise
+            if isinstance(response, StreamingResponse):
+                response.body_iterator = release_after(response.body_iterator, slots)
+            else:
+                slots.release()
+            return response
+        return wrapper
+    return decorate
+
+
+async def read_json(request):
+    try:
+        return await request.json()
+    except Exception:
+        return None
+
+
+@idempotent
+@admitted('story', chat_slots)
+async def start_story(request):
+    try:
+        data = await read_json(request)
+        grade_level, story_so_far = turn_request(data)
+        genre = story_genre(data.get('genre'))
+
+        if not story_so_far:
+            starter = await asyncio.to_thread(starter_pool.pop, grade_level, genre)
+            if starter:
+                return reply({"story": starter})
+
+        try:
+            result, is_safe, categories = await run_moderated_turn_async(
+                lambda: story_turn_async(
+                    "start",
+                    partial(turn_inputs, "start", grade_level, story_so_far, genre=genre),
+                    data.get('sessionId'),
+                    fallback=lambda: generate_fallback_story(grade_level, data.get('challenge'), story_so_far)
+                ),
+                story_so_far, moderate_passages_async, moderate_content_async
+            )
+            return reply(*turn_reply(result, is_safe, categories, "No story was generated"))
+        except Exception as e:
+            logger.error("Error generating story: %s", e)
+            logger.error(traceback.format_exc())
+            raise ValueError(f"Failed to generate story: {str(e)}")
+
+    except ValueError as ve:
+        logger.error("Validation error in start_story: %s", ve)
+        return reply({"error": str(ve)}, 400)
+    except Exception as e:
+        logger.error("Error in start_story: %s", e)
+        logger.error(traceback.format_exc())
+        return reply({"error": str(e)}, 500)
+
+
+@idempotent
+@admitted('story', chat_slots)
+async def continue_story(request):
+    try:
+        data = await read_json(request)
+        grade_level, story_so_far = turn_request(data, story_required=True)
+        challenge = data.get('challenge')
+
+        try:
+            result, is_safe, categories = await run_moderated_turn_async(
+                lambda: story_turn_async(
+                    "continue",
+                    partial(turn_inputs, "continue", grade_level, story_so_far, challenge=challenge,
+                            session_id=data.get('sessionId')),
+                    data.get('sessionId'),
+                    fallback=lambda: generate_fallback_story(grade_level, challenge, story_so_far)
+                ),
+                story_so_far, moderate_passages_async, moderate_content_async
+            )
+            return reply(*turn_reply(result, is_safe, categories, "No story continuation was generated"))
+        except Exception as e:
+            logger.error("Error generating continuation: %s", e)
+            logger.error(traceback.format_exc())
+            raise ValueError(f"Failed to generate story continuation: {str(e)}")
+
+    except ValueError as ve:
+        logger.error("Validation error in continue_story: %s", ve)
+        return reply({"error": str(ve)}, 400)
+    except Exception as e:
+        logger.error("Error in continue_story: %s", e)
+        logger.error(traceback.format_exc())
+        return reply({"error": str(e)}, 500)
+
+
+@idempotent
+@admitted('story', chat_slots)
+async def continue_story_stream(request):
+    """Streaming variant of /api/continue-story; same events and moderation as server.py."""
+    data = await read_json(request)
+    try:
+        grade_level, story_so_far = turn_request(data, story_required=True)
+    except ValueError as e:
+        return reply({"error": str(e)}, 400)
+    blocked = prescreen(story_so_far)
+    if blocked:
+        return reply(blocked, 400)
+
+    inputs = {
+        "grade_level": grade_level,
+        "challenge": data.get('challenge'),
+    }
+    return sse_response(continuation_events(inputs, story_so_far, story_so_far, data.get('sessionId')))
+
+
+def sse_response(events):
+    return StreamingResponse(
+        events,
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+
+async def continuation_events(inputs, story_so_far, new_text, session_id=None, on_done=None,
+                              moderate_input=moderate_passages_async):
+    """Async counterpart of server.continuation_events; on_done runs on a thread."""
+    input_check = asyncio.ensure_future(moderate_input(new_text)) if new_text else None
+    turn = StreamedTurn(
+        inputs["grade_level"], session_id, input_check,
+        lambda sentence: asyncio.ensure_future(moderate_content_async(sentence)),
+    )
+    if turn.fallback:
+        tokens = canned_tokens(generate_fallback_story(inputs["grade_level"], inputs.get("challenge"), story_so_far))
+    else:
+        prompt_story = await asyncio.to_thread(story_context.compact, story_so_far, session_id)
+        inputs = dict(inputs, story_so_far=prompt_story)
+        tokens = chat_upstream.aprotect_stream(afirst_sentences(
+            astream_task(async_client, "continue_story", inputs, model=turn.model, timeout=chat_upstream.timeout),
+            STORY_MAX_SENTENCES,
+        ))
+    try:
+        async for token in tokens:
+            for event in turn.feed(token):
+                yield event
+            if turn.stopped:
+                return
+        checks = turn.flush()
+        if checks:
+            await asyncio.wait(checks)
+        events = turn.finish()
+        if turn.result is not None and on_done is not None:
+            await asyncio.to_thread(on_done, turn.result)
+        for event in events:
+            yield event
+    except Exception as e:
+        yield turn.failed(e)
+    finally:
+        await tokens.aclose()
+        turn.close(inputs)
+
+
+async def canned_tokens(text):
+    yield text
+
+
+async def create_session(request):
+    try:
+        grade_level, genre, story = session_request(await read_json(request) or {})
+    except ValueError as e:
+        return reply({"error": str(e)}, 400)
+    if story.strip():
+        is_safe, categories = await moderate_passages_async(story)
+        if not is_safe:
+            return reply({"error": f"Content blocked for safety reasons: {categories}"}, 400)
+    session = await asyncio.to_thread(open_session, grade_level, genre, story)
+    return reply(session.to_dict(include_story=False), 201)
+
+
+async def get_session(request):
+    session = await asyncio.to_thread(sessions.get, request.path_params['session_id'])
+    if session is None:
+        return reply({"error": "Session not found"}, 404)
+    return reply(session.to_dict())
+
+
+async def delete_session(request):
+    session_id = request.path_params['session_id']
+    await asyncio.to_thread(sessions.delete, session_id)
+    story_context.forget(session_id)
+    return Response(status_code=204)
+
+
+@idempotent
+@admitted('story', chat_slots)
+async def append_session_turn(request):
+    """Same contract as server.append_session_turn."""
+    data = await read_json(request) or {}
+    turn = await asyncio.to_thread(session_turn, request.path_params['session_id'], data)
+    if turn is None:
+        return reply({"error": "Session not found"}, 404)
+    session, text, story_so_far = turn
+
+    if not story_so_far:
+        starter = await asyncio.to_thread(session_starter, session)
+        if starter:
+            return reply({"story": starter, "sessionId": session.id})
+    kind = "continue" if story_so_far else "start"
+
+    def generate():
+        return story_turn_async(
+            kind,
+            partial(turn_inputs, kind, session.grade_level, story_so_far, genre=session.genre,
+                    challenge=data.get('challenge'), session_id=session.id),
+            session.id,
+            fallback=lambda: generate_fallback_story(session.grade_level, data.get('challenge'), story_so_far)
+        )
+
+    try:
+        result, is_safe, categories = await run_moderated_turn_async(
+            generate, text, moderate_passages_async, moderate_content_async
+        )
+    except Exception as e:
+        logger.error("Error generating session turn: %s", e)
+        logger.error(traceback.format_exc())
+        return reply({"error": f"Failed to generate story continuation: {str(e)}"}, 500)
+
+    return reply(*await asyncio.to_thread(session_turn_reply, session, text, result, is_safe, categories))
+
+
+@idempotent
+@admitted('story', chat_slots)
+async def stream_session_turn(request):
+    data = await read_json(request) or {}
+    turn = await asyncio.to_thread(session_turn, request.path_params['session_id'], data)
+    if turn is None:
+        return reply({"error": "Session not found"}, 404)
+    session, text, story_so_far = turn
+    refusal = await asyncio.to_thread(session_stream_refusal, session, text, story_so_far)
+    if refusal:
+        return reply(*refusal)
+
+    async def moderate_turn(new_text):
+        is_safe, categories = await moderate_passages_async(new_text)
+        if not is_safe:
+            await asyncio.to_thread(session.flag)
+        return is_safe, categories
+
+    inputs = {
+        "grade_level": session.grade_level,
+        "challenge": data.get('challenge'),
+    }
+    return sse_response(continuation_events(
+        inputs, story_so_far, text, session.id,
+        on_done=lambda result: session.append(text, result),
+        moderate_input=moderate_turn,
+    ))
+
+
+async def render_story_image_async(story):
+    """Async counterpart of server.render_story_image."""
+    prompt = build_image_prompt(story)
+    key = prompt_key(prompt)
+    filename = await asyncio.to_thread(image_cache.lookup, key)
+    if filename:
+        return filename, None
+    result, _ = await image_flights.do(key, generate_and_store_image_async, prompt, story, key)
+    return result
+
+
+async def generate_and_store_image_async(prompt, story, key):
+    filename = await asyncio.to_thread(already_stored, key)
+    if filename:
+        return filename, None
+    try:
+        with STAGE_SECONDS.time(stage="image_generation"):
+            response = await images_upstream.acall(async_client.images.generate, prompt=prompt, **IMAGE_REQUEST)
+    except CircuitOpen:
+        raise
+    except Exception:
+        upstream_error("images")
+        raise
+    # Downloads and writes the image
+    return await asyncio.to_thread(keep_image, response, story, key)
+
+
+image_flights = AsyncSingleFlight()
+
+
+@admitted('image', image_slots)
+async def generate_image(request):
+    try:
+        data = await read_json(request) or {}
+        story = data.get('story', '')
+
+        if not story:
+            return reply({'error': 'Story text is required'}, 400)
+
+        filename, remote_url = await render_story_image_async(story)
+        image_url = remote_url or str(request.url_for('get_image', filename=filename))
+
+        return reply({
+            'success': True,
+            'image_url': image_url,
+            'filename': filename
+        })
+
+    except CircuitOpen as e:
+        return reply({'error': str(e)}, 503, {'Retry-After': str(int(e.retry_after) + 1)})
+    except Exception as e:
+        logger.error("Error generating image: %s", e)
+        return reply({'error': f'Failed to generate image: {str(e)}'}, 500)
+
+
+@admitted('image')
+async def submit_image_job(request):
+    """Queue an image for the story and return immediately with a job id."""
+    data = await read_json(request) or {}
+    story = data.get('story', '')
+    if not story:
+        return reply({'error': 'Story text is required'}, 400)
+    try:
+        job_id = await asyncio.to_thread(image_jobs.submit, story, str(request.base_url), data.get('webhookUrl'))
+    except InvalidWebhook as e:
+        return reply({'error': str(e)}, 400)
+    except QueueFull as e:
+        return reply({'error': str(e)}, 503, {'Retry-After': '10'})
+    return reply({
+        'job_id': job_id,
+        'status': 'queued',
+        'status_url': str(request.url_for('get_image_job', job_id=job_id)),
+    }, 202)
+
+
+async def get_image_job(request):
+    job = await asyncio.to_thread(image_jobs.get, request.path_params['job_id'])
+    if job is None:
+        return reply({'error': 'Job not found'}, 404)
+    return reply(job)
+
+
+async def image_job_events(request):
+    """Push the job's status over Server-Sent Events until it finishes."""
+    job_id = request.path_params['job_id']
+    if await asyncio.to_thread(image_jobs.get, job_id) is None:
+        return reply({'error': 'Job not found'}, 404)
+
+    async def events():
+        watch = JobWatch(job_id)
+        while True:
+            for event in watch.update(await asyncio.to_thread(image_jobs.get, job_id)):
+                yield event
+            if watch.finished:
+                return
+            await asyncio.sleep(watch.POLL_INTERVAL)
+
+    return sse_response(events())
+
+
+async def get_image(request):
+    """Serve generated images with validators and long-lived caching"""
+    filename = request.path_params['filename']
+    path = os.path.join(IMAGES_DIR, filename)
+    if os.path.basename(filename) != filename or not os.path.isfile(path):
+        return reply({'error': 'Not found'}, 404)
+
+    etag = image_etag(path)
+    headers = {
+        'ETag': etag,
+        'Cache-Control': f'public, max-age={IMAGE_MAX_AGE}, immutable',
+    }
+    if etag_matches(request.headers.get('if-none-match'), etag):
+        return Response(status_code=304, headers=headers)
+    # FileResponse streams the file and adds Last-Modified (and Range support on Starlette >= 0.39)
+    return FileResponse(path, headers=headers)
+
+
+async def cache_stats(request):
+    # The starter and verdict stores may count rows in SQLite
+    return reply(await asyncio.to_thread(cache_report))
+
+
+async def usage(request):
+    return reply(usage_report(request.query_params.get('sessionId')))
+
+
+async def metrics(request):
+    return Response(render_metrics(), media_type=METRICS_CONTENT_TYPE)
+
+
+async def health_check(request):
+    return reply(health_report())
+
+
+async def health_live(request):
+    return reply({'status': 'alive'})
+
+
+async def health_ready(request):
+    return reply(*readiness_report())
+
+routes = [
+    Route('/api/start-story', start_story, methods=['POST']),
+    Route('/api/continue-story', continue_story, methods=['POST']),
+    Route('/api/continue-story/stream', continue_story_stream, methods=['POST']),
+    Route('/api/sessions', create_session, methods=['POST']),
+    Route('/api/sessions/{session_id}', get_session, methods=['GET']),
+    Route('/api/sessions/{session_id}', delete_session, methods=['DELETE']),
+    Route('/api/sessions/{session_id}/turns', append_session_turn, methods=['POST']),
+    Route('/api/sessions/{session_id}/turns/stream', stream_session_turn, methods=['POST']),
+    Route('/api/generate-image', generate_image, methods=['POST']),
+    Route('/api/image-jobs', submit_image_job, methods=['POST']),
+    Route('/api/image-jobs/{job_id}', get_image_job, name='get_image_job'),
+    Route('/api/image-jobs/{job_id}/events', image_job_events),
+    Route('/api/images/{filename}', get_image, name='get_image'),
+    Route('/api/cache-stats', cache_stats),
+    Route('/api/usage', usage),
+    Route('/metrics', metrics),
+    Route('/health', health_check),
+    Route('/health/live', health_live),
+    Route('/health/ready', health_ready),
+]
+
+
+def route_name(scope):
+    for route in routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.name
+    return 'unmatched'
+
+
+class RequestContextMiddleware:
+    """Binds the request id for logs, echoes it in X-Request-ID and times the whole response."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        endpoint = route_name(scope)
+        request_id = bind_request(endpoint, Headers(scope=scope).get('x-request-id'))
+        start = time.perf_counter()
+        status = '500'
+
+        async def send_with_request_id(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = str(message['status'])
+                MutableHeaders(scope=message).append('X-Request-ID', request_id)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint, status=status)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    start_background_workers()
+    yield
+    stop_background_workers()
+
+
+app = Starlette(
+    routes=routes,
+    middleware=[
+        Middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"]),
+        Middleware(RequestContextMiddleware),
+    ],
+    lifespan=lifespan,
+)
+
+
+if __name__ == '__main__':
+    import uvicorn
+
+    port = int(os.environ.get('PORT', 5002))
+    logger.info("Starting ASGI server on port %s", port)
+    uvicorn.run(app, host='0.0.0.0', port=port)
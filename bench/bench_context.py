@@ -0,0 +1,92 @@
+"""
+Benchmark: continuation prompt size and latency vs. story length, with and
+without context compaction (N2G/context.py).
+
+Plays a simulated game turn by turn and, at each checkpoint, reports the
+story-so-far tokens that would go into the continue_story prompt, how many
+summarizer calls compaction has made so far, and the time compaction took.
+The summarizer and the generation call use the mock backend unless --live
+is given, in which case both hit OpenAI and the generation latency column
+reflects real prompt-processing cost.
+
+    python bench/bench_context.py
+    python bench/bench_context.py --turns 120 --budget 400
+    OPENAI_API_KEY=... python bench/bench_context.py --live --turns 40
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SENTENCES = [
+    "Pip the little fox followed the glowing path deeper into the whispering woods.",
+    "An old owl named Hoot called down from a crooked branch and asked where she was going.",
+    "Pip explained that the acorn had started humming the moment the moon came up.",
+    "Hoot blinked slowly and said that only one creature in the forest could read a humming acorn.",
+    "Together they crossed a stream on stepping stones that lit up under their paws.",
+    "On the far bank a family of otters was building a raft out of reeds and string.",
+]
+
+
+def build_clients(live):
+    if live:
+        from openai import OpenAI
+        return OpenAI()
+    os.environ.setdefault("STORY_QUEST_BACKEND", "mock")
+    os.environ.setdefault("MOCK_CHAT_LATENCY_MS", "50")
+    from N2G.mock_backend import MockOpenAI
+    return MockOpenAI()
+
+
+def timed_generation(client, story, live):
+    from N2G.direct import render_messages
+    messages = render_messages("continue_story", {"story_so_far": story, "grade_level": "3-5"})
+    start = time.perf_counter()
+    client.chat.completions.create(
+        model="gpt-4-turbo" if live else "mock",
+        messages=messages,
+        max_tokens=120,
+    )
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=80, help="Turns to simulate (two sentences per turn)")
+    parser.add_argument("--every", type=int, default=10, help="Report every N turns")
+    parser.add_argument("--budget", type=int, default=None, help="Token budget (default CONTEXT_TOKEN_BUDGET)")
+    parser.add_argument("--live", action="store_true", help="Use OpenAI for summaries and generation")
+    args = parser.parse_args()
+
+    from N2G.context import ContextCompactor, count_tokens, make_openai_summarizer
+
+    client = build_clients(args.live)
+    compactor = ContextCompactor(make_openai_summarizer(client), token_budget=args.budget)
+
+    print(f"token budget {compactor.token_budget}, keep {compactor.keep_sentences} sentences, "
+          f"summary chunk {compactor.summary_chunk}")
+    print(f"{'turn':>5} {'full tok':>9} {'compact tok':>12} {'summaries':>10} {'compact ms':>11} "
+          f"{'gen full ms':>12} {'gen compact ms':>15}")
+
+    story_lines = []
+    compact_time = 0.0
+    for turn in range(1, args.turns + 1):
+        story_lines.append(" ".join(SENTENCES[(2 * turn + i) % len(SENTENCES)] for i in range(2)))
+        story = "\n".join(story_lines)
+
+        start = time.perf_counter()
+        prompt_story = compactor.compact(story, session_id="bench")
+        compact_time = time.perf_counter() - start
+
+        if turn % args.every == 0 or turn == args.turns:
+            gen_full = timed_generation(client, story, args.live)
+            gen_compact = timed_generation(client, prompt_story, args.live)
+            print(f"{turn:>5} {count_tokens(story):>9} {count_tokens(prompt_story):>12} "
+                  f"{compactor.summary_calls:>10} {compact_time * 1000:>11.1f} "
+                  f"{gen_full * 1000:>12.0f} {gen_compact * 1000:>15.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+Benchmark: story turns on the CrewAI engine vs. the direct chat-completions
+engine (STORY_ENGINE_START / STORY_ENGINE_CONTINUE in server.py).
+
+Runs each task (story starter and continuation) a number of times on each
+engine and reports latency percentiles, tokens per turn and LLM requests per
+turn. With the mock backend (the default) the model itself is a fixed-latency
+stand-in, so the difference is CrewAI's own overhead: crew build, agent
+prompt assembly, output parsing and any extra round trips. The mock chat
+model reports no token usage, so token columns show "-" for the crew; run
+with --live to compare real token counts and costs.
+
+    python bench/bench_engines.py
+    python bench/bench_engines.py --runs 50 --engines direct
+    OPENAI_API_KEY=... python bench/bench_engines.py --live --runs 10
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+STORY = (
+    "Pip the little fox followed the glowing path deeper into the whispering woods.\n"
+    "An old owl named Hoot called down from a crooked branch and asked where she was going.\n"
+)
+
+TASKS = {
+    "start": ("generate_prompt", {"grade_level": "3-5", "genre": "adventure", "story_so_far": ""}),
+    "continue": ("continue_story", {"grade_level": "3-5", "story_so_far": STORY, "challenge": None}),
+}
+
+
+def configure(live):
+    if not live:
+        os.environ.setdefault("STORY_QUEST_BACKEND", "mock")
+        os.environ.setdefault("MOCK_CHAT_LATENCY_MS", "200")
+
+
+def run_direct(task_name, inputs, model, live):
+    from N2G.direct import run_task
+    if live:
+        from openai import OpenAI
+        client = OpenAI()
+    else:
+        from N2G.mock_backend import MockOpenAI
+        client = MockOpenAI()
+
+    def turn():
+        start = time.perf_counter()
+        text, response = run_task(client, task_name, inputs, model=model)
+        usage = getattr(response, "usage", None)
+        tokens = (usage.prompt_tokens, usage.completion_tokens) if usage else None
+        return time.perf_counter() - start, tokens, 1, text
+    return turn
+
+
+def run_crew(task_name, inputs, model, live):
+    from N2G.crew import CrewPool, build_prompt_only_crew, build_continue_only_crew
+    from usage import crew_tokens
+    builder = build_prompt_only_crew if task_name == "generate_prompt" else build_continue_only_crew
+    # Pooled like server.py, so build cost is only paid on the first turn
+    pool = CrewPool(builder, model=model)
+
+    def turn():
+        start = time.perf_counter()
+        crew = pool.acquire()
+        try:
+            before = crew_tokens(crew)
+            requests_before = getattr(getattr(crew, "usage_metrics", None), "successful_requests", 0) or 0
+            output = crew.kickoff(inputs=inputs)
+            after = crew_tokens(crew, output)
+            requests_after = getattr(getattr(crew, "usage_metrics", None), "successful_requests", 0) or 0
+        finally:
+            pool.release(crew)
+        elapsed = time.perf_counter() - start
+        tokens = None
+        if after and any(after):
+            before = before or (0, 0)
+            tokens = (after[0] - before[0], after[1] - before[1])
+        requests = requests_after - requests_before if requests_after else None
+        return elapsed, tokens, requests, str(output)
+    return turn
+
+
+ENGINES = {"crew": run_crew, "direct": run_direct}
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def report(engine, task, results):
+    latencies = [r[0] for r in results]
+    tokens = [r[1] for r in results if r[1] is not None]
+    requests = [r[2] for r in results if r[2] is not None]
+    prompt = f"{statistics.mean(t[0] for t in tokens):>8.0f}" if tokens else f"{'-':>8}"
+    completion = f"{statistics.mean(t[1] for t in tokens):>8.0f}" if tokens else f"{'-':>8}"
+    calls = f"{statistics.mean(requests):>6.1f}" if requests else f"{'-':>6}"
+    print(f"{engine:<7} {task:<9} {len(results):>5} {percentile(latencies, 0.5) * 1000:>8.0f} "
+          f"{percentile(latencies, 0.95) * 1000:>8.0f} {max(latencies) * 1000:>8.0f} "
+          f"{prompt} {completion} {calls}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=20, help="Turns per engine and task")
+    parser.add_argument("--engines", default="crew,direct", help="Comma-separated engines to compare")
+    parser.add_argument("--tasks", default="start,continue", help="Comma-separated tasks (start, continue)")
+    parser.add_argument("--model", default="gpt-4-turbo", help="Model for both engines")
+    parser.add_argument("--live", action="store_true", help="Call OpenAI instead of the mock backend")
+    args = parser.parse_args()
+    configure(args.live)
+
+    print(f"{'engine':<7} {'task':<9} {'runs':>5} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8} "
+          f"{'prompt':>8} {'output':>8} {'calls':>6}")
+    for engine in args.engines.split(","):
+        for task in args.tasks.split(","):
+            task_name, inputs = TASKS[task]
+            try:
+                turn = ENGINES[engine](task_name, inputs, args.model, args.live)
+                results = [turn() for _ in range(args.runs)]
+            except ImportError as e:
+                print(f"{engine:<7} {task:<9} skipped: {e}")
+                continue
+            report(engine, task, results)
+
+
+if __name__ == "__main__":
+    main()
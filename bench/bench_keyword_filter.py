@@ -0,0 +1,71 @@
+"""
+Micro-benchmark: compiled keyword filter vs. the old per-keyword substring scan.
+
+Exits with status 1 if the compiled filter is slower than the old scan on any
+text size, clean or with a keyword at the end.
+
+    python bench/bench_keyword_filter.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from content_filter import KEYWORDS_PATH, KeywordFilter, load_keywords  # noqa: E402
+
+SAFE_PARAGRAPH = (
+    "Pip the little fox found a glowing acorn under the old oak tree. "
+    "When she picked it up, the forest began to hum a secret song, and the air "
+    "made every leaf shimmer with colour as the otters cheered for their friend. "
+)
+
+# Safe sentences the old substring scan rejected
+FALSE_POSITIVES = [
+    "They sailed past the cliffs of Essex.",
+    "The seasons began to change.",
+    "She counted the cumulus clouds.",
+    "The scunthorpe bus was late.",
+    "He ate a shotgun-shaped cookie.",
+]
+
+
+def legacy_contains(text, keywords):
+    text_lower = text.lower()
+    for word in keywords:
+        if word in text_lower:
+            return True, word
+    return False, None
+
+
+def main():
+    keywords = sorted(load_keywords(KEYWORDS_PATH))
+    matcher = KeywordFilter(reload_interval=3600)
+
+    print("False positives (legacy -> compiled):")
+    for sentence in FALSE_POSITIVES:
+        print(f"  {sentence!r}: {legacy_contains(sentence, keywords)[1]} -> {matcher.find(sentence)}")
+    print()
+
+    print(f"{'chars':>8} {'legacy us':>10} {'compiled us':>12} {'speedup':>8}  legacy hit / compiled hit")
+    slower = []
+    for repeats in (1, 10, 100, 1000):
+        # Clean text, and an unsafe word at the very end so both implementations scan the whole story
+        for text in (SAFE_PARAGRAPH * repeats, SAFE_PARAGRAPH * repeats + "Then the dragon tried to kill them."):
+            number = max(5, 2000 // repeats)
+            legacy = min(timeit.repeat(lambda: legacy_contains(text, keywords), number=number, repeat=3)) / number
+            compiled = min(timeit.repeat(lambda: matcher.find(text), number=number, repeat=3)) / number
+            print(
+                f"{len(text):>8} {legacy * 1e6:>10.1f} {compiled * 1e6:>12.1f} {legacy / compiled:>7.1f}x  "
+                f"{legacy_contains(text, keywords)[1]} / {matcher.find(text)}"
+            )
+            if compiled > legacy:
+                slower.append(len(text))
+    if slower:
+        print(f"FAIL: compiled filter slower than the legacy scan at {slower} chars")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,64 @@
+"""
+Benchmark: wall-clock time of the six-agent pipeline, one task at a time vs.
+the dependency-aware parallel executor (N2G/dag.py).
+
+Both modes use the same runner, so the difference is scheduling alone. The
+critical path column is the sum of the slowest task in each dependency
+stage, the floor the parallel mode can approach. Uses the direct engine on
+the mock backend by default; --engine crew runs each task as a CrewAI crew
+and --live calls OpenAI.
+
+    python bench/bench_pipeline.py
+    python bench/bench_pipeline.py --runs 5 --latency-ms 800
+    OPENAI_API_KEY=... python bench/bench_pipeline.py --live --runs 3
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+INPUTS = {
+    "grade_level": "3-5",
+    "genre": "adventure",
+    "story_so_far": "Pip the little fox followed the glowing path deeper into the whispering woods.",
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=3, help="Pipeline runs per mode")
+    parser.add_argument("--engine", choices=("direct", "crew"), default="direct")
+    parser.add_argument("--latency-ms", type=int, default=300, help="Mock chat latency per call")
+    parser.add_argument("--live", action="store_true", help="Call OpenAI instead of the mock backend")
+    args = parser.parse_args()
+    if not args.live:
+        os.environ.setdefault("STORY_QUEST_BACKEND", "mock")
+        os.environ.setdefault("MOCK_CHAT_LATENCY_MS", str(args.latency_ms))
+
+    from N2G.dag import DagExecutor, crew_runner, direct_runner, levels, task_graph
+    from N2G.main import direct_client
+
+    runner = direct_runner(direct_client()) if args.engine == "direct" else crew_runner()
+    stages = levels(task_graph())
+    print("stages: " + " -> ".join("[" + ", ".join(stage) + "]" for stage in stages))
+    print(f"{'mode':<10} {'runs':>5} {'mean s':>8} {'min s':>8} {'critical path s':>16} {'failed':>7}")
+    for mode, workers in (("serial", 1), ("parallel", None)):
+        executor = DagExecutor(runner, max_workers=workers)
+        times = []
+        paths = []
+        failed = 0
+        for _ in range(args.runs):
+            start = time.perf_counter()
+            results = executor.run(INPUTS)
+            times.append(time.perf_counter() - start)
+            paths.append(sum(max(results[name].seconds for name in stage) for stage in stages))
+            failed += sum(1 for r in results.values() if r.error is not None)
+        print(f"{mode:<10} {args.runs:>5} {statistics.mean(times):>8.2f} {min(times):>8.2f} "
+              f"{statistics.mean(paths):>16.2f} {failed:>7}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Benchmark: cold-start cost of importing the server, the time a new worker
+spends before it can bind its port.
+
+Each run imports the module in a fresh interpreter under `python -X importtime`
+and reports the wall-clock time, the slowest imports, and whether any of the
+heavy dependencies that are meant to load on first use (crewai, langchain,
+tiktoken) were imported anyway. Uses the mock backend so no API key is needed.
+The pass/fail check on the same numbers is tests/test_startup.py; use this to
+see which import got slower.
+
+    python bench/bench_startup.py
+    python bench/bench_startup.py --module asgi --runs 5 --top 15
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Imported on first use (N2G/crew.py, N2G/context.py), never at startup
+DEFERRED = ("crewai", "crewai_tools", "langchain_openai", "langchain_core", "tiktoken")
+
+PROBE = (
+    "import importlib, sys; importlib.import_module(sys.argv[1]); "
+    "print(','.join(sorted({{m.split('.')[0] for m in sys.modules}} & set({deferred!r}))))"
+)
+
+
+def import_once(module):
+    """Import module in a new interpreter; returns (seconds, importtime rows, deferred modules loaded)."""
+    env = dict(os.environ, STORY_QUEST_BACKEND=os.environ.get("STORY_QUEST_BACKEND", "mock"))
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", PROBE.format(deferred=DEFERRED), module],
+        cwd=ROOT, env=env, capture_output=True, text=True,
+    )
+    seconds = time.perf_counter() - start
+    if proc.returncode != 0:
+        errors = [line for line in proc.stderr.splitlines() if not line.startswith("import time:")]
+        raise SystemExit(f"import {module} failed:\n" + "\n".join(errors[-20:]))
+    rows = []
+    for line in proc.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        rows.append((int(cumulative), name.rstrip()))
+    loaded = [m for m in proc.stdout.strip().split(",") if m]
+    return seconds, rows, loaded
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="server", help="Module to import (default server)")
+    parser.add_argument("--runs", type=int, default=3, help="Fresh interpreters to time")
+    parser.add_argument("--top", type=int, default=10, help="Slowest top-level imports to list")
+    args = parser.parse_args()
+
+    results = [import_once(args.module) for _ in range(args.runs)]
+    times = [seconds for seconds, _, _ in results]
+    _, rows, loaded = results[-1]
+
+    print(f"import {args.module}: median {statistics.median(times):.2f}s, "
+          f"min {min(times):.2f}s over {args.runs} runs")
+    # Top-level imports only (no leading indent), so nested ones are not counted twice
+    top_level = sorted((row for row in rows if not row[1].startswith("  ")), reverse=True)
+    print(f"{'cumulative ms':>14}  module")
+    for cumulative, name in top_level[:args.top]:
+        print(f"{cumulative / 1000:>14.1f}  {name.strip()}")
+    if loaded:
+        print(f"deferred dependencies imported at startup: {', '.join(loaded)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Benchmark: grade-level analysis of many stories (text_analysis.py), one
+analyze() call per text vs. one analyze_batch() call for the whole list.
+
+Builds --stories synthetic stories from a mix of easy and harder sentences,
+scores them against a grade both ways, checks that the two agree, and
+reports stories per second and how the batch fits the grade.
+
+    python bench/bench_text_analysis.py
+    python bench/bench_text_analysis.py --stories 50000 --grade 6-8
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SENTENCES = [
+    "The cat ran to the big red box and sat down.",
+    "Pip the little fox followed the glowing path deeper into the whispering woods.",
+    "An old owl named Hoot called down from a crooked branch.",
+    "The mysterious expedition discovered an extraordinary civilization beneath the glacier.",
+    "Despite the treacherous conditions, the determined explorers persevered through the night.",
+    "We had fun and it was a good day.",
+]
+
+
+def make_stories(count, seed=7):
+    rng = random.Random(seed)
+    return [" ".join(rng.choice(SENTENCES) for _ in range(rng.randint(2, 8))) for _ in range(count)]
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--stories", type=int, default=5000, help="Stories to analyze")
+    parser.add_argument("--grade", default="3-5", help="Grade level to score against")
+    args = parser.parse_args()
+
+    from text_analysis import text_analyzer
+
+    stories = make_stories(args.stories)
+    # Compile the grade tables before timing anything
+    text_analyzer.analyze_batch(stories[:10], args.grade)
+
+    single_seconds, single = timed(lambda: [text_analyzer.analyze(text, args.grade) for text in stories])
+    batch_seconds, batch = timed(lambda: text_analyzer.analyze_batch(stories, args.grade))
+
+    for field in ("words", "sentences", "syllables", "vocabulary_points", "grade_fit"):
+        assert list(batch[field]) == [getattr(stats, field) for stats in single], field
+
+    print(f"{args.stories} stories, grade {args.grade}")
+    print(f"{'method':<22}{'seconds':>10}{'stories/s':>12}")
+    for name, seconds in (("analyze() per text", single_seconds), ("analyze_batch()", batch_seconds)):
+        print(f"{name:<22}{seconds:>10.3f}{args.stories / seconds:>12.0f}")
+    fits = {}
+    for fit in batch["grade_fit"]:
+        fits[fit] = fits.get(fit, 0) + 1
+    print("grade fit: " + ", ".join(f"{fit} {count}" for fit, count in sorted(fits.items())))
+
+
+if __name__ == "__main__":
+    main()
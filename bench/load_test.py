@@ -0,0 +1,157 @@
+"""
+Load test for the Flask story API.
+
+By default this starts server.py in-process against the mock backend
+(STORY_QUEST_BACKEND=mock, see N2G/mock_backend.py) so no OpenAI calls are
+made, then drives each endpoint at increasing concurrency and prints latency
+percentiles and throughput. Point it at a running server with --url instead.
+
+Every request comes from the same IP and user, so the in-process server runs
+with the rate limits (ratelimit.py) turned off; otherwise the per-user and
+per-IP buckets would reject nearly all of them with 429 and the numbers would
+measure the limiter. Set RATE_LIMIT_<KIND>_<SCOPE> to benchmark with a limit
+on. A server started separately and tested with --url keeps its own limits.
+
+Images are cached by content (image_store.py), so the image benchmark is
+reported twice: "image" sends a different story with every request, so each
+one generates an image (cold), and "image-warm" repeats one story after a
+priming request, so each one is a cache hit.
+
+    python bench/load_test.py
+    python bench/load_test.py --concurrency 1,8,32 --requests 200
+    MOCK_CHAT_LATENCY_MS=2000 python bench/load_test.py --endpoints continue
+    python bench/load_test.py --url http://localhost:5002
+"""
+import argparse
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+STORY = (
+    "Pip the little fox found a glowing acorn under the old oak tree. "
+    "When she picked it up, the forest began to hum a secret song."
+)
+
+# Unique across runs too, so a second run against the same server is still cold
+RUN_ID = uuid.uuid4().hex[:8]
+_request_ids = itertools.count()
+
+
+def varied(payload, field):
+    """A payload factory that makes field unique per request, so no request hits the server's caches."""
+    def make():
+        return dict(payload, **{field: f"{payload[field]} (load test {RUN_ID}-{next(_request_ids)})"})
+    return make
+
+
+ENDPOINTS = {
+    "start": ("/api/start-story", {"gradeLevel": "3-5", "storySoFar": ""}),
+    "continue": ("/api/continue-story", {"gradeLevel": "3-5", "storySoFar": STORY, "challenge": "Use a color"}),
+    "image": ("/api/generate-image", varied({"story": STORY}, "story")),
+    "image-warm": ("/api/generate-image", {"story": STORY}),
+}
+# Sent once before timing, so every timed request finds the result cached
+PRIMED = {"image-warm"}
+
+
+def start_local_server():
+    os.environ.setdefault("STORY_QUEST_BACKEND", "mock")
+    for kind in ("STORY", "IMAGE"):
+        for scope in ("USER", "IP", "GLOBAL"):
+            os.environ.setdefault(f"RATE_LIMIT_{kind}_{scope}", "off")
+    sys.path.insert(0, ROOT)
+    os.chdir(ROOT)
+    from werkzeug.serving import make_server
+    import server
+
+    httpd = make_server("127.0.0.1", 0, server.app, threaded=True)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{httpd.server_port}"
+
+
+def post(url, payload, timeout):
+    body = json.dumps(payload).encode("utf-8")
+    req = urllib.request.Request(url, data=body, headers={"Content-Type": "application/json"})
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            resp.read()
+            ok = 200 <= resp.status < 300
+    except urllib.error.HTTPError as e:
+        e.read()
+        ok = False
+    except Exception:
+        ok = False
+    return time.perf_counter() - start, ok
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def run_level(url, payload, concurrency, total, timeout):
+    make = payload if callable(payload) else lambda: payload
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        start = time.perf_counter()
+        results = list(pool.map(lambda _: post(url, make(), timeout), range(total)))
+        elapsed = time.perf_counter() - start
+    latencies = sorted(latency for latency, _ in results)
+    errors = sum(1 for _, ok in results if not ok)
+    return {
+        "concurrency": concurrency,
+        "requests": total,
+        "errors": errors,
+        "rps": total / elapsed if elapsed else 0.0,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="Base URL of a running server (default: start one in-process)")
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS), help=f"Comma-separated subset of {','.join(ENDPOINTS)}")
+    parser.add_argument("--concurrency", default="1,4,16,64", help="Comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=0, help="Requests per level (default: 4x concurrency, min 20)")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--json", action="store_true", help="Print results as JSON lines")
+    args = parser.parse_args()
+
+    base_url = args.url.rstrip("/") if args.url else start_local_server()
+    levels = [int(c) for c in args.concurrency.split(",") if c]
+
+    if not args.json:
+        print(f"Target: {base_url}")
+        print(f"{'endpoint':<10} {'conc':>5} {'reqs':>6} {'err':>5} {'rps':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for name in [e.strip() for e in args.endpoints.split(",") if e.strip()]:
+        path, payload = ENDPOINTS[name]
+        if name in PRIMED:
+            post(base_url + path, payload, args.timeout)
+        for concurrency in levels:
+            total = args.requests or max(20, concurrency * 4)
+            stats = run_level(base_url + path, payload, concurrency, total, args.timeout)
+            stats["endpoint"] = name
+            if args.json:
+                print(json.dumps(stats))
+            else:
+                print(
+                    f"{name:<10} {stats['concurrency']:>5} {stats['requests']:>6} {stats['errors']:>5} "
+                    f"{stats['rps']:>8.1f} {stats['p50'] * 1000:>8.0f} {stats['p95'] * 1000:>8.0f} {stats['p99'] * 1000:>8.0f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""
+Built-in keyword filter run before the moderation API.
+
+The keyword list lives in N2G/config/prohibited_keywords.yaml and is compiled
+into a set of every accepted word form. A check lowercases the text and splits
+it into letter runs in one pass, then intersects them with that set, so its
+cost depends on the text length only, not on the number of keywords, and only
+whole words match. Keywords listed under `inflected` also match their regular
+endings ("rape" -> "raping", "stab" -> "stabbing"); every other form has to be
+listed. The file is re-read when it changes.
+"""
+import logging
+import os
+import re
+import threading
+import time
+
+import yaml
+
+logger = logging.getLogger(__name__)
+
+KEYWORDS_PATH = os.path.join(os.path.dirname(__file__), "N2G", "config", "prohibited_keywords.yaml")
+
+# Section naming the keywords that also match their regular endings
+INFLECTED_SECTION = "inflected"
+SUFFIXES = ("s", "es", "d", "ed", "ing", "er", "ers")
+# Endings that drop a final "e" ("strangle" -> "strangling") or double a final consonant ("stab" -> "stabbing")
+RESPELLED_SUFFIXES = ("ing", "ed", "er", "ers")
+VOWELS = "aeiou"
+
+# Lowercases ASCII letters and turns every other byte into a space, so split() yields the words
+_WORD_BYTES = bytes(
+    c if 97 <= c <= 122 else c + 32 if 65 <= c <= 90 else 32
+    for c in range(256)
+)
+
+
+def load_categories(path):
+    with open(path, "r") as f:
+        raw = yaml.safe_load(f) or {}
+    return {
+        category: {w.strip().lower() for w in words or [] if w and w.strip()}
+        for category, words in raw.items()
+    }
+
+
+def load_keywords(path):
+    keywords = set()
+    for words in load_categories(path).values():
+        keywords.update(words)
+    return keywords
+
+
+def inflections(keyword):
+    """keyword with each regular ending, including the usual spelling changes."""
+    stems = [(keyword, SUFFIXES)]
+    if keyword.endswith("e") and not keyword.endswith("ee"):
+        stems.append((keyword[:-1], RESPELLED_SUFFIXES))
+    elif (
+        len(keyword) >= 3
+        and keyword[-1] not in VOWELS + "wxy"
+        and keyword[-2] in VOWELS
+        and keyword[-3] not in VOWELS
+    ):
+        stems.append((keyword + keyword[-1], RESPELLED_SUFFIXES))
+    return [stem + suffix for stem, suffixes in stems for suffix in suffixes]
+
+
+def compile_keywords(keywords, inflected=()):
+    """Map every accepted form of each keyword back to the keyword itself."""
+    forms = {}
+    # Longest first so, among inflections, the shorter keyword's form wins; listed words are set last
+    for keyword in sorted(inflected, key=len, reverse=True):
+        for form in inflections(keyword):
+            forms[form] = keyword
+    for keyword in keywords:
+        forms[keyword] = keyword
+    return forms
+
+
+def split_words(text):
+    """The lowercase ASCII letter runs of text, as bytes."""
+    return text.encode("utf-8").translate(_WORD_BYTES).split()
+
+
+class Compiled:
+    """Lookup tables for one version of the keyword file."""
+
+    def __init__(self, forms):
+        self.forms = forms
+        words = {form: keyword for form, keyword in forms.items() if form.isalpha()}
+        self.words = {form.encode("ascii"): keyword for form, keyword in words.items()}
+        self.word_set = frozenset(self.words)
+        # Keywords such as "self-harm" span several words: found by a regex, run only when their first word occurs
+        phrases = sorted((form for form in forms if not form.isalpha()), key=len, reverse=True)
+        self.phrase_starts = frozenset(split_words(phrase)[0] for phrase in phrases)
+        self.phrase_re = re.compile(
+            r"\b(?:%s)\b" % "|".join(r"[\W_]+".join(map(re.escape, re.split(r"[^a-z]+", p))) for p in phrases)
+        ) if phrases else None
+
+
+class KeywordFilter:
+    """Whole-word matcher over the prohibited keyword list, hot-reloaded from disk."""
+
+    def __init__(self, path=KEYWORDS_PATH, reload_interval=None):
+        self.path = path
+        self.reload_interval = float(
+            reload_interval if reload_interval is not None else os.getenv("KEYWORDS_RELOAD_INTERVAL", "2.0")
+        )
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._checked_at = 0.0
+        self._compiled = Compiled({})
+        self._reload()
+
+    def _reload(self):
+        mtime = os.path.getmtime(self.path)
+        categories = load_categories(self.path)
+        inflected = categories.get(INFLECTED_SECTION, set())
+        keywords = set().union(*categories.values())
+        self._compiled, self._mtime = Compiled(compile_keywords(keywords, inflected)), mtime
+        logger.info("Loaded prohibited keywords from %s", self.path)
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if now - self._checked_at < self.reload_interval:
+            return
+        with self._lock:
+            if now - self._checked_at < self.reload_interval:
+                return
+            self._checked_at = now
+            try:
+                if os.path.getmtime(self.path) != self._mtime:
+                    self._reload()
+            except Exception as e:
+                # Keep serving the last good list if the file is mid-edit or broken
+                logger.error("Failed to reload prohibited keywords: %s", e)
+
+    def find(self, text):
+        """Return the first prohibited keyword in text, or None."""
+        self._maybe_reload()
+        compiled = self._compiled
+        words = split_words(text)
+        hits = {word.decode("ascii"): compiled.words[word] for word in compiled.word_set.intersection(words)}
+        if compiled.phrase_re is not None and not compiled.phrase_starts.isdisjoint(words):
+            for match in compiled.phrase_re.finditer(text.lower()):
+                phrase = re.sub(r"[\W_]+", "-", match.group())
+                hits[match.group()] = compiled.forms.get(phrase, phrase)
+        if not hits:
+            return None
+        if len(hits) == 1:
+            return next(iter(hits.values()))
+        # Report the first offending word in reading order
+        text_lower = text.lower()
+        positions = [re.search(r"\b%s\b" % re.escape(hit), text_lower).start() for hit in hits]
+        return hits[min(zip(positions, hits))[1]]
+
+
+keyword_filter = KeywordFilter()
@@ -0,0 +1,22 @@
+"""
+Canned story text for when the model cannot (or should not) be called.
+"""
+
+FALLBACK_STARTER = "Once upon a time, there was a magical forest. The trees whispered secrets to anyone who would listen."
+FALLBACK_CONTINUATION = "The forest creatures gathered to hear the trees' stories. They learned about the magic that lived in their home."
+
+
+def generate_fallback_story(grade_level, challenge, story_so_far=None):
+    """Generate a fallback story if OpenAI API fails."""
+    if not story_so_far:
+        # Return a simple starter
+        return FALLBACK_STARTER
+    else:
+        # Return a simple continuation
+        return FALLBACK_CONTINUATION
+
+
+def is_fallback_story(text):
+    """True for canned text (or a sentence of it), which never needs moderating."""
+    text = text.strip()
+    return bool(text) and any(text in story for story in (FALLBACK_STARTER, FALLBACK_CONTINUATION))
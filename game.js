@@ -17,7 +17,9 @@ let gameState = {
     userWords: 0,
     userProfile: null,
     xp: 0,
-    userSentenceCount: 0 // NEW: track only user turns
+    userSentenceCount: 0, // NEW: track only user turns
+    sessionId: null, // server-side story session
+    syncedLength: 0 // how much of gameState.story the session already has
 };
 
 // Story challenges by grade level
@@ -427,18 +429,8 @@ async function endGame() {
             // Prepare the story text for image generation
             const storyText = gameState.story;
             
-            // Call the Flask backend to generate image
-            const response = await fetch('http://localhost:5002/api/generate-image', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                },
-                body: JSON.stringify({
-                    story: storyText
-                })
-            });
-            
-            const data = await response.json();
+            // Queue the image on the Flask backend and wait for the job to finish
+            const data = await requestStoryImage(storyText);
             
             if (data.success && data.image_url) {
                 // Display the generated image
@@ -589,6 +581,35 @@ async function endGame() {
 }
 
 // Game functions
+// Submit an image job and poll until it is done.
+// The server answers the submit immediately, so no HTTP worker waits on DALL-E.
+async function requestStoryImage(storyText) {
+    const submitResponse = await fetch('http://localhost:5002/api/image-jobs', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({
+            story: storyText
+        })
+    });
+    const job = await submitResponse.json();
+    if (!submitResponse.ok) {
+        throw new Error(job.error || `HTTP error! status: ${submitResponse.status}`);
+    }
+    
+    const deadline = Date.now() + 3 * 60 * 1000;
+    while (Date.now() < deadline) {
+        await new Promise(resolve => setTimeout(resolve, 2000));
+        const statusResponse = await fetch(job.status_url);
+        const status = await statusResponse.json();
+        if (status.status === 'done' || status.status === 'failed') {
+            return status;
+        }
+    }
+    throw new Error('Image generation timed out');
+}
+
 async function startGame() {
     if (gameState.gameStarted) return;
     
@@ -596,6 +617,7 @@ async function startGame() {
     gameState.sentenceCount = 0;
     gameState.story = '';
     gameState.storyLines = [];
+    resetStorySession();
     gameState.completedChallenges = [];
     gameState.points = 0;
     gameState.words = 0;
@@ -630,6 +652,163 @@ async function startGame() {
     await getAIResponse();
 }
 
+// One key per story turn. Retries of the turn resend it, so the server replays
+// (or waits for) the first attempt instead of generating the turn twice.
+function newIdempotencyKey() {
+    if (window.crypto && crypto.randomUUID) return crypto.randomUUID();
+    return Date.now().toString(36) + '-' + Math.random().toString(36).slice(2);
+}
+
+// Retry a request that failed on the network (or at a gateway), e.g. on flaky classroom Wi-Fi,
+// or that the server turned away as busy. A short Retry-After from the server is honoured;
+// a longer one (a rate limit) is shown to the player instead of waited out.
+async function withNetworkRetry(request, retries = 2) {
+    for (let attempt = 0; ; attempt++) {
+        try {
+            return await request();
+        } catch (error) {
+            const transient = !error.status || [429, 502, 503, 504].includes(error.status);
+            const delay = error.retryAfter ? error.retryAfter * 1000 : 1000 * (attempt + 1);
+            if (!transient || attempt >= retries || delay > 5000) throw error;
+            console.warn(`Request failed (${error.message}), retrying`);
+            await new Promise(resolve => setTimeout(resolve, delay));
+        }
+    }
+}
+
+// Stream a continuation from the server over Server-Sent Events.
+// Tokens are shown in a provisional paragraph that is removed once the
+// final (moderated) text arrives, or if the server blocks the continuation.
+async function streamStoryContinuation(url, payload, idempotencyKey) {
+    const response = await fetch(url, {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+            'Accept': 'text/event-stream',
+            'Idempotency-Key': idempotencyKey
+        },
+        body: JSON.stringify(payload)
+    });
+    
+    if (!response.ok || !response.body) {
+        const errorData = await response.json().catch(() => ({ error: 'Unknown error' }));
+        console.error('Server error response:', errorData);
+        const error = new Error(errorData.error || `HTTP error! status: ${response.status}`);
+        error.status = response.status;
+        error.retryAfter = Number(response.headers.get('Retry-After')) || 0;
+        throw error;
+    }
+    
+    const storyDisplay = document.getElementById('story-display');
+    const pending = document.createElement('p');
+    pending.className = 'ai-pending';
+    pending.textContent = '🤖 AI: ';
+    if (storyDisplay) storyDisplay.appendChild(pending);
+    
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    try {
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                const rawEvent = buffer.slice(0, boundary);
+                buffer = buffer.slice(boundary + 2);
+                
+                let eventName = 'message';
+                let eventData = '';
+                rawEvent.split('\n').forEach(line => {
+                    if (line.startsWith('event:')) eventName = line.slice(6).trim();
+                    else if (line.startsWith('data:')) eventData += line.slice(5).trim();
+                });
+                const parsed = eventData ? JSON.parse(eventData) : {};
+                
+                if (eventName === 'token') {
+                    pending.textContent += parsed.token;
+                } else if (eventName === 'done') {
+                    return { story: parsed.story };
+                } else if (eventName === 'error') {
+                    return { error: parsed.error };
+                }
+            }
+        }
+        throw new Error('Story stream ended unexpectedly');
+    } finally {
+        pending.remove();
+        reader.cancel().catch(() => {});
+    }
+}
+
+// The server keeps the story in a session, so each turn only sends the text
+// added since the last sync instead of the whole story.
+async function ensureStorySession() {
+    if (gameState.sessionId) return gameState.sessionId;
+    
+    const response = await fetch('http://localhost:5002/api/sessions', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+            'Accept': 'application/json'
+        },
+        body: JSON.stringify({
+            gradeLevel: gameState.gradeLevel,
+            storySoFar: gameState.story
+        })
+    });
+    const data = await response.json().catch(() => ({ error: 'Unknown error' }));
+    if (!response.ok) {
+        throw new Error(data.error || `HTTP error! status: ${response.status}`);
+    }
+    
+    gameState.sessionId = data.sessionId;
+    gameState.syncedLength = gameState.story.length;
+    return gameState.sessionId;
+}
+
+function resetStorySession() {
+    gameState.sessionId = null;
+    gameState.syncedLength = 0;
+}
+
+async function requestSessionTurn(isStart, idempotencyKey) {
+    const sessionId = await ensureStorySession();
+    const turnUrl = `http://localhost:5002/api/sessions/${sessionId}/turns`;
+    const payload = {
+        text: gameState.story.slice(gameState.syncedLength),
+        challenge: gameState.currentChallenge
+    };
+    
+    if (!isStart) {
+        // Stream the continuation so the first words show up as soon as they are generated
+        return streamStoryContinuation(`${turnUrl}/stream`, payload, idempotencyKey);
+    }
+    
+    const response = await fetch(turnUrl, {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+            'Accept': 'application/json',
+            'Idempotency-Key': idempotencyKey
+        },
+        body: JSON.stringify(payload)
+    });
+    
+    if (!response.ok) {
+        const errorData = await response.json().catch(() => ({ error: 'Unknown error' }));
+        console.error('Server error response:', errorData);
+        const error = new Error(errorData.error || `HTTP error! status: ${response.status}`);
+        error.status = response.status;
+        error.retryAfter = Number(response.headers.get('Retry-After')) || 0;
+        throw error;
+    }
+    
+    return response.json();
+}
+
 async function getAIResponse() {
     try {
         // Ensure we're in AI's turn
@@ -650,34 +829,23 @@ async function getAIResponse() {
         
         console.log('Sending request with:', {
             gradeLevel: gameState.gradeLevel,
-            storySoFar: gameState.story,
+            newText: gameState.story.slice(gameState.syncedLength),
             challenge: gameState.currentChallenge
         });
         
         // Determine if this is the start of the story or a continuation
         const isStart = !gameState.story || gameState.story.trim() === '';
-        const endpoint = isStart ? '/api/start-story' : '/api/continue-story';
         
-        const response = await fetch(`http://localhost:5002${endpoint}`, {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-                'Accept': 'application/json'
-            },
-            body: JSON.stringify({
-                gradeLevel: gameState.gradeLevel,
-                storySoFar: gameState.story,
-                challenge: gameState.currentChallenge
-            })
-        });
-        
-        if (!response.ok) {
-            const errorData = await response.json().catch(() => ({ error: 'Unknown error' }));
-            console.error('Server error response:', errorData);
-            throw new Error(errorData.error || `HTTP error! status: ${response.status}`);
+        const turnKey = newIdempotencyKey();
+        let data;
+        try {
+            data = await withNetworkRetry(() => requestSessionTurn(isStart, turnKey));
+        } catch (error) {
+            if (error.status !== 404) throw error;
+            // The server no longer has the session; start a new one from our copy of the story
+            resetStorySession();
+            data = await withNetworkRetry(() => requestSessionTurn(isStart, turnKey));
         }
-        
-        const data = await response.json();
         console.log('Received data:', data);
         
         if (data.error) {
@@ -685,6 +853,7 @@ async function getAIResponse() {
         }
         
         addToStory(data.story, true);
+        gameState.syncedLength = gameState.story.length;
         // Do NOT increment gameState.sentenceCount here
         // updateSentenceCount();
         
@@ -719,6 +888,8 @@ async function getAIResponse() {
             stack: error.stack
         });
         alert('Error getting AI response: ' + error.message);
+        // The server may not have kept this turn; resend the whole story next time
+        resetStorySession();
         
         // Re-enable input and submit button on error
         const input = document.getElementById('story-input');
@@ -1409,6 +1580,7 @@ function startNewGame() {
     gameState.userSentenceCount = 0;
     gameState.story = '';
     gameState.storyLines = [];
+    resetStorySession();
     gameState.completedChallenges = [];
     gameState.points = 0;
     gameState.words = 0;
@@ -1884,6 +2056,7 @@ function loadStoryFromText(storyText) {
     // Reset game state as for a new game
     gameState.story = storyText;
     gameState.storyLines = [];
+    resetStorySession();
     gameState.points = 0;
     gameState.words = 0;
     gameState.userWords = 0;
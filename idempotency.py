@@ -0,0 +1,316 @@
+"""
+Idempotency-Key support for story turns.
+
+A client that retries a request (after a timeout on flaky Wi-Fi, say) sends
+the same Idempotency-Key header again. While the first request is still
+running, duplicates wait for it and share its response instead of starting
+another crew kickoff; once it has finished, its response is replayed from a
+short-lived cache. Only successes and deterministic client errors are stored:
+server errors and "try again later" answers (429 from the rate limiter, 503,
+408, 409, 425) are not, so retries of those run again once the client has
+waited out their Retry-After.
+
+A key is tied to the route and request body it was first used with; reusing
+it for a different request is rejected. In-flight requests are tracked per
+process, so a retry only waits for a request served by the same worker.
+Finished responses are also written to IDEMPOTENCY_PATH when it is set, so
+any worker process on the host can replay them.
+
+    IDEMPOTENCY_TTL           seconds a finished response is replayed (default 600)
+    IDEMPOTENCY_MAX_ENTRIES   finished responses kept in memory (default 10000)
+    IDEMPOTENCY_WAIT          seconds a duplicate waits for the first request (default 120)
+    IDEMPOTENCY_PATH          optional SQLite file shared across workers
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+_KEY_RE = re.compile(r"^[A-Za-z0-9._:-]{1,128}$")
+
+StoredResponse = namedtuple("StoredResponse", ["status", "body", "content_type"])
+
+# 4xx answers that depend on timing rather than on the request, so a retry can succeed
+RETRYABLE_STATUSES = frozenset({408, 409, 425, 429})
+
+IDEMPOTENT_REPLAYS = Counter(
+    "storyquest_idempotent_replays_total",
+    "Requests answered from another request with the same Idempotency-Key.",
+    ["endpoint", "source"],
+)
+
+
+class KeyReused(Exception):
+    """The Idempotency-Key was already used for a different request."""
+
+
+class InProgress(Exception):
+    """A duplicate gave up waiting for the request it repeats."""
+
+
+class _Flight:
+    def __init__(self, fingerprint):
+        self.fingerprint = fingerprint
+        self.done = threading.Event()
+        self.response = None
+
+
+def storable(response):
+    """Whether response may be replayed for later requests with the same key."""
+    return (response is not None and 200 <= response.status < 500
+            and response.status not in RETRYABLE_STATUSES)
+
+
+def valid_key(key):
+    return bool(key) and _KEY_RE.match(key) is not None
+
+
+def fingerprint(method, path, body):
+    digest = hashlib.sha256()
+    for part in (method.encode(), path.encode(), body or b""):
+        digest.update(part)
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class SQLiteResponseStore:
+    """Finished responses in a SQLite file, one connection per thread."""
+
+    PURGE_EVERY = 500
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._writes = 0
+        self._connect().execute(
+            "CREATE TABLE IF NOT EXISTS idempotent_responses ("
+            " key TEXT PRIMARY KEY, fingerprint TEXT, status INTEGER NOT NULL, body BLOB NOT NULL,"
+            " content_type TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        # A connection must not be used on both sides of a fork (serve.py preloads the app)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key, now):
+        """(fingerprint, StoredResponse, expires_at) for key, or None."""
+        row = self._connect().execute(
+            "SELECT fingerprint, status, body, content_type, expires_at FROM idempotent_responses"
+            " WHERE key = ? AND expires_at > ?",
+            (key, now),
+        ).fetchone()
+        if row is None:
+            return None
+        return row[0], StoredResponse(row[1], bytes(row[2]), row[3]), row[4]
+
+    def put(self, key, fingerprint, response, expires_at):
+        conn = self._connect()
+        conn.execute(
+            "INSERT OR REPLACE INTO idempotent_responses"
+            " (key, fingerprint, status, body, content_type, expires_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (key, fingerprint, response.status, response.body, response.content_type, expires_at),
+        )
+        self._writes += 1
+        if self._writes % self.PURGE_EVERY == 0:
+            conn.execute("DELETE FROM idempotent_responses WHERE expires_at <= ?", (time.time(),))
+
+
+class IdempotencyStore:
+    """In-flight requests and recently finished responses, by idempotency key."""
+
+    def __init__(self, ttl=None, max_entries=None, wait=None, path=None):
+        self.ttl = float(ttl or os.getenv("IDEMPOTENCY_TTL", "600"))
+        self.max_entries = int(max_entries or os.getenv("IDEMPOTENCY_MAX_ENTRIES", "10000"))
+        self.wait_timeout = float(wait or os.getenv("IDEMPOTENCY_WAIT", "120"))
+        path = path or os.getenv("IDEMPOTENCY_PATH")
+        self._store = SQLiteResponseStore(path) if path else None
+        self._lock = threading.Lock()
+        self._flights = {}
+        # key -> (fingerprint, StoredResponse, expires_at)
+        self._done = OrderedDict()
+
+    def begin(self, key, fingerprint):
+        """
+        Claim key for a request. Returns (stored, flight):
+
+        stored is a finished response to replay; flight is an earlier request
+        still running, to wait() on. (None, None) means the caller runs the
+        request itself and must call finish() or abandon() when it ends.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._done.get(key)
+            if entry is not None and entry[2] <= now:
+                del self._done[key]
+                entry = None
+            if entry is None and key not in self._flights:
+                entry = self._shared(key, now)
+            if entry is not None:
+                if entry[0] != fingerprint:
+                    raise KeyReused("Idempotency-Key was already used for a different request")
+                self._done.move_to_end(key)
+                return entry[1], None
+            flight = self._flights.get(key)
+            if flight is not None:
+                if flight.fingerprint != fingerprint:
+                    raise KeyReused("Idempotency-Key was already used for a different request")
+                return None, flight
+            self._flights[key] = _Flight(fingerprint)
+            return None, None
+
+    def _shared(self, key, now):
+        # A response finished by another worker; called under self._lock
+        if self._store is None:
+            return None
+        try:
+            entry = self._store.get(key, now)
+        except sqlite3.Error as e:
+            logger.error("Idempotency store read failed: %s", e)
+            return None
+        if entry is not None:
+            self._remember(key, entry)
+        return entry
+
+    def _remember(self, key, entry):
+        self._done[key] = entry
+        self._done.move_to_end(key)
+        while len(self._done) > self.max_entries:
+            self._done.popitem(last=False)
+
+    def wait(self, flight):
+        """Block until flight ends; its stored response, or None if it stored nothing."""
+        if not flight.done.wait(self.wait_timeout):
+            raise InProgress("A request with this Idempotency-Key is still in progress")
+        return flight.response
+
+    def claim(self, key, fingerprint):
+        """
+        begin(), waiting out an earlier request with the same key.
+
+        Returns (stored, source): a finished response to replay and where it
+        came from ('cache' or 'in_flight'), or (None, None) when the caller
+        runs the request itself and must call finish() or abandon(). Raises
+        KeyReused, or InProgress if the earlier request outlasts the wait.
+        """
+        while True:
+            stored, flight = self.begin(key, fingerprint)
+            if flight is None:
+                return stored, 'cache' if stored is not None else None
+            stored = self.wait(flight)
+            if stored is not None:
+                return stored, 'in_flight'
+            # The first request stored nothing (it failed or was dropped), so run this one
+
+    def finish(self, key, response, flight=None):
+        """
+        End the caller's flight, storing response for replay if storable().
+
+        With flight, only that flight is ended: once it has, the call does
+        nothing, even if a later request has claimed the key since.
+        """
+        if not storable(response):
+            response = None
+        entry = None
+        with self._lock:
+            if flight is not None and self._flights.get(key) is not flight:
+                return
+            flight = self._flights.pop(key, None)
+            if response is not None:
+                entry = (flight.fingerprint if flight else None, response, time.time() + self.ttl)
+                self._remember(key, entry)
+        if entry is not None and self._store is not None:
+            try:
+                self._store.put(key, *entry)
+            except sqlite3.Error as e:
+                logger.error("Idempotency store write failed: %s", e)
+        if flight is not None:
+            flight.response = response
+            flight.done.set()
+
+    def abandon(self, key, flight=None):
+        """End the caller's flight without storing anything; waiting duplicates run themselves."""
+        self.finish(key, None, flight)
+
+    def _flight(self, key):
+        with self._lock:
+            return self._flights.get(key)
+
+    def release_on_close(self, key):
+        """
+        A callable that abandons the caller's flight if it is still running.
+
+        Register it to run when a streamed response is closed: a client that
+        disconnects before the first chunk closes the body without ever
+        starting record_stream()'s generator, which would leave the key in
+        flight until duplicates give up waiting.
+        """
+        flight = self._flight(key)
+        if flight is None:
+            return lambda: None
+        return lambda: self.abandon(key, flight)
+
+    def record_stream(self, key, events, replayable, content_type="text/event-stream"):
+        """
+        Pass a streamed body through, ending the caller's flight with it.
+
+        Only the last chunk is stored, and only if replayable(chunk); a stream
+        the client dropped, or that ended otherwise, stores nothing. Pair it
+        with release_on_close() for bodies that are closed before they start.
+        """
+        return self._stream(key, self._flight(key), events, replayable, content_type)
+
+    def _stream(self, key, flight, events, replayable, content_type):
+        last = None
+        try:
+            for last in events:
+                yield last
+        except BaseException:
+            self.abandon(key, flight)
+            raise
+        finally:
+            close = getattr(events, "close", None)
+            if close:
+                close()
+        self._finish_stream(key, flight, last, replayable, content_type)
+
+    def arecord_stream(self, key, events, replayable, content_type="text/event-stream"):
+        """Async counterpart of record_stream()."""
+        return self._astream(key, self._flight(key), events, replayable, content_type)
+
+    async def _astream(self, key, flight, events, replayable, content_type):
+        last = None
+        try:
+            async for last in events:
+                yield last
+        except BaseException:
+            self.abandon(key, flight)
+            raise
+        # Storing the response may write to SQLite, so not on the event loop
+        await asyncio.to_thread(self._finish_stream, key, flight, last, replayable, content_type)
+
+    def _finish_stream(self, key, flight, last, replayable, content_type):
+        if last is not None and replayable(last):
+            body = last.encode("utf-8") if isinstance(last, str) else last
+            self.finish(key, StoredResponse(200, body, content_type), flight)
+        else:
+            self.abandon(key, flight)
+
+    def stats(self):
+        with self._lock:
+            return {"in_flight": len(self._flights), "stored": len(self._done), "ttl": self.ttl,
+                    "shared": self._store is not None}
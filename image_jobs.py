@@ -0,0 +1,274 @@
+"""
+Background image-generation jobs.
+
+Submitting a job returns an id straight away; a bounded pool of worker
+threads runs the DALL-E call and clients poll (or subscribe to) the job's
+status. Jobs are kept in SQLite, so queued work survives a restart and any
+worker process on the host can pick it up.
+
+    IMAGE_JOBS_PATH         SQLite file (default image_jobs.db in STORY_QUEST_STATE_DIR, var/ in the repo)
+    IMAGE_WORKERS           worker threads per process (default 2)
+    IMAGE_JOB_QUEUE_LIMIT   max queued jobs before submissions are refused (default 100)
+    IMAGE_JOB_RETENTION     seconds finished jobs are kept (default 86400)
+    IMAGE_JOB_EVENTS_MAX    seconds a job's event stream stays open before the client must poll (default 300)
+    IMAGE_WEBHOOK_HOSTS     optional comma-separated hosts webhooks may be sent to
+
+A webhook host that is not in IMAGE_WEBHOOK_HOSTS must resolve to public
+addresses only: private, loopback, link-local (cloud metadata) and other
+reserved addresses are refused when the job is submitted and again right
+before the webhook is sent, and redirects are not followed.
+"""
+import ipaddress
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import urllib.parse
+import urllib.request
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Same state directory as serve.py's shared SQLite files
+STATE_DIR = os.getenv("STORY_QUEST_STATE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "var"))
+DEFAULT_JOBS_PATH = os.path.join(STATE_DIR, "image_jobs.db")
+FINISHED = ("done", "failed")
+
+
+class QueueFull(Exception):
+    """Raised when too many image jobs are already waiting."""
+
+
+class InvalidWebhook(ValueError):
+    """Raised when a webhook URL is not allowed."""
+
+
+def resolves_to_public(host):
+    """True if every address host resolves to is publicly routable."""
+    try:
+        infos = socket.getaddrinfo(host, None, proto=socket.IPPROTO_TCP)
+    except (socket.gaierror, UnicodeError):
+        return False
+    addresses = {ipaddress.ip_address(info[4][0].split("%")[0]) for info in infos}
+    return bool(addresses) and all(
+        address.is_global and not address.is_multicast and not (
+            address.version == 6 and address.ipv4_mapped and not address.ipv4_mapped.is_global
+        )
+        for address in addresses
+    )
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+_webhook_opener = urllib.request.build_opener(_NoRedirect)
+
+
+class ImageJobQueue:
+    """
+    SQLite-backed job queue with a pool of worker threads.
+
+    process(story) must return (filename, remote_url) like
+    server.render_story_image.
+    """
+
+    def __init__(self, process, path=None, workers=None, queue_limit=None, retention=None):
+        self._process = process
+        self.path = path or os.getenv("IMAGE_JOBS_PATH", DEFAULT_JOBS_PATH)
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.workers = int(workers or os.getenv("IMAGE_WORKERS", "2"))
+        self.queue_limit = int(queue_limit or os.getenv("IMAGE_JOB_QUEUE_LIMIT", "100"))
+        self.retention = float(retention or os.getenv("IMAGE_JOB_RETENTION", "86400"))
+        self.events_max_seconds = float(os.getenv("IMAGE_JOB_EVENTS_MAX", "300"))
+        hosts = os.getenv("IMAGE_WEBHOOK_HOSTS", "")
+        self.webhook_hosts = {h.strip().lower() for h in hosts.split(",") if h.strip()}
+        self._local = threading.local()
+        self._wakeup = threading.Condition()
+        self._threads = []
+        self._stopped = False
+        self._running = set()
+        self._connect().execute(
+            "CREATE TABLE IF NOT EXISTS image_jobs ("
+            " id TEXT PRIMARY KEY, status TEXT NOT NULL, story TEXT NOT NULL,"
+            " base_url TEXT, webhook_url TEXT, filename TEXT, remote_url TEXT, error TEXT,"
+            " created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        # A connection must not be used on both sides of a fork (serve.py preloads the app)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    # --- Client side ---
+    def submit(self, story, base_url, webhook_url=None):
+        if webhook_url:
+            self._check_webhook(webhook_url)
+        conn = self._connect()
+        queued = conn.execute("SELECT COUNT(*) FROM image_jobs WHERE status = 'queued'").fetchone()[0]
+        if queued >= self.queue_limit:
+            raise QueueFull("Too many image requests are waiting; please try again shortly")
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        conn.execute(
+            "INSERT INTO image_jobs (id, status, story, base_url, webhook_url, created_at, updated_at)"
+            " VALUES (?, 'queued', ?, ?, ?, ?, ?)",
+            (job_id, story, base_url, webhook_url, now, now),
+        )
+        with self._wakeup:
+            self._wakeup.notify()
+        return job_id
+
+    def get(self, job_id):
+        row = self._connect().execute("SELECT * FROM image_jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._describe(row) if row else None
+
+    def _describe(self, row):
+        job = {"job_id": row["id"], "status": row["status"]}
+        if row["status"] == "done":
+            job["success"] = True
+            job["filename"] = row["filename"]
+            job["image_url"] = row["remote_url"] or f"{row['base_url'].rstrip('/')}/api/images/{row['filename']}"
+        elif row["status"] == "failed":
+            job["error"] = row["error"]
+        return job
+
+    def _check_webhook(self, url):
+        parsed = urllib.parse.urlparse(url)
+        if parsed.scheme not in ("http", "https") or not parsed.hostname:
+            raise InvalidWebhook("webhookUrl must be an http(s) URL")
+        host = parsed.hostname.lower()
+        if self.webhook_hosts:
+            if host not in self.webhook_hosts:
+                raise InvalidWebhook("webhookUrl host is not allowed")
+        elif not resolves_to_public(host):
+            raise InvalidWebhook("webhookUrl must point to a public host")
+
+    # --- Worker side ---
+    def start(self, recover=True):
+        """
+        Start the worker threads.
+
+        recover puts jobs left running by a previous process back in the
+        queue. Pass False when sibling processes share the queue and may be
+        running them right now; serve.py recovers once, before forking.
+        """
+        if self._threads:
+            return
+        if recover:
+            self.recover()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"image-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info("Started %d image workers", self.workers)
+
+    def recover(self):
+        # Jobs that were running when the previous process died go back in the queue
+        count = self._connect().execute(
+            "UPDATE image_jobs SET status = 'queued', updated_at = ? WHERE status = 'running'", (time.time(),)
+        ).rowcount
+        if count:
+            logger.info("Requeued %d interrupted image jobs", count)
+
+    def stop(self, timeout=None):
+        """
+        Stop taking jobs. With a timeout, wait that long for running jobs to
+        finish and put any that have not back in the queue.
+        """
+        with self._wakeup:
+            self._stopped = True
+            self._wakeup.notify_all()
+        if timeout is None:
+            return
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+        with self._wakeup:
+            unfinished = list(self._running)
+        # Hand jobs that are still running to the other worker processes
+        for job_id in unfinished:
+            self._connect().execute(
+                "UPDATE image_jobs SET status = 'queued', updated_at = ? WHERE id = ? AND status = 'running'",
+                (time.time(), job_id),
+            )
+        if unfinished:
+            logger.info("Requeued %d unfinished image jobs", len(unfinished))
+
+    def _claim(self):
+        conn = self._connect()
+        while True:
+            row = conn.execute(
+                "SELECT id FROM image_jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+            ).fetchone()
+            if row is None:
+                return None
+            claimed = conn.execute(
+                "UPDATE image_jobs SET status = 'running', updated_at = ? WHERE id = ? AND status = 'queued'",
+                (time.time(), row["id"]),
+            ).rowcount
+            if claimed:
+                return conn.execute("SELECT * FROM image_jobs WHERE id = ?", (row["id"],)).fetchone()
+            # Another worker got there first; try the next job
+
+    def _run(self):
+        while not self._stopped:
+            try:
+                job = self._claim()
+            except sqlite3.Error as e:
+                logger.error("Failed to claim image job: %s", e)
+                job = None
+            if job is None:
+                with self._wakeup:
+                    if not self._stopped:
+                        # Also poll, so jobs submitted by other processes are picked up
+                        self._wakeup.wait(timeout=1.0)
+                continue
+            self._execute(job)
+
+    def _execute(self, job):
+        conn = self._connect()
+        with self._wakeup:
+            self._running.add(job["id"])
+        try:
+            filename, remote_url = self._process(job["story"])
+            conn.execute(
+                "UPDATE image_jobs SET status = 'done', filename = ?, remote_url = ?, updated_at = ? WHERE id = ?",
+                (filename, remote_url, time.time(), job["id"]),
+            )
+        except Exception as e:
+            logger.error("Image job %s failed: %s", job["id"], e)
+            conn.execute(
+                "UPDATE image_jobs SET status = 'failed', error = ?, updated_at = ? WHERE id = ?",
+                (f"Failed to generate image: {str(e)}", time.time(), job["id"]),
+            )
+        finally:
+            with self._wakeup:
+                self._running.discard(job["id"])
+        conn.execute(
+            "DELETE FROM image_jobs WHERE status IN ('done', 'failed') AND updated_at < ?",
+            (time.time() - self.retention,),
+        )
+        if job["webhook_url"]:
+            self._notify(job["webhook_url"], self.get(job["id"]))
+
+    def _notify(self, url, payload):
+        body = json.dumps(payload).encode("utf-8")
+        req = urllib.request.Request(url, data=body, headers={"Content-Type": "application/json"})
+        try:
+            # Check again: the host may resolve differently now than when the job was submitted
+            self._check_webhook(url)
+            with _webhook_opener.open(req, timeout=10) as resp:
+                resp.read()
+        except Exception as e:
+            logger.warning("Image job webhook to %s failed: %s", url, e)
@@ -0,0 +1,173 @@
+"""
+Local storage for generated images.
+
+DALL-E only returns a temporary URL, so the image bytes are downloaded into
+IMAGES_DIR as soon as they are generated and served from there afterwards.
+Downloads are streamed to disk in chunks and renamed into place once
+complete, so a half-written file is never served.
+
+Images are content-addressed: the filename is derived from a hash of the
+normalized prompt, so the same story maps to the same file and is only
+generated once. IMAGE_CACHE_MAX_BYTES bounds the directory; the least
+recently requested images are evicted first.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+import threading
+import urllib.request
+import uuid
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+IMAGES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'generated_images')
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+DOWNLOAD_TIMEOUT = float(os.getenv("IMAGE_DOWNLOAD_TIMEOUT", "30"))
+# Stored images never change, so browsers may cache them for a year
+IMAGE_MAX_AGE = int(os.getenv("IMAGE_MAX_AGE", str(365 * 24 * 3600)))
+# mkstemp creates files 0600; a separate static file server must be able to read them
+IMAGE_FILE_MODE = 0o644
+
+_WHITESPACE = re.compile(r"\s+")
+_ENTITY_TAG = re.compile(r'(?:W/)?("[^"]*")')
+
+
+def prompt_key(prompt):
+    """Hash of the prompt with case and whitespace normalized."""
+    normalized = _WHITESPACE.sub(" ", prompt).strip().lower()
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+def cached_filename(key):
+    return f"story_image_{key[:16]}.png"
+
+
+def download_image(url, path, timeout=DOWNLOAD_TIMEOUT):
+    """Stream url into path without holding the whole body in memory."""
+    directory = os.path.dirname(path) or "."
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as out, urllib.request.urlopen(url, timeout=timeout) as resp:
+            shutil.copyfileobj(resp, out, DOWNLOAD_CHUNK_SIZE)
+        os.chmod(tmp_path, IMAGE_FILE_MODE)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def store_image(image_url, story, filename=None, key=None):
+    """
+    Download a generated image and record its metadata.
+
+    Returns (filename, stored). stored is False when the download failed; the
+    metadata is still written so the upstream URL is not lost.
+    """
+    # Generate a unique filename
+    filename = filename or f"story_image_{uuid.uuid4().hex[:8]}.png"
+
+    stored = False
+    try:
+        download_image(image_url, os.path.join(IMAGES_DIR, filename))
+        stored = True
+    except Exception as e:
+        logger.error("Failed to download generated image %s: %s", filename, e)
+
+    # Save the image URL to a JSON file for reference
+    image_data = {
+        'filename': filename,
+        'url': image_url,
+        'stored': stored,
+        'prompt_hash': key,
+        'story': story[:200] + "..." if len(story) > 200 else story,
+        'timestamp': datetime.now(timezone.utc).isoformat()
+    }
+
+    with open(os.path.join(IMAGES_DIR, f"{filename}.json"), 'w') as f:
+        json.dump(image_data, f)
+    return filename, stored
+
+
+def image_etag(path):
+    stat = os.stat(path)
+    return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+
+def etag_matches(if_none_match, etag):
+    """True if an If-None-Match header is "*" or lists etag; W/ prefixes are ignored (weak comparison)."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return etag in _ENTITY_TAG.findall(if_none_match)
+
+
+class ImageCache:
+    """Size-bounded, content-addressed view over IMAGES_DIR."""
+
+    def __init__(self, directory=IMAGES_DIR, max_bytes=None):
+        self.directory = directory
+        self.max_bytes = int(max_bytes or os.getenv("IMAGE_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def lookup(self, key):
+        """Return the stored filename for a prompt key, or None."""
+        filename = cached_filename(key)
+        path = os.path.join(self.directory, filename)
+        if not os.path.isfile(path):
+            with self._lock:
+                self.misses += 1
+            return None
+        # Touch the metadata, not the image, so the image's ETag stays stable
+        try:
+            os.utime(path + ".json")
+        except OSError:
+            pass
+        with self._lock:
+            self.hits += 1
+        return filename
+
+    def evict(self):
+        """Delete least recently used images until the directory fits max_bytes."""
+        with self._lock:
+            entries = []
+            total = 0
+            for name in os.listdir(self.directory):
+                if not name.endswith(".png"):
+                    continue
+                path = os.path.join(self.directory, name)
+                meta = path + ".json"
+                try:
+                    size = os.path.getsize(path)
+                    used = os.path.getmtime(meta) if os.path.exists(meta) else os.path.getmtime(path)
+                except OSError:
+                    continue
+                entries.append((used, size, path))
+                total += size
+            entries.sort()
+            while total > self.max_bytes and entries:
+                _, size, path = entries.pop(0)
+                for victim in (path, path + ".json"):
+                    try:
+                        os.remove(victim)
+                    except FileNotFoundError:
+                        pass
+                total -= size
+                self.evictions += 1
+                logger.info("Evicted cached image %s", os.path.basename(path))
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+
+image_cache = ImageCache()
@@ -0,0 +1,204 @@
+"""
+Latency histograms, error counters and request-scoped logging.
+
+Metrics are kept in-process and rendered in the Prometheus text format at
+/metrics. Every request gets an id (taken from X-Request-ID when the client
+sends one) that is attached to its log records and echoed in the response.
+Request payloads are only logged at DEBUG for a sample of requests, so
+DEBUG can stay on in production without logging every story.
+
+    LOG_LEVEL                 root log level (default INFO)
+    LOG_PAYLOAD_SAMPLE_RATE   fraction of requests whose payloads are logged at DEBUG (default 0.01)
+"""
+import bisect
+import contextvars
+import logging
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_REQUEST_ID_RE = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value):
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Counter:
+    """Monotonic counter with optional labels."""
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        REGISTRY.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram with optional labels."""
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        # label values -> [per-bucket counts (+Inf last), sum, count]
+        self._series = {}
+        REGISTRY.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of the with-block, including when it raises."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((key, (list(s[0]), s[1], s[2])) for key, s in self._series.items())
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, ('le', le))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+REGISTRY = []
+
+
+def render():
+    """All registered metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# --- Story API metrics ---
+STAGE_SECONDS = Histogram(
+    "storyquest_stage_seconds",
+    "Time spent in each stage of a story request.",
+    ["stage"],
+)
+REQUEST_SECONDS = Histogram(
+    "storyquest_request_seconds",
+    "Total time to serve a request, including streamed bodies.",
+    ["endpoint", "status"],
+)
+UPSTREAM_ERRORS = Counter(
+    "storyquest_upstream_errors_total",
+    "Failed calls to OpenAI (or the crew) by endpoint and upstream.",
+    ["endpoint", "upstream"],
+)
+
+
+def upstream_error(upstream):
+    UPSTREAM_ERRORS.inc(endpoint=current_endpoint(), upstream=upstream)
+
+
+# --- Request ids ---
+_request_id = contextvars.ContextVar("request_id", default="-")
+_endpoint = contextvars.ContextVar("endpoint", default="background")
+_sampled = contextvars.ContextVar("payload_sampled", default=False)
+
+PAYLOAD_SAMPLE_RATE = float(os.getenv("LOG_PAYLOAD_SAMPLE_RATE", "0.01"))
+
+
+def bind_request(endpoint, request_id=None):
+    """Start the request context for the current thread or task; returns the request id."""
+    if not request_id or not _REQUEST_ID_RE.match(request_id):
+        request_id = uuid.uuid4().hex
+    _request_id.set(request_id)
+    _endpoint.set(endpoint or "unmatched")
+    _sampled.set(random.random() < PAYLOAD_SAMPLE_RATE)
+    return request_id
+
+
+def current_request_id():
+    return _request_id.get()
+
+
+def current_endpoint():
+    return _endpoint.get()
+
+
+def in_request_context(fn):
+    """Wrap fn so it runs with the caller's request id when handed to another thread."""
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.run(fn, *args, **kwargs)
+
+
+# --- Logging ---
+class RequestIdFilter(logging.Filter):
+    def filter(self, record):
+        record.request_id = _request_id.get()
+        return True
+
+
+def configure_logging():
+    """Root logging with the request id in every line; level from LOG_LEVEL."""
+    logging.basicConfig(
+        level=os.getenv("LOG_LEVEL", "INFO").upper(),
+        format="%(asctime)s %(levelname)s [%(request_id)s] %(name)s: %(message)s",
+    )
+    for handler in logging.getLogger().handlers:
+        if not any(isinstance(f, RequestIdFilter) for f in handler.filters):
+            handler.addFilter(RequestIdFilter())
+
+
+def log_payload(logger, message, payload):
+    """Log a request or response body at DEBUG, for sampled requests only."""
+    if _sampled.get() and logger.isEnabledFor(logging.DEBUG):
+        logger.debug("%s: %r", message, payload)
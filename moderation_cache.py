@@ -0,0 +1,166 @@
+"""
+Cache of moderation API verdicts keyed by a hash of the normalized text.
+
+Verdicts are kept in an in-process LRU with a TTL. When MODERATION_CACHE_PATH
+is set they are also written to a SQLite file, so every worker process on the
+host shares them and a verdict survives restarts.
+
+    MODERATION_CACHE_SIZE   entries kept in memory (default 10000)
+    MODERATION_CACHE_TTL    seconds a verdict stays valid (default 86400)
+    MODERATION_CACHE_PATH   optional SQLite file shared across workers
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def cache_key(text):
+    normalized = _WHITESPACE.sub(" ", text).strip().lower()
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+class SQLiteVerdictStore:
+    """Verdict table in a SQLite file, one connection per thread."""
+
+    PURGE_EVERY = 500
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._writes = 0
+        self._connect().execute(
+            "CREATE TABLE IF NOT EXISTS moderation_verdicts ("
+            " key TEXT PRIMARY KEY, flagged INTEGER NOT NULL, categories TEXT, expires_at REAL NOT NULL)"
+        )
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        # A connection must not be used on both sides of a fork (serve.py preloads the app)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key, now):
+        """(expires_at, verdict) for an unexpired key, or None."""
+        row = self._connect().execute(
+            "SELECT flagged, categories, expires_at FROM moderation_verdicts WHERE key = ? AND expires_at > ?",
+            (key, now),
+        ).fetchone()
+        if row is None:
+            return None
+        return row[2], (bool(row[0]), json.loads(row[1]) if row[1] else None)
+
+    def put(self, key, verdict, expires_at):
+        flagged, categories = verdict
+        conn = self._connect()
+        conn.execute(
+            "INSERT OR REPLACE INTO moderation_verdicts (key, flagged, categories, expires_at) VALUES (?, ?, ?, ?)",
+            (key, int(flagged), json.dumps(categories) if categories else None, expires_at),
+        )
+        self._writes += 1
+        if self._writes % self.PURGE_EVERY == 0:
+            conn.execute("DELETE FROM moderation_verdicts WHERE expires_at <= ?", (time.time(),))
+
+
+class ModerationCache:
+    """LRU + TTL cache of (flagged, categories) verdicts, optionally backed by SQLite."""
+
+    def __init__(self, max_entries=None, ttl=None, path=None):
+        self.max_entries = int(max_entries or os.getenv("MODERATION_CACHE_SIZE", "10000"))
+        self.ttl = float(ttl or os.getenv("MODERATION_CACHE_TTL", "86400"))
+        path = path or os.getenv("MODERATION_CACHE_PATH")
+        self._store = SQLiteVerdictStore(path) if path else None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    def get(self, text):
+        key = cache_key(text)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, verdict = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return verdict
+                del self._entries[key]
+
+        if self._store is not None:
+            try:
+                entry = self._store.get(key, now)
+            except sqlite3.Error as e:
+                logger.error("Moderation cache read failed: %s", e)
+                entry = None
+            if entry is not None:
+                # Keep the shared expiry: a verdict must not outlive its TTL by being copied around
+                expires_at, verdict = entry
+                self._remember(key, verdict, expires_at)
+                with self._lock:
+                    self.shared_hits += 1
+                return verdict
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, text, verdict):
+        key = cache_key(text)
+        expires_at = time.time() + self.ttl
+        self._remember(key, verdict, expires_at)
+        if self._store is not None:
+            try:
+                self._store.put(key, verdict, expires_at)
+            except sqlite3.Error as e:
+                logger.error("Moderation cache write failed: %s", e)
+
+    def _remember(self, key, verdict, expires_at):
+        with self._lock:
+            self._entries[key] = (expires_at, verdict)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.shared_hits + self.misses
+            return {
+                "hits": self.hits,
+                "shared_hits": self.shared_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.shared_hits) / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+                "shared": self._store is not None,
+            }
+
+
+def categories_to_dict(categories):
+    """Reduce a moderation result's categories to the ones that were flagged."""
+    if categories is None:
+        return None
+    if hasattr(categories, "model_dump"):
+        values = categories.model_dump()
+    elif isinstance(categories, dict):
+        values = categories
+    else:
+        values = vars(categories)
+    return {name: True for name, flagged in values.items() if flagged}
+
+
+moderation_cache = ModerationCache()
@@ -0,0 +1,80 @@
+"""
+Story-turn pipeline: generation runs alongside moderation of the student's input.
+
+Previously a turn was generate -> moderate output -> respond, and unsafe
+student text was only caught (if at all) after paying for a full crew run.
+Here the keyword filter screens the input before anything is spent, the
+moderation API checks it while generation is already under way, and a
+rejection returns straight away without waiting for the model.
+"""
+import asyncio
+import contextvars
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from content_filter import keyword_filter
+
+generation_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("GENERATION_THREADS", "32")),
+    thread_name_prefix="generate",
+)
+
+
+def prescreen(story_so_far):
+    """The rejection (as moderation categories) if the keyword filter blocks story_so_far, else None."""
+    keyword = keyword_filter.find(story_so_far) if story_so_far else None
+    if keyword:
+        return {"error": f"Content blocked for safety reasons: contains prohibited word '{keyword}'"}
+    return None
+
+
+def run_moderated_turn(generate, story_so_far, moderate_input, moderate_output):
+    """
+    Run generate() while story_so_far is moderated, then moderate the output.
+
+    Returns (result, is_safe, categories). When the input is rejected, result
+    is None and generate() is cancelled if it has not started yet; a crew that
+    is already running cannot be interrupted, but the caller no longer waits
+    for it.
+    """
+    categories = prescreen(story_so_far)
+    if categories:
+        return None, False, categories
+
+    if not story_so_far:
+        result = generate()
+    else:
+        # Copy the caller's context so the request id follows generate() into the pool
+        future = generation_executor.submit(contextvars.copy_context().run, generate)
+        is_safe, categories = moderate_input(story_so_far)
+        if not is_safe:
+            future.cancel()
+            return None, False, categories
+        result = future.result()
+
+    if not result:
+        return result, True, None
+    is_safe, categories = moderate_output(result)
+    return result, is_safe, categories
+
+
+async def run_moderated_turn_async(generate, story_so_far, moderate_input, moderate_output):
+    """Async counterpart of run_moderated_turn; generate and the moderators are coroutine functions."""
+    categories = prescreen(story_so_far)
+    if categories:
+        return None, False, categories
+
+    if not story_so_far:
+        result = await generate()
+    else:
+        task = asyncio.ensure_future(generate())
+        is_safe, categories = await moderate_input(story_so_far)
+        if not is_safe:
+            task.cancel()
+            return None, False, categories
+        result = await task
+
+    if not result:
+        return result, True, None
+    is_safe, categories = await moderate_output(result)
+    return result, is_safe, categories
@@ -0,0 +1,313 @@
+"""
+Admission control for story turns and image generation.
+
+Token buckets cap how fast one player (their session), one IP address (in
+practice one classroom, behind its school's NAT) and the whole service may
+start story turns and images, so one burst cannot use up the OpenAI rate
+limit for everyone. A request that would get a token within
+RATE_LIMIT_MAX_WAIT seconds reserves it and waits its turn; otherwise it is
+rejected straight away with 429 and a Retry-After. With RATE_LIMIT_PATH set
+the buckets live in a SQLite file that every worker process on the host
+shares (serve.py sets it); otherwise they are per process.
+
+Load generators send every request as one user from one IP, so the default
+per-user and per-IP limits turn most of their requests away;
+bench/load_test.py sets RATE_LIMIT_*=off for the server it starts.
+
+Each upstream also gets a cap on requests in flight. A request waits up to
+ADMISSION_WAIT seconds for a slot and is then turned away with 503 and a
+Retry-After. The caps are for the host and are split evenly across the
+WEB_WORKERS processes.
+
+    RATE_LIMIT_<KIND>_<SCOPE>   N/s, N/m or N/h, or off. KIND is STORY or IMAGE, SCOPE is USER, IP
+                                or GLOBAL (story 20/m, 300/m, 1200/m; image 5/m, 60/m, 100/m)
+    RATE_LIMIT_MAX_WAIT         seconds a request may queue for a token (default 2)
+    RATE_LIMIT_PATH             optional SQLite file shared across workers
+    RATE_LIMIT_TRUSTED_PROXIES  proxies in front of the app whose X-Forwarded-For is used (default 0)
+    CONCURRENCY_<UPSTREAM>      requests in flight per upstream on the host (chat 64, images 8)
+    ADMISSION_WAIT              seconds a request waits for an upstream slot (default 5)
+"""
+import asyncio
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+from metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+Limit = namedtuple("Limit", ["capacity", "per_second"])
+
+DEFAULT_LIMITS = {
+    "story": {"user": "20/m", "ip": "300/m", "global": "1200/m"},
+    "image": {"user": "5/m", "ip": "60/m", "global": "100/m"},
+}
+DEFAULT_CONCURRENCY = {"chat": 64, "images": 8}
+PERIODS = {"s": 1.0, "m": 60.0, "h": 3600.0}
+# Buckets idle this long are full again (no period is longer), so they can be dropped
+IDLE_BUCKET_SECONDS = 3600.0
+
+RATE_LIMITED = Counter(
+    "storyquest_rate_limited_total",
+    "Requests rejected because a rate limit bucket was empty.",
+    ["kind", "scope"],
+)
+RATE_LIMIT_QUEUED = Counter(
+    "storyquest_rate_limit_queued_total",
+    "Requests that waited for a rate limit token before running.",
+    ["kind"],
+)
+SATURATED = Counter(
+    "storyquest_upstream_saturated_total",
+    "Requests turned away because an upstream had no free concurrency slot.",
+    ["upstream"],
+)
+
+
+class RateLimited(Exception):
+    """A rate limit bucket is empty; retry_after is when it will have a token."""
+
+    def __init__(self, kind, scope, retry_after):
+        super().__init__(f"Too many {kind} requests; please slow down")
+        self.kind = kind
+        self.scope = scope
+        self.retry_after = retry_after
+
+
+class Saturated(Exception):
+    """No concurrency slot for the upstream came free in time."""
+
+    def __init__(self, upstream, retry_after=1.0):
+        super().__init__("The story service is busy; please try again in a moment")
+        self.upstream = upstream
+        self.retry_after = retry_after
+
+
+def retry_after_header(seconds):
+    return str(max(1, math.ceil(seconds)))
+
+
+def parse_limit(spec):
+    """'20/m' -> Limit(20, 20/60); 'off', '0' or '' -> None."""
+    spec = (spec or "").strip().lower()
+    if spec in ("", "off", "0", "none"):
+        return None
+    count, _, period = spec.partition("/")
+    if period not in PERIODS or not count.isdigit() or int(count) <= 0:
+        raise ValueError(f"Invalid rate limit {spec!r}; expected N/s, N/m or N/h")
+    return Limit(float(count), int(count) / PERIODS[period])
+
+
+def client_ip(remote_addr, forwarded_for=None, trusted_proxies=None):
+    """The client address, skipping trusted proxies listed in X-Forwarded-For."""
+    if trusted_proxies is None:
+        trusted_proxies = int(os.getenv("RATE_LIMIT_TRUSTED_PROXIES", "0"))
+    if trusted_proxies and forwarded_for:
+        hops = [hop.strip() for hop in forwarded_for.split(",") if hop.strip()]
+        if len(hops) >= trusted_proxies:
+            return hops[-trusted_proxies]
+    return remote_addr or "unknown"
+
+
+def _reserve(buckets, requests, now, max_wait):
+    """
+    Take one token from each bucket in requests [(key, scope, Limit)].
+
+    buckets is {key: (tokens, updated_at)}. Tokens may go negative by up to
+    max_wait seconds' worth, which queues the request behind earlier ones.
+    Returns (new bucket values, seconds to wait), or raises RateLimited
+    without taking anything if any bucket would need a longer wait.
+    """
+    taken = {}
+    wait = 0.0
+    for key, scope, limit in requests:
+        tokens, updated_at = buckets.get(key) or (limit.capacity, now)
+        tokens = min(limit.capacity, tokens + (now - updated_at) * limit.per_second) - 1
+        needed = -tokens / limit.per_second if tokens < 0 else 0.0
+        if needed > max_wait:
+            raise RateLimited(key.split(":", 1)[0], scope, needed)
+        taken[key] = (tokens, now)
+        wait = max(wait, needed)
+    return taken, wait
+
+
+class MemoryBuckets:
+    """Token buckets in this process only."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {}
+        self._purged_at = time.time()
+
+    def reserve(self, requests, max_wait):
+        now = time.time()
+        with self._lock:
+            taken, wait = _reserve(self._buckets, requests, now, max_wait)
+            self._buckets.update(taken)
+            if now - self._purged_at > IDLE_BUCKET_SECONDS:
+                self._purged_at = now
+                for key in [k for k, (_, at) in self._buckets.items() if now - at > IDLE_BUCKET_SECONDS]:
+                    del self._buckets[key]
+        return wait
+
+
+class SQLiteBuckets:
+    """Token buckets in a SQLite file, updated in one transaction per request."""
+
+    PURGE_EVERY = 1000
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._writes = 0
+        self._connect().execute(
+            "CREATE TABLE IF NOT EXISTS rate_buckets ("
+            " key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        # A connection must not be used on both sides of a fork (serve.py preloads the app)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def reserve(self, requests, max_wait):
+        conn = self._connect()
+        keys = [key for key, _, _ in requests]
+        # IMMEDIATE takes the write lock up front, so workers cannot interleave read and update
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute(
+                f"SELECT key, tokens, updated_at FROM rate_buckets WHERE key IN ({','.join('?' * len(keys))})",
+                keys,
+            ).fetchall()
+            taken, wait = _reserve({key: (tokens, at) for key, tokens, at in rows}, requests, time.time(), max_wait)
+            conn.executemany(
+                "INSERT OR REPLACE INTO rate_buckets (key, tokens, updated_at) VALUES (?, ?, ?)",
+                [(key, tokens, at) for key, (tokens, at) in taken.items()],
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        self._writes += 1
+        if self._writes % self.PURGE_EVERY == 0:
+            conn.execute("DELETE FROM rate_buckets WHERE updated_at < ?", (time.time() - IDLE_BUCKET_SECONDS,))
+        return wait
+
+
+class RateLimiter:
+    """Per-user, per-IP and global token buckets for each kind of request."""
+
+    def __init__(self, limits=None, path=None, max_wait=None):
+        if limits is None:
+            limits = {
+                kind: {scope: parse_limit(os.getenv(f"RATE_LIMIT_{kind.upper()}_{scope.upper()}", spec))
+                       for scope, spec in scopes.items()}
+                for kind, scopes in DEFAULT_LIMITS.items()
+            }
+        self.limits = limits
+        self.max_wait = float(max_wait if max_wait is not None else os.getenv("RATE_LIMIT_MAX_WAIT", "2"))
+        path = path or os.getenv("RATE_LIMIT_PATH")
+        self._buckets = SQLiteBuckets(path) if path else MemoryBuckets()
+
+    def reserve(self, kind, user=None, ip=None):
+        """
+        Take a token from each of kind's buckets that applies; returns the
+        seconds to wait before going ahead. Raises RateLimited if a bucket is
+        empty for longer than max_wait. A request without a user id is only
+        counted against its IP and the global bucket.
+        """
+        values = {"user": user, "ip": ip, "global": "all"}
+        requests = [
+            (f"{kind}:{scope}:{values[scope]}", scope, limit)
+            for scope, limit in self.limits.get(kind, {}).items()
+            if limit is not None and values[scope]
+        ]
+        if not requests:
+            return 0.0
+        try:
+            wait = self._buckets.reserve(requests, self.max_wait)
+        except RateLimited as e:
+            RATE_LIMITED.inc(kind=kind, scope=e.scope)
+            raise
+        except sqlite3.Error as e:
+            # Fail open: a broken limiter must not take the game down with it
+            logger.error("Rate limiter failed: %s", e)
+            return 0.0
+        if wait > 0:
+            RATE_LIMIT_QUEUED.inc(kind=kind)
+        return wait
+
+    def admit(self, kind, user=None, ip=None):
+        """reserve(), then wait for the token."""
+        wait = self.reserve(kind, user, ip)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def aadmit(self, kind, user=None, ip=None):
+        """Async counterpart of admit()."""
+        wait = await asyncio.to_thread(self.reserve, kind, user, ip)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+class ConcurrencyLimit:
+    """Caps requests in flight to one upstream from this process."""
+
+    POLL_INTERVAL = 0.02
+
+    def __init__(self, name, limit=None, wait=None, workers=None):
+        self.name = name
+        if limit is None:
+            limit = int(os.getenv(f"CONCURRENCY_{name.upper()}", str(DEFAULT_CONCURRENCY.get(name, 32))))
+        workers = max(1, int(workers or os.getenv("WEB_WORKERS") or 1))
+        # The limit is for the host; each worker process gets its share
+        self.limit = max(1, math.ceil(limit / workers))
+        self.wait = float(wait if wait is not None else os.getenv("ADMISSION_WAIT", "5"))
+        self._slots = threading.BoundedSemaphore(self.limit)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+
+    def acquire(self):
+        if not self._slots.acquire(timeout=self.wait):
+            self._reject()
+        self._count(1)
+
+    async def aacquire(self):
+        """Async counterpart of acquire(); polls, since the slots are shared with threads."""
+        deadline = time.monotonic() + self.wait
+        while not self._slots.acquire(blocking=False):
+            if time.monotonic() >= deadline:
+                self._reject()
+            await asyncio.sleep(self.POLL_INTERVAL)
+        self._count(1)
+
+    def release(self):
+        self._count(-1)
+        self._slots.release()
+
+    def _count(self, delta):
+        with self._lock:
+            self.in_flight += delta
+
+    def _reject(self):
+        SATURATED.inc(upstream=self.name)
+        raise Saturated(self.name)
+
+    def stats(self):
+        with self._lock:
+            return {"limit": self.limit, "in_flight": self.in_flight}
+
+
+rate_limiter = RateLimiter()
+chat_slots = ConcurrencyLimit("chat")
+image_slots = ConcurrencyLimit("images")
@@ -0,0 +1,269 @@
+"""
+Deadlines, retries and circuit breakers for calls to OpenAI.
+
+Each upstream (chat, moderation, images) gets an Upstream object. call()
+retries transient failures (timeouts, connection errors, 429 and 5xx) with
+full-jitter exponential backoff, giving each attempt the smaller of the
+per-attempt timeout and what is left of the overall deadline. After
+BREAKER_FAILURES consecutive failures the breaker opens and calls fail
+immediately with CircuitOpen, so callers can serve their fallback in
+milliseconds instead of waiting out a timeout. After BREAKER_RESET seconds
+one trial call is let through; if it succeeds the breaker closes again.
+
+    UPSTREAM_<NAME>_TIMEOUT    seconds per attempt (chat 30, moderation 5, images 60)
+    UPSTREAM_<NAME>_DEADLINE   seconds for all attempts together (chat 45, moderation 8, images 90)
+    UPSTREAM_<NAME>_RETRIES    retries after the first attempt (chat 2, moderation 2, images 1)
+    BREAKER_FAILURES           consecutive failures that open a breaker (default 5)
+    BREAKER_RESET              seconds an open breaker waits before a trial call (default 30)
+"""
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+
+from metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+try:
+    import openai
+
+    _TRANSIENT = (
+        ConnectionError,
+        TimeoutError,
+        openai.APIConnectionError,  # includes APITimeoutError
+        openai.RateLimitError,
+        openai.InternalServerError,
+    )
+except ImportError:
+    _TRANSIENT = (ConnectionError, TimeoutError)
+
+DEFAULTS = {
+    "chat": {"timeout": 30.0, "deadline": 45.0, "retries": 2},
+    "moderation": {"timeout": 5.0, "deadline": 8.0, "retries": 2},
+    "images": {"timeout": 60.0, "deadline": 90.0, "retries": 1},
+}
+
+BACKOFF_BASE = 0.25
+BACKOFF_CAP = 4.0
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+RETRIES = Counter("storyquest_upstream_retries_total", "Retried calls to an upstream.", ["upstream"])
+BREAKER_OPENED = Counter("storyquest_breaker_opened_total", "Times an upstream's circuit breaker opened.", ["upstream"])
+SHORT_CIRCUITED = Counter(
+    "storyquest_breaker_rejected_total",
+    "Calls failed fast because an upstream's circuit breaker was open.",
+    ["upstream"],
+)
+
+
+class CircuitOpen(Exception):
+    """Raised instead of calling an upstream whose breaker is open."""
+
+    def __init__(self, upstream, retry_after):
+        super().__init__(f"{upstream} is temporarily unavailable")
+        self.upstream = upstream
+        self.retry_after = retry_after
+
+
+def is_transient(error):
+    """Whether a failure is worth retrying and counts against the breaker."""
+    status = getattr(error, "status_code", None)
+    if status is not None:
+        return status in (408, 409, 429) or status >= 500
+    return isinstance(error, _TRANSIENT)
+
+
+def backoff(attempt):
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * (2 ** attempt)))
+
+
+class Upstream:
+    """Circuit breaker plus retry policy for one upstream service."""
+
+    def __init__(self, name, timeout=None, deadline=None, retries=None, failure_threshold=None, reset_timeout=None):
+        defaults = DEFAULTS.get(name, DEFAULTS["chat"])
+        prefix = f"UPSTREAM_{name.upper()}_"
+        self.name = name
+        self.timeout = float(timeout or os.getenv(prefix + "TIMEOUT", defaults["timeout"]))
+        self.deadline = float(deadline or os.getenv(prefix + "DEADLINE", defaults["deadline"]))
+        self.retries = int(retries if retries is not None else os.getenv(prefix + "RETRIES", defaults["retries"]))
+        self.failure_threshold = int(failure_threshold or os.getenv("BREAKER_FAILURES", "5"))
+        self.reset_timeout = float(reset_timeout or os.getenv("BREAKER_RESET", "30"))
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_running = False
+
+    # --- Breaker ---
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                return HALF_OPEN
+            return self._state
+
+    def available(self):
+        """True unless the breaker is open (a half-open breaker is available for its trial call)."""
+        return self.state != OPEN
+
+    def _before_call(self):
+        with self._lock:
+            if self._state == CLOSED:
+                return
+            waited = time.monotonic() - self._opened_at
+            if waited >= self.reset_timeout and not self._trial_running:
+                self._trial_running = True
+                return
+            retry_after = max(0.0, self.reset_timeout - waited)
+        SHORT_CIRCUITED.inc(upstream=self.name)
+        raise CircuitOpen(self.name, retry_after)
+
+    def record_success(self):
+        with self._lock:
+            if self._state != CLOSED:
+                logger.info("Circuit breaker for %s closed", self.name)
+            self._state = CLOSED
+            self._failures = 0
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            trial_failed = self._trial_running
+            self._trial_running = False
+            if trial_failed or (self._state == CLOSED and self._failures >= self.failure_threshold):
+                if self._state == CLOSED:
+                    BREAKER_OPENED.inc(upstream=self.name)
+                    logger.warning("Circuit breaker for %s opened after %d failures", self.name, self._failures)
+                self._state = OPEN
+                self._opened_at = time.monotonic()
+
+    def _end_trial(self):
+        with self._lock:
+            self._trial_running = False
+
+    def _record(self, error):
+        if is_transient(error):
+            self.record_failure()
+        else:
+            # The upstream answered; the request itself was bad
+            self.record_success()
+
+    # --- Calls ---
+    def protect(self, fn, *args, **kwargs):
+        """Call fn once under the breaker, without retries or a timeout (e.g. a crew kickoff)."""
+        self._before_call()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            self._record(e)
+            raise
+        self.record_success()
+        return result
+
+    def protect_stream(self, tokens):
+        """
+        Iterate a token stream under the breaker, as one call.
+
+        Streams are not retried: tokens already sent to the client cannot be
+        taken back. A consumer that stops early counts as neither outcome.
+        """
+        try:
+            self._before_call()
+            yield from tokens
+        except GeneratorExit:
+            self._end_trial()
+            raise
+        except CircuitOpen:
+            raise
+        except Exception as e:
+            self._record(e)
+            raise
+        else:
+            self.record_success()
+        finally:
+            tokens.close()
+
+    async def aprotect_stream(self, tokens):
+        """Async counterpart of protect_stream()."""
+        try:
+            self._before_call()
+            async for token in tokens:
+                yield token
+        except GeneratorExit:
+            self._end_trial()
+            raise
+        except CircuitOpen:
+            raise
+        except Exception as e:
+            self._record(e)
+            raise
+        else:
+            self.record_success()
+        finally:
+            await tokens.aclose()
+
+    def call(self, fn, *args, **kwargs):
+        """Call fn(*args, timeout=..., **kwargs) with retries, the deadline and the breaker."""
+        deadline = time.monotonic() + self.deadline
+        attempt = 0
+        while True:
+            self._before_call()
+            remaining = deadline - time.monotonic()
+            try:
+                result = fn(*args, timeout=max(0.1, min(self.timeout, remaining)), **kwargs)
+            except Exception as e:
+                self._record(e)
+                delay = backoff(attempt)
+                if (not is_transient(e) or attempt >= self.retries or not self.available()
+                        or time.monotonic() + delay >= deadline):
+                    raise
+                attempt += 1
+                RETRIES.inc(upstream=self.name)
+                logger.warning("%s call failed (%s); retry %d in %.2fs", self.name, e, attempt, delay)
+                time.sleep(delay)
+                continue
+            self.record_success()
+            return result
+
+    async def acall(self, fn, *args, **kwargs):
+        """Async counterpart of call(); fn is a coroutine function."""
+        deadline = time.monotonic() + self.deadline
+        attempt = 0
+        while True:
+            self._before_call()
+            remaining = deadline - time.monotonic()
+            try:
+                result = await fn(*args, timeout=max(0.1, min(self.timeout, remaining)), **kwargs)
+            except Exception as e:
+                self._record(e)
+                delay = backoff(attempt)
+                if (not is_transient(e) or attempt >= self.retries or not self.available()
+                        or time.monotonic() + delay >= deadline):
+                    raise
+                attempt += 1
+                RETRIES.inc(upstream=self.name)
+                logger.warning("%s call failed (%s); retry %d in %.2fs", self.name, e, attempt, delay)
+                await asyncio.sleep(delay)
+                continue
+            self.record_success()
+            return result
+
+    def stats(self):
+        return {"state": self.state, "consecutive_failures": self._failures}
+
+
+chat = Upstream("chat")
+moderation = Upstream("moderation")
+images = Upstream("images")
+
+
+def upstream_states():
+    return {u.name: u.stats() for u in (chat, moderation, images)}
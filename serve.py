@@ -0,0 +1,154 @@
+"""
+Production entry point: the API on several worker processes under gunicorn.
+
+    python serve.py                    # server.py (Flask) on threaded workers
+    python serve.py --app asgi         # asgi.py on uvicorn workers
+    python serve.py --app story        # story-server.py
+    gunicorn -c serve.py server:app    # the same settings, started by gunicorn
+
+The app is imported once in the master before forking (preload_app), so the
+YAML config, prompts and keyword lists are parsed once and shared by the
+workers. Each worker then starts its own background threads (starter pool,
+image workers, crew pre-warm; see server.start_background_workers); the
+starter pool is shared, and only one worker at a time refills it. On
+SIGTERM gunicorn stops accepting connections and gives in-flight requests,
+streamed story turns included, WEB_DRAIN_SECONDS to finish; each worker then
+stops its background threads, hands unfinished image jobs back to the queue
+and saves its sessions.
+
+State every worker must see lives in SQLite files in STORY_QUEST_STATE_DIR:
+sessions (SESSION_SHARED), moderation verdicts, finished Idempotency-Key
+responses, the image job queue, rate limit buckets and pre-generated story
+starters. Set SESSION_STORE_PATH, MODERATION_CACHE_PATH, IDEMPOTENCY_PATH,
+IMAGE_JOBS_PATH, RATE_LIMIT_PATH or STARTER_POOL_PATH to put one elsewhere.
+Crew pools, usage totals and /metrics stay per process: the global usage
+budget is split evenly across workers, and /metrics describes whichever
+worker answered the scrape.
+
+    WEB_WORKERS            worker processes (default: CPU cores available)
+    WEB_THREADS            request threads per Flask worker (default 32)
+    WEB_DRAIN_SECONDS      seconds in-flight requests get on shutdown (default 60)
+    WEB_TIMEOUT            seconds a worker may hang before it is restarted (default 120)
+    PORT                   port to listen on (default 5002)
+    STORY_QUEST_STATE_DIR  directory for the shared SQLite files (default var/ in the repo)
+"""
+import importlib
+import importlib.util
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+APPS = {"server": "server", "asgi": "asgi", "story": "story-server.py"}
+
+
+def available_cores():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+# --- gunicorn settings ---
+# Module-level names are read by gunicorn itself with `gunicorn -c serve.py`
+bind = f"0.0.0.0:{os.getenv('PORT', '5002')}"
+workers = int(os.getenv("WEB_WORKERS") or available_cores())
+# Story turns spend their time waiting on OpenAI, so each process serves many on threads
+worker_class = "gthread"
+threads = int(os.getenv("WEB_THREADS", "32"))
+preload_app = True
+graceful_timeout = int(os.getenv("WEB_DRAIN_SECONDS", "60"))
+timeout = int(os.getenv("WEB_TIMEOUT", "120"))
+keepalive = 5
+
+# --- Shared state ---
+# Set before the app is imported: the stores read these when their module loads
+STATE_DIR = os.getenv("STORY_QUEST_STATE_DIR", os.path.join(ROOT, "var"))
+os.makedirs(STATE_DIR, exist_ok=True)
+os.environ.setdefault("SESSION_STORE_PATH", os.path.join(STATE_DIR, "sessions.db"))
+os.environ.setdefault("MODERATION_CACHE_PATH", os.path.join(STATE_DIR, "moderation_cache.db"))
+os.environ.setdefault("IDEMPOTENCY_PATH", os.path.join(STATE_DIR, "idempotency.db"))
+os.environ.setdefault("IMAGE_JOBS_PATH", os.path.join(STATE_DIR, "image_jobs.db"))
+os.environ.setdefault("RATE_LIMIT_PATH", os.path.join(STATE_DIR, "rate_limits.db"))
+os.environ.setdefault("STARTER_POOL_PATH", os.path.join(STATE_DIR, "starters.db"))
+# Host-wide limits (ratelimit.py) and the global usage budget are split across this many processes
+os.environ.setdefault("WEB_WORKERS", str(workers))
+# Also with one worker: sessions then survive a worker restart
+os.environ.setdefault("SESSION_SHARED", "1")
+
+
+# --- Hooks ---
+def _story_app():
+    # The shared stores and background workers belong to server.py (asgi.py reuses them)
+    return sys.modules.get("server")
+
+
+def when_ready(arbiter):
+    app = _story_app()
+    if app is not None:
+        # Once, before any worker starts taking image jobs
+        app.image_jobs.recover()
+
+
+def post_worker_init(worker):
+    app = _story_app()
+    if app is not None:
+        app.start_background_workers(recover=False)
+
+
+def worker_exit(arbiter, worker):
+    app = _story_app()
+    if app is not None:
+        app.stop_background_workers(timeout=5)
+
+
+def load_app(name):
+    """The WSGI/ASGI app for a name in APPS."""
+    target = APPS[name]
+    if target.endswith(".py"):
+        # story-server.py is not an importable module name
+        spec = importlib.util.spec_from_file_location("story_server", os.path.join(ROOT, target))
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[spec.name] = module
+        spec.loader.exec_module(module)
+    else:
+        module = importlib.import_module(target)
+    return module.app
+
+
+def main(argv=None):
+    import argparse
+
+    from gunicorn.app.base import BaseApplication
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--app", choices=sorted(APPS), default="server", help="Which API to serve")
+    parser.add_argument("--workers", type=int, help="Worker processes (default WEB_WORKERS or CPU cores)")
+    parser.add_argument("--port", type=int, help="Port to listen on (default PORT or 5002)")
+    args = parser.parse_args(argv)
+
+    settings = {name: value for name, value in globals().items() if name in (
+        "bind", "workers", "worker_class", "threads", "preload_app", "graceful_timeout", "timeout",
+        "keepalive", "when_ready", "post_worker_init", "worker_exit",
+    )}
+    if args.workers:
+        settings["workers"] = args.workers
+        os.environ["WEB_WORKERS"] = str(args.workers)
+    if args.port:
+        settings["bind"] = f"0.0.0.0:{args.port}"
+    if args.app == "asgi":
+        settings["worker_class"] = "uvicorn.workers.UvicornWorker"
+
+    class Application(BaseApplication):
+        def load_config(self):
+            for name, value in settings.items():
+                self.cfg.set(name, value)
+
+        def load(self):
+            sys.path.insert(0, ROOT)
+            return load_app(args.app)
+
+    Application().run()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,76 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, request, jsonify, send_from_directory, Response, stream_with_context, url_for, g
 from flask_cors import CORS
-from N2G.crew import build_prompt_only_crew, build_continue_only_crew
+from N2G.crew import prompt_crews, continue_crews, budget_prompt_crews, budget_continue_crews, BUDGET_MODEL, CREW_MODEL
+from N2G import mock_backend
+from N2G.direct import (
+    SentenceBuffer,
+    complete_sentences,
+    estimate_messages_usage,
+    estimate_usage,
+    first_sentences,
+    render_messages,
+    stream_task,
+    trim_sentences,
+)
+from N2G.context import ContextCompactor, count_tokens, make_openai_summarizer
+from content_filter import keyword_filter
+from moderation_cache import moderation_cache, categories_to_dict
+from pipeline import prescreen, run_moderated_turn
+from starter_pool import StarterPool
+from text_analysis import text_analyzer, TOO_EASY, TOO_HARD
+from image_store import IMAGES_DIR, IMAGE_MAX_AGE, store_image, image_cache, prompt_key, cached_filename
+from singleflight import SingleFlight
+from image_jobs import ImageJobQueue, QueueFull, InvalidWebhook
+from sessions import SessionStore
+from idempotency import (
+    IDEMPOTENT_REPLAYS,
+    IdempotencyStore,
+    InProgress,
+    KeyReused,
+    StoredResponse,
+    fingerprint,
+    valid_key,
+)
+from metrics import (
+    CONTENT_TYPE as METRICS_CONTENT_TYPE,
+    REQUEST_SECONDS,
+    STAGE_SECONDS,
+    bind_request,
+    configure_logging,
+    in_request_context,
+    log_payload,
+    render as render_metrics,
+    upstream_error,
+)
+from usage import usage_tracker, crew_tokens, BudgetExceeded, DOWNGRADE, FALLBACK
+from fallbacks import generate_fallback_story, is_fallback_story
+from ratelimit import (
+    RateLimited,
+    Saturated,
+    chat_slots,
+    client_ip,
+    image_slots,
+    rate_limiter,
+    retry_after_header,
+)
+from resilience import (
+    CircuitOpen,
+    chat as chat_upstream,
+    images as images_upstream,
+    is_transient,
+    moderation as moderation_upstream,
+    upstream_states,
+)
+from concurrent.futures import ThreadPoolExecutor, wait as wait_futures
+from functools import partial, wraps
 import os
+import threading
 import traceback
+import time
 import logging
 from dotenv import load_dotenv
 import openai
 import base64
-import uuid
 import json
 from openai import OpenAI
 import re
@@ -15,12 +78,12 @@ import re
 # Load environment variables
 load_dotenv()
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
+# Configure logging (LOG_LEVEL, request ids; see metrics.py)
+configure_logging()
 logger = logging.getLogger(__name__)
 
 # Validate environment variables
-if not os.getenv("OPENAI_API_KEY"):
+if not mock_backend.is_enabled() and not os.getenv("OPENAI_API_KEY"):
     logger.error("OPENAI_API_KEY environment variable is not set!")
     raise ValueError("OPENAI_API_KEY environment variable is required")
 
@@ -28,172 +91,992 @@ app = Flask(__name__)
 # Configure CORS to allow all origins in development
 CORS(app, resources={r"/*": {"origins": "*"}}, supports_credentials=True)
 
-# Configure OpenAI
+# Configure OpenAI (STORY_QUEST_BACKEND=mock swaps in a local stand-in for load testing)
 openai.api_key = os.getenv('OPENAI_API_KEY')
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+if mock_backend.is_enabled():
+    logger.warning("Using mock OpenAI backend")
+    client = mock_backend.MockOpenAI()
+else:
+    # Retries, deadlines and circuit breaking are done in resilience.py, not by the SDK
+    client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0)
+
+MODERATION_BATCH_SIZE = 32
+
+# Sentences of a streamed continuation are moderated off the response thread
+moderation_executor = ThreadPoolExecutor(max_workers=int(os.getenv("MODERATION_THREADS", "16")))
+
+# Keeps continuation prompts bounded as stories grow
+story_context = ContextCompactor(
+    make_openai_summarizer(client, on_response=usage_tracker.record_response, upstream=chat_upstream)
+)
 
 # Create images directory if it doesn't exist
-IMAGES_DIR = 'generated_images'
 if not os.path.exists(IMAGES_DIR):
     os.makedirs(IMAGES_DIR)
 
 def contains_prohibited_content(text):
-    # Basic keyword-based filter for profanity, hate speech, sexual content, violence, and dangerous acts
-    # This is not exhaustive, but covers common cases
-    prohibited_keywords = [
-        # Profanity (sample, not exhaustive)
-        'fuck', 'shit', 'bitch', 'asshole', 'bastard', 'dick', 'pussy', 'cunt', 'fag', 'slut', 'whore',
-        # Hate speech
-        'nigger', 'nigga', 'chink', 'spic', 'kike', 'faggot', 'tranny', 'retard', 'gook', 'wetback',
-        # Sexual content
-        'sex', 'sexual', 'nude', 'naked', 'porn', 'penis', 'vagina', 'boobs', 'breasts', 'cum', 'ejaculate', 'masturbate', 'orgasm',
-        # Violence
-        'kill', 'murder', 'rape', 'stab', 'shoot', 'gun', 'bomb', 'terrorist', 'terrorism', 'suicide', 'hang', 'lynch', 'molest',
-        # Dangerous acts
-        'overdose', 'self-harm', 'cutting', 'bleed', 'poison', 'chloroform', 'strangle', 'asphyxiate', 'arson', 'explosive', 'explosion'
-    ]
-    text_lower = text.lower()
-    for word in prohibited_keywords:
-        if word in text_lower:
-            return True, word
-    return False, None
+    # Basic keyword-based filter for profanity, hate speech, sexual content, violence, and dangerous acts.
+    # The list is in N2G/config/prohibited_keywords.yaml; see content_filter.py
+    keyword = keyword_filter.find(text)
+    return keyword is not None, keyword
+
+def prohibited(keyword):
+    """The moderation verdict for text the keyword filter rejected."""
+    return False, {"error": f"Content blocked for safety reasons: contains prohibited word '{keyword}'"}
+
+def split_passages(text):
+    """The distinct non-empty lines (turns) of student input."""
+    return list(dict.fromkeys(line.strip() for line in text.splitlines() if line.strip()))
+
+def screen_passages(passages):
+    """
+    Everything moderation does before calling the API; shared with asgi.py.
+
+    Returns (verdict, verdicts, batches). verdict is final when the keyword
+    filter rejected a passage. Otherwise verdicts holds what needs no API
+    call (our own canned text, cached verdicts) and batches the rest, to
+    send to the moderation API and hand to record_verdicts().
+    """
+    for passage in passages:
+        is_blocked, keyword = contains_prohibited_content(passage)
+        if is_blocked:
+            logger.info("Built-in filter blocked content for keyword: %s", keyword)
+            return prohibited(keyword), None, None
+    verdicts = {}
+    misses = []
+    for passage in passages:
+        # Our own canned text needs no API check, so fallback turns still work when moderation is down
+        verdict = (False, None) if is_fallback_story(passage) else moderation_cache.get(passage)
+        if verdict is None:
+            misses.append(passage)
+        else:
+            verdicts[passage] = verdict
+    batches = [misses[start:start + MODERATION_BATCH_SIZE] for start in range(0, len(misses), MODERATION_BATCH_SIZE)]
+    return None, verdicts, batches
+
+def record_verdicts(batch, response, verdicts):
+    """Cache the moderation API's verdicts for batch and add them to verdicts."""
+    for passage, results in zip(batch, response.results):
+        verdict = (results.flagged, categories_to_dict(results.categories))
+        moderation_cache.put(passage, verdict)
+        verdicts[passage] = verdict
+
+def moderation_failed(e):
+    """The verdict when the moderation API call raised e: fail closed."""
+    if isinstance(e, CircuitOpen):
+        # Straight away rather than after a timeout
+        return False, {"error": "Moderation is temporarily unavailable"}
+    upstream_error("moderation")
+    logger.error("Moderation API error: %s", e)
+    return False, {"error": "Moderation API error"}
+
+def first_flagged(passages, verdicts):
+    for passage in passages:
+        flagged, categories = verdicts[passage]
+        if flagged:
+            return False, categories
+    return True, None
+
+def moderate(passages):
+    """Moderate passages: keyword filter, then the verdict cache, then one API request per batch of misses."""
+    verdict, verdicts, batches = screen_passages(passages)
+    if verdict is not None:
+        return verdict
+    for batch in batches:
+        try:
+            with STAGE_SECONDS.time(stage="moderation"):
+                response = moderation_upstream.call(client.moderations.create, input=batch)
+        except Exception as e:
+            return moderation_failed(e)
+        record_verdicts(batch, response, verdicts)
+    return first_flagged(passages, verdicts)
 
 def moderate_content(text):
-    # First, check with built-in filter
-    is_blocked, keyword = contains_prohibited_content(text)
-    if is_blocked:
-        print(f"Built-in filter blocked content for keyword: {keyword}")
-        return False, {"error": f"Content blocked for safety reasons: contains prohibited word '{keyword}'"}
+    return moderate([text])
+
+def moderate_passages(text):
+    """
+    Moderate multi-line student input one line (turn) at a time.
+
+    Lines already seen hit the verdict cache, so each turn only sends the new
+    lines to the moderation API, batched into one request.
+    """
+    return moderate(split_passages(text))
+
+def build_image_prompt(story):
+    """Turn a finished story into a DALL-E prompt."""
+    # Preprocess the story: remove numbered lists and dialogue labels
+    story_for_image = re.sub(r'\d+\.\s.*', '', story)  # Remove numbered lists
+    story_for_image = re.sub(r'[A-Za-z]+:', '', story_for_image)  # Remove dialogue labels
+    story_for_image = story_for_image.strip()
+
+    # Create a prompt for image generation based on the story
+    return (
+        "Absolutely do not include any text, words, numbers, or writing of any kind in the image. "
+        "No signs, no books, no visible writing. "
+        "Create a beautiful, child-friendly illustration summarizing this story visually: "
+        f"{story_for_image[:1000]}"
+    )
+
+def render_story_image(story):
+    """
+    Return (filename, remote_url) for a story's illustration.
+
+    Images are keyed by a hash of the normalized prompt, so a story that was
+    already illustrated is served from disk, and concurrent requests for the
+    same story share one DALL-E call. remote_url is only set when the image
+    could not be stored locally.
+    """
+    prompt = build_image_prompt(story)
+    key = prompt_key(prompt)
+    filename = image_cache.lookup(key)
+    if filename:
+        return filename, None
+    result, _ = image_flights.do(key, generate_and_store_image, prompt, story, key)
+    return result
+
+# One illustration per story; GPT-4o doesn't generate images, DALL-E 3 is the current image generation model
+IMAGE_REQUEST = {"model": "dall-e-3", "size": "1024x1024", "quality": "standard", "n": 1}
+
+def already_stored(key):
+    """The stored image's filename if a flight that finished after our lookup already stored it."""
+    filename = cached_filename(key)
+    return filename if os.path.isfile(os.path.join(IMAGES_DIR, filename)) else None
+
+def keep_image(response, story, key):
+    """Record a DALL-E response's usage and store its image; (filename, remote_url) as in render_story_image."""
+    usage_tracker.record("dall-e-3", images=1)
+    image_url = response.data[0].url
+    filename, stored = store_image(image_url, story, filename=cached_filename(key), key=key)
+    image_cache.evict()
+    return filename, None if stored else image_url
+
+def generate_and_store_image(prompt, story, key):
+    filename = already_stored(key)
+    if filename:
+        return filename, None
+    try:
+        with STAGE_SECONDS.time(stage="image_generation"):
+            response = images_upstream.call(client.images.generate, prompt=prompt, **IMAGE_REQUEST)
+    except CircuitOpen:
+        raise
+    except Exception:
+        upstream_error("images")
+        raise
+    return keep_image(response, story, key)
+
+image_flights = SingleFlight()
+
+def kickoff(crew, inputs, model, session_id=None):
+    """
+    Run a crew and return its output, timing it, counting failures and
+    recording usage. The output is cut after STORY_MAX_SENTENCES sentences:
+    a crew cannot be stopped mid-answer, so it is only trimmed afterwards.
+    """
+    before = crew_tokens(crew)
+    try:
+        with STAGE_SECONDS.time(stage="crew_kickoff"):
+            # The LLM client bounds and retries each call; the breaker skips the crew during an outage
+            output = chat_upstream.protect(crew.kickoff, inputs=inputs)
+    except CircuitOpen:
+        raise
+    except Exception:
+        upstream_error("crew")
+        raise
+    usage_tracker.record_crew(model, before, crew_tokens(crew, output), session_id)
+    return trim_sentences(str(output), STORY_MAX_SENTENCES)
+
+for pool in (prompt_crews, continue_crews, budget_prompt_crews, budget_continue_crews):
+    pool.on_build = partial(STAGE_SECONDS.observe, stage="crew_build")
+
+def direct_completion(task_name, inputs, model, session_id=None):
+    """
+    Run a task as one chat-completions call instead of a crew, timing it and
+    recording usage. The call is streamed and cancelled once
+    STORY_MAX_SENTENCES sentences are in, so the model does not go on
+    writing text that would be cut off anyway.
+    """
+    messages = render_messages(task_name, inputs)
+    try:
+        with STAGE_SECONDS.time(stage="direct_completion"):
+            text = chat_upstream.call(complete_sentences, client, messages, STORY_MAX_SENTENCES, model=model)
+    except CircuitOpen:
+        raise
+    except Exception:
+        upstream_error("chat")
+        raise
+    # A cancelled stream reports no usage, so count what was sent and kept
+    usage_tracker.record(model, *estimate_messages_usage(messages, text), session_id=session_id)
+    return text
+
+# Story turns ("start" or "continue") run on a pooled CrewAI crew, or with
+# STORY_ENGINE_START / STORY_ENGINE_CONTINUE=direct as one chat-completions
+# call rendered from the same agents.yaml and tasks.yaml (N2G/direct.py)
+STORY_ENGINES = {
+    "start": os.getenv("STORY_ENGINE_START", "crew").lower(),
+    "continue": os.getenv("STORY_ENGINE_CONTINUE", "crew").lower(),
+}
+# (normal, over budget) crew pools per kind of turn
+TURN_POOLS = {
+    "start": (prompt_crews, budget_prompt_crews),
+    "continue": (continue_crews, budget_continue_crews),
+}
+DIRECT_TASKS = {"start": "generate_prompt", "continue": "continue_story"}
+# The story tasks ask for 2-3 sentences; generation stops (or crew output is cut) after this many
+STORY_MAX_SENTENCES = int(os.getenv("STORY_MAX_SENTENCES", "3"))
+# Genres a client may pick; the genre is put into the prompt, so nothing else is accepted
+STORY_GENRES = [
+    genre.strip().lower()
+    for genre in os.getenv("STORY_GENRES", "adventure,fantasy,mystery,animals,space,funny").split(",")
+    if genre.strip()
+]
+
+def story_genre(genre):
+    """The requested genre (adventure if none), or ValueError if it is not one of STORY_GENRES."""
+    genre = (genre or 'adventure').strip().lower()
+    if genre not in STORY_GENRES:
+        raise ValueError(f"genre must be one of: {', '.join(STORY_GENRES)}")
+    return genre
+
+def turn_engine(kind, session_id=None):
+    """
+    How to run one story turn within the usage budget; shared with asgi.py.
+
+    Returns ("direct", model) or ("crew", pool): over budget the turn runs
+    on BUDGET_MODEL. None means the turn is served by its fallback: past the
+    hard limit, or while the chat breaker is open.
+    """
+    if not chat_upstream.available():
+        return None
+    plan = usage_tracker.plan(session_id)
+    if plan == FALLBACK:
+        return None
+    over_budget = plan == DOWNGRADE
+    if STORY_ENGINES[kind] == "direct":
+        return "direct", BUDGET_MODEL if over_budget else CREW_MODEL
+    return "crew", TURN_POOLS[kind][over_budget]
+
+def serves_fallback(e):
+    """True if a turn that raised e is served by its fallback: the chat upstream is down, not the request bad."""
+    if not (isinstance(e, CircuitOpen) or is_transient(e)):
+        return False
+    logger.warning("Chat upstream unavailable, serving fallback story: %s", e)
+    return True
+
+def turn_inputs(kind, grade_level, story_so_far, genre=None, challenge=None, session_id=None):
+    """Task inputs for a story turn; long stories are cut down to a summary plus the latest sentences."""
+    if kind == "start":
+        return {
+            "grade_level": grade_level,
+            "story_so_far": story_so_far,
+            "genre": genre,
+            "is_single_sentence": True  # Request a single sentence response
+        }
+    return {
+        "grade_level": grade_level,
+        "story_so_far": story_context.compact(story_so_far, session_id),
+        "challenge": challenge,
+        "is_single_sentence": True
+    }
+
+def story_turn(kind, build_inputs, session_id=None, fallback=None):
+    """
+    Return generate() for one story turn, within the usage budget.
+
+    Over budget the turn runs on BUDGET_MODEL; past the hard limit it is
+    served by fallback() without calling the model. fallback() is also used
+    while the chat breaker is open and when the model fails after its
+    retries. A crew is only leased once generate() runs, so a turn whose
+    input is rejected before then (or whose generate() is cancelled) holds
+    no crew.
+    """
+    engine = turn_engine(kind, session_id)
+    if engine is None:
+        return fallback
+    engine, target = engine
+    if engine == "direct":
+        run = lambda inputs: direct_completion(DIRECT_TASKS[kind], inputs, target, session_id)
+    else:
+        def run(inputs):
+            crew = target.acquire()
+            try:
+                return kickoff(crew, inputs, target.model, session_id)
+            finally:
+                target.release(crew)
+
+    def generate():
+        try:
+            inputs = build_inputs()
+            result = run(inputs)
+        except Exception as e:
+            if not serves_fallback(e):
+                raise
+            return fallback()
+        if result:
+            check_reading_level(result, inputs.get("grade_level"))
+        return result
+    return generate
+
+def check_reading_level(text, grade_level):
+    """Count (and log, if it is off) how a generated turn's reading level fits grade_level; no model call."""
+    stats = text_analyzer.check(text, grade_level)
+    if stats.grade_fit in (TOO_EASY, TOO_HARD):
+        logger.info("Story turn reads at grade %s, %s for %s", stats.reading_grade, stats.grade_fit, grade_level)
+    return stats
+
+def generate_starter(grade_level, genre):
+    """Generate and moderate one starter for the pool; None if it was blocked."""
+    if not usage_tracker.within_budget():
+        raise BudgetExceeded("Usage budget reached; not pre-generating starters")
+    inputs = {
+        "grade_level": grade_level,
+        "story_so_far": "",
+        "genre": genre,
+        "is_single_sentence": True
+    }
+    if STORY_ENGINES["start"] == "direct":
+        result = direct_completion(DIRECT_TASKS["start"], inputs, CREW_MODEL)
+    else:
+        crew = prompt_crews.acquire()
+        try:
+            result = kickoff(crew, inputs, prompt_crews.model)
+        finally:
+            prompt_crews.release(crew)
+    if not result:
+        return None
+    is_safe, _ = moderate_content(result)
+    return result if is_safe else None
+
+starter_pool = StarterPool(generate_starter)
+
+image_jobs = ImageJobQueue(render_story_image)
+
+sessions = SessionStore()
+
+# --- Readiness ---
+# Importing this module stays cheap: the crew stack (crewai, langchain) is only
+# imported when the first crew is built. With STORY_QUEST_PREWARM on (the
+# default) a background thread does that, one crew per pool in use, while the
+# server is already answering; /health/ready is 503 until it has finished.
+PREWARM = os.getenv("STORY_QUEST_PREWARM", "1").lower() not in ("0", "false", "no")
+warmup = {"ready": not PREWARM, "seconds": None, "error": None}
+
+def prewarm():
+    """Build the first crews and load the tokenizer before the first story turn needs them."""
+    start = time.perf_counter()
     try:
-        response = client.moderations.create(input=text)
-        results = response.results[0]
-        if results.flagged:
-            return False, results.categories
-        return True, None
+        for kind, engine in STORY_ENGINES.items():
+            if engine == "crew":
+                TURN_POOLS[kind][0].prewarm(1)
+        count_tokens("")
     except Exception as e:
-        print(f"Moderation API error: {e}")
-        return False, {"error": "Moderation API error"}
+        # Not fatal: each turn builds its own crew (or falls back) as before
+        logger.error("Pre-warm failed: %s", e)
+        warmup['error'] = str(e)
+    warmup['seconds'] = round(time.perf_counter() - start, 3)
+    warmup['ready'] = True
+    logger.info("Ready after %ss of pre-warm", warmup['seconds'])
+
+_workers_started = threading.Event()
+
+def start_background_workers(recover=True):
+    """
+    Start the threads that serve the app, once per serving process.
+
+    recover requeues image jobs a dead process left running; serve.py does
+    that once before forking and passes False here.
+    """
+    if _workers_started.is_set():
+        return
+    _workers_started.set()
+    starter_pool.start()
+    image_jobs.start(recover=recover)
+    if PREWARM:
+        threading.Thread(target=prewarm, name="prewarm", daemon=True).start()
+
+def stop_background_workers(timeout=None):
+    """Stop refilling and taking jobs, wait up to timeout for running image jobs, save sessions."""
+    starter_pool.stop()
+    image_jobs.stop(timeout)
+    sessions.flush()
+
+idempotency = IdempotencyStore()
+
+def is_done_event(event):
+    return event.startswith("event: done\n")
+
+def idempotent(view):
+    """
+    Honour an Idempotency-Key header on a story turn (see idempotency.py).
+
+    Duplicates of a request that is still running wait for it; finished
+    responses are replayed. Streamed turns replay their final `done` event.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+        if not key:
+            return view(*args, **kwargs)
+        if not valid_key(key):
+            return jsonify({"error": "Invalid Idempotency-Key"}), 400
+        scoped = f"{request.path}:{key}"
+        try:
+            stored, source = idempotency.claim(scoped, fingerprint(request.method, request.path, request.get_data()))
+        except KeyReused as e:
+            return jsonify({"error": str(e)}), 422
+        except InProgress as e:
+            return jsonify({"error": str(e)}), 409
+
+        if stored is not None:
+            IDEMPOTENT_REPLAYS.inc(endpoint=request.endpoint, source=source)
+            return Response(stored.body, status=stored.status, content_type=stored.content_type,
+                            headers={'Idempotent-Replayed': 'true'})
+
+        try:
+            response = app.make_response(view(*args, **kwargs))
+        except BaseException:
+            idempotency.abandon(scoped)
+            raise
+        if response.is_streamed:
+            response.response = idempotency.record_stream(scoped, response.response, is_done_event)
+            # Also runs if the client is gone before the body is read at all
+            response.call_on_close(idempotency.release_on_close(scoped))
+        else:
+            idempotency.finish(scoped, StoredResponse(response.status_code, response.get_data(), response.content_type))
+        return response
+    return wrapper
+
+def request_user(view_args):
+    """The player a request is counted against: its session, if it names one."""
+    if view_args.get('session_id'):
+        return view_args['session_id']
+    data = request.get_json(silent=True)
+    return data.get('sessionId') if isinstance(data, dict) else None
+
+def rejection(e):
+    """(body, status, headers) for a request turned away by a rate limit (429) or a concurrency cap (503)."""
+    status = 429 if isinstance(e, RateLimited) else 503
+    return {"error": str(e)}, status, {'Retry-After': retry_after_header(e.retry_after)}
+
+def admitted(kind, slots=None):
+    """
+    Apply kind's rate limits and, if given, an upstream's concurrency cap to
+    a route (see ratelimit.py). Rejected requests get 429 or 503 with a
+    Retry-After. The slot is held until the response, streamed or not, has
+    been sent.
+    """
+    def decorate(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            ip = client_ip(request.remote_addr, request.headers.get('X-Forwarded-For'))
+            try:
+                rate_limiter.admit(kind, user=request_user(kwargs), ip=ip)
+                if slots is not None:
+                    slots.acquire()
+            except (RateLimited, Saturated) as e:
+                body, status, headers = rejection(e)
+                return jsonify(body), status, headers
+            if slots is None:
+                return view(*args, **kwargs)
+            try:
+                response = app.make_response(view(*args, **kwargs))
+            except BaseException:
+                slots.release()
+                raise
+            response.call_on_close(slots.release)
+            return response
+        return wrapper
+    return decorate
+
+@app.before_request
+def start_request_context():
+    g.request_start = time.perf_counter()
+    g.request_id = bind_request(request.endpoint, request.headers.get('X-Request-ID'))
+
+@app.after_request
+def finish_request_context(response):
+    response.headers['X-Request-ID'] = g.request_id
+    endpoint = request.endpoint or 'unmatched'
+    status = str(response.status_code)
+    start = g.request_start
+    # Streamed bodies are still being sent at this point, so observe when the response closes
+    response.call_on_close(
+        lambda: REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint, status=status)
+    )
+    return response
+
+# --- Story turns ---
+# The parsing, inputs and replies below are shared with asgi.py's handlers
+
+def turn_request(data, story_required=False):
+    """(grade_level, story_so_far) of a stateless story-turn request; ValueError if a field is missing."""
+    if not data:
+        raise ValueError("No data received in request")
+    grade_level = data.get('gradeLevel')
+    if not grade_level:
+        raise ValueError("gradeLevel is required")
+    story_so_far = data.get('storySoFar') or ''
+    if story_required and not story_so_far:
+        raise ValueError("storySoFar is required")
+    return grade_level, story_so_far
+
+def turn_reply(result, is_safe, categories, missing):
+    """(body, status) for a finished stateless turn; ValueError(missing) if nothing was generated."""
+    if not is_safe:
+        return {"error": f"Content blocked for safety reasons: {categories}"}, 400
+    if not result:
+        raise ValueError(missing)
+    return {"story": result}, 200
 
 @app.route('/api/start-story', methods=['POST'])
+@idempotent
+@admitted('story', chat_slots)
 def start_story():
     try:
         logger.debug("Received start-story request")
         data = request.json
-        logger.debug(f"Request data: {data}")
+        log_payload(logger, "Request data", data)
+        grade_level, story_so_far = turn_request(data)
+        genre = story_genre(data.get('genre'))
         
-        if not data:
-            raise ValueError("No data received in request")
-            
-        grade_level = data.get('gradeLevel')
-        if not grade_level:
-            raise ValueError("gradeLevel is required")
-            
-        story_so_far = data.get('storySoFar', '')
+        # A fresh game can be served straight from the pre-generated pool
+        if not story_so_far:
+            starter = starter_pool.pop(grade_level, genre)
+            if starter:
+                logger.debug("Served starter from pool")
+                return jsonify({"story": starter})
         
-        logger.debug(f"Building prompt crew with grade_level={grade_level}")
+        logger.debug("Building prompt crew with grade_level=%s", grade_level)
         try:
-            crew = build_prompt_only_crew()
+            generate = story_turn(
+                "start",
+                lambda: turn_inputs("start", grade_level, story_so_far, genre=genre),
+                data.get('sessionId'),
+                fallback=lambda: generate_fallback_story(grade_level, data.get('challenge'), story_so_far)
+            )
         except Exception as e:
-            logger.error(f"Error building crew: {str(e)}")
+            logger.error("Error building crew: %s", e)
             logger.error(traceback.format_exc())
             raise ValueError(f"Failed to initialize story generation: {str(e)}")
         
         logger.debug("Kicking off crew")
         try:
-            result = str(crew.kickoff(inputs={
-                "grade_level": grade_level,
-                "story_so_far": story_so_far,
-                "genre": "adventure",  # Add default genre
-                "is_single_sentence": True  # Request a single sentence response
-            })).strip()
-            
-            if not result:
-                raise ValueError("No story was generated")
-            
-            # Moderation check
-            is_safe, categories = moderate_content(result)
-            if not is_safe:
-                return jsonify({"error": f"Content blocked for safety reasons: {categories}"}), 400
-            
-            logger.debug(f"Generated story: {result}")
-            return jsonify({"story": result})
+            # Any student text is moderated while the crew runs; the output is moderated after
+            result, is_safe, categories = run_moderated_turn(
+                generate, story_so_far, moderate_passages, moderate_content
+            )
+            body, status = turn_reply(result, is_safe, categories, "No story was generated")
+            log_payload(logger, "Generated story", result)
+            return jsonify(body), status
         except Exception as e:
-            logger.error(f"Error generating story: {str(e)}")
+            logger.error("Error generating story: %s", e)
             logger.error(traceback.format_exc())
             raise ValueError(f"Failed to generate story: {str(e)}")
             
     except ValueError as ve:
-        logger.error(f"Validation error in start_story: {str(ve)}")
+        logger.error("Validation error in start_story: %s", ve)
         return jsonify({"error": str(ve)}), 400
     except Exception as e:
-        logger.error(f"Error in start_story: {str(e)}")
+        logger.error("Error in start_story: %s", e)
         logger.error(traceback.format_exc())
         return jsonify({"error": str(e)}), 500
 
 @app.route('/api/continue-story', methods=['POST'])
+@idempotent
+@admitted('story', chat_slots)
 def continue_story():
     try:
         logger.debug("Received continue-story request")
         data = request.json
-        logger.debug(f"Request data: {data}")
-        
-        # Validate required fields
-        if not data:
-            raise ValueError("No data received in request")
-            
-        grade_level = data.get('gradeLevel')
-        if not grade_level:
-            raise ValueError("gradeLevel is required")
-            
-        story_so_far = data.get('storySoFar')
-        if not story_so_far:
-            raise ValueError("storySoFar is required")
-            
+        log_payload(logger, "Request data", data)
+        grade_level, story_so_far = turn_request(data, story_required=True)
         challenge = data.get('challenge')
         
-        logger.debug(f"Building continue crew with grade_level={grade_level}")
-        logger.debug(f"Story so far: {story_so_far[:100]}...")  # Log first 100 chars of story
+        logger.debug("Building continue crew with grade_level=%s", grade_level)
+        log_payload(logger, "Story so far", story_so_far[:100])
         
         try:
-            crew = build_continue_only_crew()
+            generate = story_turn(
+                "continue",
+                lambda: turn_inputs("continue", grade_level, story_so_far, challenge=challenge,
+                                    session_id=data.get('sessionId')),
+                data.get('sessionId'),
+                fallback=lambda: generate_fallback_story(grade_level, challenge, story_so_far)
+            )
         except Exception as e:
-            logger.error(f"Error building crew: {str(e)}")
+            logger.error("Error building crew: %s", e)
             logger.error(traceback.format_exc())
             raise ValueError(f"Failed to initialize story continuation: {str(e)}")
         
         logger.debug("Kicking off crew")
         try:
-            result = str(crew.kickoff(inputs={
-                "grade_level": grade_level,
-                "story_so_far": story_so_far,
-                "challenge": challenge,
-                "is_single_sentence": True  # Request a single sentence response
-            })).strip()
-            
-            if not result:
-                raise ValueError("No story continuation was generated")
-            
-            # Moderation check
-            is_safe, categories = moderate_content(result)
-            if not is_safe:
-                return jsonify({"error": f"Content blocked for safety reasons: {categories}"}), 400
-            
-            logger.debug(f"Generated continuation: {result}")
-            return jsonify({"story": result})
+            # The student's story is moderated while the crew runs; the output is moderated after
+            result, is_safe, categories = run_moderated_turn(
+                generate, story_so_far, moderate_passages, moderate_content
+            )
+            body, status = turn_reply(result, is_safe, categories, "No story continuation was generated")
+            log_payload(logger, "Generated continuation", result)
+            return jsonify(body), status
         except Exception as e:
-            logger.error(f"Error generating continuation: {str(e)}")
+            logger.error("Error generating continuation: %s", e)
             logger.error(traceback.format_exc())
             raise ValueError(f"Failed to generate story continuation: {str(e)}")
             
     except ValueError as ve:
-        logger.error(f"Validation error in continue_story: {str(ve)}")
+        logger.error("Validation error in continue_story: %s", ve)
         return jsonify({"error": str(ve)}), 400
     except Exception as e:
-        logger.error(f"Error in continue_story: {str(e)}")
+        logger.error("Error in continue_story: %s", e)
         logger.error(traceback.format_exc())
         return jsonify({"error": str(e)}), 500
 
+def sse_event(event, payload):
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+@app.route('/api/continue-story/stream', methods=['POST'])
+@idempotent
+@admitted('story', chat_slots)
+def continue_story_stream():
+    """
+    Streaming variant of /api/continue-story using Server-Sent Events.
+
+    Emits a `token` event per model delta, then `done` with the full
+    continuation. The student's story is moderated while generation starts;
+    tokens are held back until it passes, and a rejection closes the upstream
+    request. Each finished sentence is checked by the keyword filter straight
+    away and by the moderation API in the background; if either rejects it,
+    generation stops and an `error` event tells the client to discard the
+    partial text.
+    """
+    data = request.get_json(silent=True)
+    try:
+        grade_level, story_so_far = turn_request(data, story_required=True)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    blocked = prescreen(story_so_far)
+    if blocked:
+        return jsonify(blocked), 400
+
+    inputs = {
+        "grade_level": grade_level,
+        "challenge": data.get('challenge'),
+    }
+    return sse_response(continuation_events(inputs, story_so_far, story_so_far, data.get('sessionId')))
+
+def sse_response(events):
+    return Response(
+        stream_with_context(events),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+class StreamedTurn:
+    """
+    Moderation and bookkeeping of one streamed continuation, shared with asgi.py.
+
+    The caller feeds it the model's tokens and sends the events it returns.
+    The checks (the input check and check_sentence's results) may be
+    concurrent.futures or asyncio futures: only done(), result() and
+    cancel() are used, and the caller waits for them before finish().
+    """
+
+    def __init__(self, grade_level, session_id, input_check, check_sentence):
+        self.grade_level = grade_level
+        self.session_id = session_id
+        self.input_check = input_check
+        self.check_sentence = check_sentence
+        plan = usage_tracker.plan(session_id)
+        self.model = BUDGET_MODEL if plan == DOWNGRADE else CREW_MODEL
+        # While the chat breaker is open the fallback story is streamed
+        self.fallback = plan == FALLBACK or not chat_upstream.available()
+        self.buffer = SentenceBuffer()
+        self.parts = []
+        self.held = []
+        self.pending = []
+        self.stopped = False
+        self.result = None
+
+    def _blocked(self, categories):
+        self.stopped = True
+        return [sse_event("error", {"error": f"Content blocked for safety reasons: {categories}"})]
+
+    def _release_held(self):
+        events = [sse_event("token", {"token": token}) for token in self.held]
+        self.held = []
+        return events
+
+    def _input_rejected(self):
+        # The input check's verdict if it is in and negative; tokens are held back until it passes
+        if self.input_check is None or not self.input_check.done():
+            return None
+        is_safe, categories = self.input_check.result()
+        self.input_check = None
+        return None if is_safe else categories
+
+    def feed(self, token):
+        """Events to send after token; sets stopped if the turn was rejected."""
+        self.parts.append(token)
+        self.held.append(token)
+        categories = self._input_rejected()
+        if categories:
+            return self._blocked(categories)
+        events = self._release_held() if self.input_check is None else []
+        for sentence in self.buffer.feed(token):
+            is_blocked, keyword = contains_prohibited_content(sentence)
+            if is_blocked:
+                return events + self._blocked({"error": f"contains prohibited word '{keyword}'"})
+            self.pending.append(self.check_sentence(sentence))
+        for future in [f for f in self.pending if f.done()]:
+            self.pending.remove(future)
+            is_safe, categories = future.result()
+            if not is_safe:
+                return events + self._blocked(categories)
+        return events
+
+    def flush(self):
+        """After the last token: the checks to wait for before finish()."""
+        tail = self.buffer.flush()
+        if tail.strip():
+            self.pending.append(self.check_sentence(tail))
+        return [f for f in self.pending + [self.input_check] if f is not None]
+
+    def finish(self):
+        """The closing events; result is set when the continuation passed moderation."""
+        categories = self._input_rejected()
+        if categories:
+            return self._blocked(categories)
+        events = self._release_held()
+        for future in self.pending:
+            is_safe, categories = future.result()
+            if not is_safe:
+                return events + self._blocked(categories)
+        self.pending = []
+        result = "".join(self.parts).strip()
+        if not result:
+            return events + [sse_event("error", {"error": "No story continuation was generated"})]
+        if not self.fallback:
+            check_reading_level(result, self.grade_level)
+        self.result = result
+        return events + [sse_event("done", {"story": result})]
+
+    def failed(self, e):
+        upstream_error("chat")
+        logger.error("Error streaming continuation: %s", e)
+        logger.error(traceback.format_exc())
+        return sse_event("error", {"error": f"Failed to generate story continuation: {str(e)}"})
+
+    def close(self, inputs):
+        for future in self.pending + [self.input_check]:
+            if future is not None:
+                future.cancel()
+        if not self.fallback:
+            # Streamed responses carry no usage, so count what was sent and received
+            usage_tracker.record(self.model, *estimate_usage("continue_story", inputs, "".join(self.parts)),
+                                 session_id=self.session_id)
+
+def continuation_events(inputs, story_so_far, new_text, session_id=None, on_done=None,
+                        moderate_input=moderate_passages):
+    """
+    SSE events for one streamed continuation of story_so_far.
+
+    Only new_text is sent to the moderation API (the whole story for the
+    stateless route, just the latest turn for sessions). on_done(result) is
+    called once the continuation has passed moderation. Over the usage
+    budget the cheaper model (or the fallback story) is streamed instead; the
+    fallback story is also streamed while the chat breaker is open.
+    """
+    input_check = moderation_executor.submit(in_request_context(moderate_input), new_text) if new_text else None
+    turn = StreamedTurn(
+        inputs["grade_level"], session_id, input_check,
+        lambda sentence: moderation_executor.submit(in_request_context(moderate_content), sentence),
+    )
+    if turn.fallback:
+        tokens = canned_tokens(generate_fallback_story(inputs["grade_level"], inputs.get("challenge"), story_so_far))
+    else:
+        inputs = dict(inputs, story_so_far=story_context.compact(story_so_far, session_id))
+        tokens = chat_upstream.protect_stream(first_sentences(
+            stream_task(client, "continue_story", inputs, model=turn.model, timeout=chat_upstream.timeout),
+            STORY_MAX_SENTENCES,
+        ))
+    try:
+        for token in tokens:
+            yield from turn.feed(token)
+            if turn.stopped:
+                return
+        wait_futures(turn.flush())
+        events = turn.finish()
+        if turn.result is not None and on_done is not None:
+            on_done(turn.result)
+        yield from events
+    except Exception as e:
+        yield turn.failed(e)
+    finally:
+        tokens.close()
+        turn.close(inputs)
+
+def canned_tokens(text):
+    yield text
+
+# --- Sessions ---
+# The server keeps the story, so each turn only carries the student's new text
+
+def session_request(data):
+    """(grade_level, genre, story) for a new session; ValueError if the request is invalid."""
+    grade_level = data.get('gradeLevel')
+    if not grade_level:
+        raise ValueError("gradeLevel is required")
+    return grade_level, story_genre(data.get('genre')), data.get('storySoFar') or ''
+
+def open_session(grade_level, genre, story):
+    session = sessions.create(grade_level, genre)
+    session.append(*story.splitlines())
+    return session
+
+def session_turn(session_id, data):
+    """(session, text, story_so_far) for a turn on session_id, or None if there is no such session."""
+    session = sessions.get(session_id)
+    if session is None:
+        return None
+    text = (data.get('text') or '').strip()
+    return session, text, session.extended(text)
+
+def session_starter(session):
+    """Serve an empty session's first turn from the starter pool; the starter, or None if the pool is empty."""
+    starter = starter_pool.pop(session.grade_level, session.genre)
+    if starter:
+        session.append(starter)
+    return starter
+
+def session_turn_reply(session, text, result, is_safe, categories):
+    """Record a finished session turn; (body, status) for the reply."""
+    if not is_safe:
+        if result is None:
+            # The student's text was rejected, so it stays out of the story
+            session.flag()
+        else:
+            session.append(text)
+        return {"error": f"Content blocked for safety reasons: {categories}"}, 400
+    if not result:
+        session.append(text)
+        return {"error": "No story continuation was generated"}, 500
+
+    session.append(text, result)
+    return {"story": result, "sessionId": session.id}, 200
+
+def session_stream_refusal(session, text, story_so_far):
+    """(body, status) if a streamed session turn cannot start, else None; prohibited text flags the session."""
+    if not story_so_far:
+        return {"error": "Session has no story yet"}, 400
+    blocked = prescreen(text)
+    if blocked:
+        session.flag()
+        return blocked, 400
+    return None
+
+@app.route('/api/sessions', methods=['POST'])
+def create_session():
+    """Create a story session, optionally seeded with a story the client already has."""
+    try:
+        grade_level, genre, story = session_request(request.get_json(silent=True) or {})
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if story.strip():
+        is_safe, categories = moderate_passages(story)
+        if not is_safe:
+            return jsonify({"error": f"Content blocked for safety reasons: {categories}"}), 400
+    session = open_session(grade_level, genre, story)
+    return jsonify(session.to_dict(include_story=False)), 201
+
+@app.route('/api/sessions/<session_id>', methods=['GET'])
+def get_session(session_id):
+    session = sessions.get(session_id)
+    if session is None:
+        return jsonify({"error": "Session not found"}), 404
+    return jsonify(session.to_dict())
+
+@app.route('/api/sessions/<session_id>', methods=['DELETE'])
+def delete_session(session_id):
+    sessions.delete(session_id)
+    story_context.forget(session_id)
+    return '', 204
+
+@app.route('/api/sessions/<session_id>/turns', methods=['POST'])
+@idempotent
+@admitted('story', chat_slots)
+def append_session_turn(session_id):
+    """
+    Append the student's new text to a session and return the AI's next line.
+
+    Only the new text is moderated; the rest of the story passed on earlier
+    turns. A session with no story yet gets a starter instead.
+    """
+    data = request.get_json(silent=True) or {}
+    turn = session_turn(session_id, data)
+    if turn is None:
+        return jsonify({"error": "Session not found"}), 404
+    session, text, story_so_far = turn
+
+    if not story_so_far:
+        starter = session_starter(session)
+        if starter:
+            return jsonify({"story": starter, "sessionId": session.id})
+    kind = "continue" if story_so_far else "start"
+
+    try:
+        generate = story_turn(
+            kind,
+            lambda: turn_inputs(kind, session.grade_level, story_so_far, genre=session.genre,
+                                challenge=data.get('challenge'), session_id=session.id),
+            session.id,
+            fallback=lambda: generate_fallback_story(session.grade_level, data.get('challenge'), story_so_far)
+        )
+    except Exception as e:
+        logger.error("Error building crew: %s", e)
+        logger.error(traceback.format_exc())
+        return jsonify({"error": f"Failed to initialize story generation: {str(e)}"}), 500
+
+    try:
+        result, is_safe, categories = run_moderated_turn(generate, text, moderate_passages, moderate_content)
+    except Exception as e:
+        logger.error("Error generating session turn: %s", e)
+        logger.error(traceback.format_exc())
+        return jsonify({"error": f"Failed to generate story continuation: {str(e)}"}), 500
+
+    body, status = session_turn_reply(session, text, result, is_safe, categories)
+    return jsonify(body), status
+
+@app.route('/api/sessions/<session_id>/turns/stream', methods=['POST'])
+@idempotent
+@admitted('story', chat_slots)
+def stream_session_turn(session_id):
+    """Streaming variant of a session turn; same events as /api/continue-story/stream."""
+    data = request.get_json(silent=True) or {}
+    turn = session_turn(session_id, data)
+    if turn is None:
+        return jsonify({"error": "Session not found"}), 404
+    session, text, story_so_far = turn
+    refusal = session_stream_refusal(session, text, story_so_far)
+    if refusal:
+        return jsonify(refusal[0]), refusal[1]
+
+    def moderate_turn(new_text):
+        is_safe, categories = moderate_passages(new_text)
+        if not is_safe:
+            session.flag()
+        return is_safe, categories
+
+    inputs = {
+        "grade_level": session.grade_level,
+        "challenge": data.get('challenge'),
+    }
+    return sse_response(continuation_events(
+        inputs, story_so_far, text, session.id,
+        on_done=lambda result: session.append(text, result),
+        moderate_input=moderate_turn,
+    ))
+
 @app.route('/api/generate-image', methods=['POST'])
+@admitted('image', image_slots)
 def generate_image():
     try:
         data = request.get_json()
@@ -202,44 +1085,9 @@ def generate_image():
         if not story:
             return jsonify({'error': 'Story text is required'}), 400
         
-        # Preprocess the story: remove numbered lists and dialogue labels
-        story_for_image = re.sub(r'\d+\.\s.*', '', story)  # Remove numbered lists
-        story_for_image = re.sub(r'[A-Za-z]+:', '', story_for_image)  # Remove dialogue labels
-        story_for_image = story_for_image.strip()
-        
-        # Create a prompt for image generation based on the story
-        prompt = (
-            "Absolutely do not include any text, words, numbers, or writing of any kind in the image. "
-            "No signs, no books, no visible writing. "
-            "Create a beautiful, child-friendly illustration summarizing this story visually: "
-            f"{story_for_image[:1000]}"
-        )
-        
-        # Generate image using OpenAI's DALL-E 3 (GPT-4o doesn't generate images, DALL-E 3 is the current image generation model)
-        response = openai.images.generate(
-            model="dall-e-3",
-            prompt=prompt,
-            size="1024x1024",
-            quality="standard",
-            n=1,
-        )
-        
-        # Get the image URL
-        image_url = response.data[0].url
-        
-        # Generate a unique filename
-        filename = f"story_image_{uuid.uuid4().hex[:8]}.png"
-        
-        # Save the image URL to a JSON file for reference
-        image_data = {
-            'filename': filename,
-            'url': image_url,
-            'story': story[:200] + "..." if len(story) > 200 else story,
-            'timestamp': str(uuid.uuid4())
-        }
-        
-        with open(os.path.join(IMAGES_DIR, f"{filename}.json"), 'w') as f:
-            json.dump(image_data, f)
+        filename, remote_url = render_story_image(story)
+        # Prefer our stored copy: the DALL-E URL expires after a couple of hours
+        image_url = remote_url or url_for('get_image', filename=filename, _external=True)
         
         return jsonify({
             'success': True,
@@ -247,20 +1095,157 @@ def generate_image():
             'filename': filename
         })
         
+    except CircuitOpen as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': str(int(e.retry_after) + 1)}
     except Exception as e:
-        print(f"Error generating image: {str(e)}")
+        logger.error("Error generating image: %s", e)
         return jsonify({'error': f'Failed to generate image: {str(e)}'}), 500
 
+@app.route('/api/image-jobs', methods=['POST'])
+@admitted('image')
+def submit_image_job():
+    """Queue an image for the story and return immediately with a job id."""
+    data = request.get_json(silent=True) or {}
+    story = data.get('story', '')
+    if not story:
+        return jsonify({'error': 'Story text is required'}), 400
+    try:
+        job_id = image_jobs.submit(story, request.host_url, data.get('webhookUrl'))
+    except InvalidWebhook as e:
+        return jsonify({'error': str(e)}), 400
+    except QueueFull as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '10'}
+    return jsonify({
+        'job_id': job_id,
+        'status': 'queued',
+        'status_url': url_for('get_image_job', job_id=job_id, _external=True)
+    }), 202
+
+@app.route('/api/image-jobs/<job_id>')
+def get_image_job(job_id):
+    job = image_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job)
+
+class JobWatch:
+    """What an image job's event stream sends on each poll; shared with asgi.py."""
+
+    POLL_INTERVAL = 0.5
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.last_status = None
+        self.finished = False
+        # Each open stream holds a request thread (or a connection), so it is closed after a while
+        self.deadline = time.monotonic() + image_jobs.events_max_seconds
+
+    def update(self, job):
+        """Events for the job's latest state (None once it is pruned); sets finished when the stream ends."""
+        if job is None:
+            # Pruned while the client was watching
+            self.finished = True
+            return [sse_event('error', {'job_id': self.job_id, 'error': 'Job not found'})]
+        events = []
+        if job['status'] != self.last_status:
+            self.last_status = job['status']
+            events.append(sse_event('status', job))
+        if job['status'] in ('done', 'failed'):
+            self.finished = True
+        elif time.monotonic() >= self.deadline:
+            self.finished = True
+            events.append(sse_event('error', {'job_id': self.job_id,
+                                              'error': 'Job is still running; poll its status instead'}))
+        return events
+
+@app.route('/api/image-jobs/<job_id>/events')
+def image_job_events(job_id):
+    """Push the job's status over Server-Sent Events until it finishes."""
+    if image_jobs.get(job_id) is None:
+        return jsonify({'error': 'Job not found'}), 404
+
+    def events():
+        watch = JobWatch(job_id)
+        while True:
+            yield from watch.update(image_jobs.get(job_id))
+            if watch.finished:
+                return
+            time.sleep(watch.POLL_INTERVAL)
+
+    return sse_response(events())
+
 @app.route('/api/images/<filename>')
 def get_image(filename):
-    """Serve generated images"""
-    return send_from_directory(IMAGES_DIR, filename)
+    """Serve generated images with validators and long-lived caching (supports Range requests)"""
+    response = send_from_directory(IMAGES_DIR, filename, conditional=True, etag=True, max_age=IMAGE_MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+# --- Reports ---
+# Bodies shared with asgi.py
+
+def cache_report():
+    return {
+        'moderation': moderation_cache.stats(),
+        'starter_pool': starter_pool.stats(),
+        'images': image_cache.stats(),
+        'sessions': sessions.stats(),
+        'idempotency': idempotency.stats()
+    }
+
+def usage_report(session_id=None):
+    """Token and cost totals, with one session's usage if session_id is given."""
+    summary = usage_tracker.summary()
+    if session_id:
+        summary['session'] = usage_tracker.session(session_id)
+    return summary
+
+def health_report():
+    upstreams = upstream_states()
+    degraded = any(u['state'] == 'open' for u in upstreams.values())
+    return {'status': 'degraded' if degraded else 'healthy', 'ready': warmup['ready'],
+            'upstreams': upstreams,
+            'admission': {'chat': chat_slots.stats(), 'images': image_slots.stats()}}
+
+def readiness_report():
+    """(body, status): 503 until pre-warm has finished."""
+    if not warmup['ready']:
+        return {'status': 'starting'}, 503
+    return {'status': 'ready', 'warmup': warmup}, 200
+
+@app.route('/api/cache-stats')
+def cache_stats():
+    return jsonify(cache_report())
+
+@app.route('/api/usage')
+def usage():
+    """Token and cost totals; pass ?sessionId= for one session's usage."""
+    return jsonify(usage_report(request.args.get('sessionId')))
+
+@app.route('/metrics')
+def metrics():
+    return Response(render_metrics(), content_type=METRICS_CONTENT_TYPE)
 
 @app.route('/health')
 def health_check():
-    return jsonify({'status': 'healthy'})
+    return jsonify(health_report())
+
+# Liveness: the process is up and serving. Restart it only if this fails.
+@app.route('/health/live')
+def health_live():
+    return jsonify({'status': 'alive'})
+
+# Readiness: pre-warm has finished, so route traffic here
+@app.route('/health/ready')
+def health_ready():
+    body, status = readiness_report()
+    return jsonify(body), status
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5002))
-    logger.info(f"Starting server on port {port}")
+    logger.info("Starting server on port %s", port)
+    # The reloader runs this block in a parent and a child process; only the child serves
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_background_workers()
     app.run(host='0.0.0.0', port=port, debug=True) 
\ No newline at end of file
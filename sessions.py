@@ -0,0 +1,240 @@
+"""
+Server-side story sessions.
+
+A session holds the story so far, so clients only send the new text each
+turn instead of the whole story. Sessions live in a bounded in-memory LRU;
+when SESSION_STORE_PATH is set, sessions pushed out of memory (by size or
+idleness) are spilled to SQLite and loaded back on their next turn.
+
+With several worker processes (serve.py) a game's turns can land on any of
+them, so SESSION_SHARED=1 keeps sessions in the SQLite file only: every turn
+reads the session from it and every change is written straight back. Two
+turns of the same game racing on different workers are last-write-wins.
+
+    SESSION_MAX_ACTIVE    sessions kept in memory (default 2000)
+    SESSION_IDLE_TTL      seconds without a turn before a session leaves memory (default 1800)
+    SESSION_STORE_PATH    optional SQLite file for spilled sessions
+    SESSION_SPILL_TTL     seconds a spilled session is kept on disk (default 604800)
+    SESSION_SHARED        1 to share sessions across processes through SESSION_STORE_PATH
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class Session:
+    """One game's story and its moderation status."""
+
+    def __init__(self, grade_level, genre, story="", session_id=None, blocked_turns=0,
+                 created_at=None, last_access=None):
+        self.id = session_id or uuid.uuid4().hex
+        self.grade_level = grade_level
+        self.genre = genre
+        self.story = story
+        self.blocked_turns = blocked_turns
+        self.created_at = created_at or time.time()
+        self.last_access = last_access or self.created_at
+        # Guards appends to the story; not persisted
+        self.lock = threading.Lock()
+        # Called with the session after each change (shared stores write it back)
+        self.on_change = None
+
+    def extended(self, *texts):
+        """The story with texts appended one line each, without changing the session."""
+        story = self.story
+        for text in texts:
+            if text and text.strip():
+                story += text.strip() + "\n"
+        return story
+
+    def append(self, *texts):
+        with self.lock:
+            self.story = self.extended(*texts)
+            self.last_access = time.time()
+        self._changed()
+
+    def flag(self):
+        """Record a turn whose student text was blocked by moderation."""
+        with self.lock:
+            self.blocked_turns += 1
+        self._changed()
+
+    def _changed(self):
+        if self.on_change is not None:
+            self.on_change(self)
+
+    def to_dict(self, include_story=True):
+        data = {
+            "sessionId": self.id,
+            "gradeLevel": self.grade_level,
+            "genre": self.genre,
+            "moderation": {"status": "flagged" if self.blocked_turns else "ok", "blockedTurns": self.blocked_turns},
+            "createdAt": self.created_at,
+            "lastAccess": self.last_access,
+        }
+        if include_story:
+            data["story"] = self.story
+        return data
+
+    def _row(self):
+        return (self.id, json.dumps({
+            "grade_level": self.grade_level,
+            "genre": self.genre,
+            "story": self.story,
+            "blocked_turns": self.blocked_turns,
+            "created_at": self.created_at,
+        }), self.last_access)
+
+    @classmethod
+    def _from_row(cls, session_id, payload, last_access):
+        data = json.loads(payload)
+        return cls(
+            data["grade_level"], data["genre"], data["story"], session_id=session_id,
+            blocked_turns=data.get("blocked_turns", 0), created_at=data.get("created_at"),
+            last_access=last_access,
+        )
+
+
+class SessionStore:
+    """Bounded in-memory session map with idle eviction and optional SQLite spill."""
+
+    SWEEP_INTERVAL = 30.0
+
+    def __init__(self, max_active=None, idle_ttl=None, path=None, spill_ttl=None, shared=None):
+        self.max_active = int(max_active or os.getenv("SESSION_MAX_ACTIVE", "2000"))
+        self.idle_ttl = float(idle_ttl or os.getenv("SESSION_IDLE_TTL", "1800"))
+        self.spill_ttl = float(spill_ttl or os.getenv("SESSION_SPILL_TTL", str(7 * 24 * 3600)))
+        self.path = path or os.getenv("SESSION_STORE_PATH")
+        if shared is None:
+            shared = os.getenv("SESSION_SHARED", "0") == "1"
+        if shared and not self.path:
+            logger.warning("SESSION_SHARED needs SESSION_STORE_PATH; sessions stay per process")
+        self.shared = bool(shared and self.path)
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._swept_at = time.monotonic()
+        if self.path:
+            self._connect().execute(
+                "CREATE TABLE IF NOT EXISTS story_sessions ("
+                " id TEXT PRIMARY KEY, payload TEXT NOT NULL, last_access REAL NOT NULL)"
+            )
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        # A connection must not be used on both sides of a fork (serve.py preloads the app)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def create(self, grade_level, genre, story=""):
+        session = Session(grade_level, genre, story)
+        if self.shared:
+            session.on_change = self._save
+            self._save(session)
+            return session
+        with self._lock:
+            self._sessions[session.id] = session
+            overflow = self._trim()
+        self._spill(overflow)
+        return session
+
+    def get(self, session_id):
+        self._sweep()
+        if self.shared:
+            session = self._load(session_id)
+            if session is not None:
+                session.last_access = time.time()
+                session.on_change = self._save
+            return session
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None:
+                self._sessions.move_to_end(session_id)
+                session.last_access = time.time()
+                return session
+
+        session = self._load(session_id)
+        if session is None:
+            return None
+        with self._lock:
+            # Another request may have loaded it meanwhile; keep a single instance
+            session = self._sessions.setdefault(session_id, session)
+            self._sessions.move_to_end(session_id)
+            session.last_access = time.time()
+            overflow = self._trim()
+        self._spill(overflow)
+        return session
+
+    def flush(self):
+        """Spill every in-memory session, e.g. before the process exits."""
+        with self._lock:
+            sessions = list(self._sessions.values())
+        self._spill(sessions)
+
+    def delete(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+        if self.path:
+            self._connect().execute("DELETE FROM story_sessions WHERE id = ?", (session_id,))
+
+    def stats(self):
+        with self._lock:
+            return {"active": len(self._sessions), "spill": bool(self.path), "shared": self.shared}
+
+    def _trim(self):
+        overflow = []
+        while len(self._sessions) > self.max_active:
+            overflow.append(self._sessions.popitem(last=False)[1])
+        return overflow
+
+    def _sweep(self):
+        now = time.monotonic()
+        if now - self._swept_at < self.SWEEP_INTERVAL:
+            return
+        self._swept_at = now
+        cutoff = time.time() - self.idle_ttl
+        idle = []
+        with self._lock:
+            for session_id, session in list(self._sessions.items()):
+                if session.last_access < cutoff:
+                    idle.append(self._sessions.pop(session_id))
+        self._spill(idle)
+        if self.path:
+            self._connect().execute(
+                "DELETE FROM story_sessions WHERE last_access < ?", (time.time() - self.spill_ttl,)
+            )
+
+    def _spill(self, sessions):
+        if not sessions or not self.path:
+            return
+        try:
+            self._connect().executemany(
+                "INSERT OR REPLACE INTO story_sessions (id, payload, last_access) VALUES (?, ?, ?)",
+                [s._row() for s in sessions],
+            )
+        except sqlite3.Error as e:
+            logger.error("Failed to spill sessions: %s", e)
+
+    def _save(self, session):
+        with session.lock:
+            self._spill([session])
+
+    def _load(self, session_id):
+        if not self.path:
+            return None
+        row = self._connect().execute(
+            "SELECT payload, last_access FROM story_sessions WHERE id = ? AND last_access >= ?",
+            (session_id, time.time() - self.spill_ttl),
+        ).fetchone()
+        return Session._from_row(session_id, row[0], row[1]) if row else None
@@ -0,0 +1,350 @@
+"""
+Pool of pre-generated, already-moderated story starters.
+
+Background threads keep up to STARTER_POOL_SIZE starters ready for every
+configured (grade_level, genre) pair, so /api/start-story can answer without
+waiting on the LLM. Starters older than STARTER_POOL_TTL seconds are
+discarded so students keep seeing fresh openings.
+
+Only the configured pairs are pooled; requests for anything else are simply
+misses. A pair nobody has asked for in STARTER_POOL_IDLE seconds stops being
+refilled until it is asked for again, and a pair whose generation fails or is
+rejected waits with exponential backoff before the next attempt, so an idle
+server does not keep paying for starters.
+
+With STARTER_POOL_PATH set (serve.py sets it) the starters live in a SQLite
+file shared by every worker process on the host: any worker can serve one,
+and only the worker holding the file's lock refills the pool, so the spend
+does not grow with the number of workers. Otherwise the pool is per process.
+
+    STARTER_POOL_SIZE      starters kept per pair; 0 disables the pool (default 3)
+    STARTER_POOL_TTL       seconds before a starter is considered stale (default 3600)
+    STARTER_POOL_GRADES    grade levels to pool (default K-2,3-5,6-8,9-12)
+    STARTER_POOL_GENRES    genres to pool (default adventure)
+    STARTER_POOL_WORKERS   refill threads (default 2)
+    STARTER_POOL_IDLE      seconds without a request before a pair goes dormant (default 7200)
+    STARTER_POOL_PATH      optional SQLite file shared across workers
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+
+try:
+    import fcntl
+except ImportError:  # Windows: no shared pool, every process refills its own
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Backoff after a failed or rejected generation, doubling per failure in a row
+RETRY_BASE = 5.0
+RETRY_CAP = 600.0
+# How often the refilling worker looks at a shared pool other workers take from
+SHARED_POLL_INTERVAL = 5.0
+
+
+def _env_list(name, default):
+    return [item.strip() for item in os.getenv(name, default).split(",") if item.strip()]
+
+
+class MemoryStarters:
+    """Starters and per-pair demand kept in this process."""
+
+    shared = False
+
+    def __init__(self, keys):
+        self._queues = {key: deque() for key in keys}
+        self._wanted_at = {}
+
+    def add(self, key, starter):
+        self._queues[key].append((time.time(), starter))
+
+    def take(self, key, cutoff):
+        queue = self._queues[key]
+        self._wanted_at[key] = time.time()
+        while queue and queue[0][0] < cutoff:
+            queue.popleft()
+        return queue.popleft()[1] if queue else None
+
+    def counts(self, cutoff):
+        for queue in self._queues.values():
+            while queue and queue[0][0] < cutoff:
+                queue.popleft()
+        return {key: len(queue) for key, queue in self._queues.items()}
+
+    def wanted(self, default):
+        return {key: self._wanted_at.setdefault(key, default) for key in self._queues}
+
+    def clear(self, key):
+        self._queues[key].clear()
+
+    def lead(self):
+        return True
+
+    def release(self):
+        pass
+
+
+class SQLiteStarters:
+    """Starters and per-pair demand in a SQLite file; a file lock picks the one process that refills."""
+
+    shared = True
+
+    def __init__(self, keys, path):
+        self.keys = list(keys)
+        self.path = path
+        self._local = threading.local()
+        self._lock_file = None
+        self._lock_pid = None
+        conn = self._connect()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS starters ("
+            " id INTEGER PRIMARY KEY, grade_level TEXT NOT NULL, genre TEXT NOT NULL,"
+            " created_at REAL NOT NULL, story TEXT NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS starters_pair ON starters (grade_level, genre, created_at)")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS starter_demand ("
+            " grade_level TEXT NOT NULL, genre TEXT NOT NULL, wanted_at REAL NOT NULL,"
+            " PRIMARY KEY (grade_level, genre))"
+        )
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        # A connection must not be used on both sides of a fork (serve.py preloads the app)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def add(self, key, starter):
+        self._connect().execute(
+            "INSERT INTO starters (grade_level, genre, created_at, story) VALUES (?, ?, ?, ?)",
+            (key[0], key[1], time.time(), starter),
+        )
+
+    def take(self, key, cutoff):
+        conn = self._connect()
+        # IMMEDIATE takes the write lock up front, so two workers cannot serve the same starter
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO starter_demand (grade_level, genre, wanted_at) VALUES (?, ?, ?)",
+                (key[0], key[1], time.time()),
+            )
+            conn.execute("DELETE FROM starters WHERE created_at < ?", (cutoff,))
+            row = conn.execute(
+                "SELECT id, story FROM starters WHERE grade_level = ? AND genre = ? ORDER BY created_at LIMIT 1",
+                key,
+            ).fetchone()
+            if row is not None:
+                conn.execute("DELETE FROM starters WHERE id = ?", (row[0],))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return row[1] if row is not None else None
+
+    def counts(self, cutoff):
+        conn = self._connect()
+        conn.execute("DELETE FROM starters WHERE created_at < ?", (cutoff,))
+        counts = dict.fromkeys(self.keys, 0)
+        for grade_level, genre, count in conn.execute(
+            "SELECT grade_level, genre, COUNT(*) FROM starters GROUP BY grade_level, genre"
+        ):
+            if (grade_level, genre) in counts:
+                counts[(grade_level, genre)] = count
+        return counts
+
+    def wanted(self, default):
+        conn = self._connect()
+        conn.executemany(
+            "INSERT OR IGNORE INTO starter_demand (grade_level, genre, wanted_at) VALUES (?, ?, ?)",
+            [(grade_level, genre, default) for grade_level, genre in self.keys],
+        )
+        rows = conn.execute("SELECT grade_level, genre, wanted_at FROM starter_demand").fetchall()
+        wanted = {(grade_level, genre): at for grade_level, genre, at in rows}
+        return {key: wanted.get(key, default) for key in self.keys}
+
+    def clear(self, key):
+        self._connect().execute("DELETE FROM starters WHERE grade_level = ? AND genre = ?", key)
+
+    def lead(self):
+        """True if this process refills the pool, taking the lock if nobody holds it."""
+        if fcntl is None:
+            return True
+        if self._lock_file is not None and self._lock_pid == os.getpid():
+            return True
+        lock_file = open(self.path + ".lock", "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file, self._lock_pid = lock_file, os.getpid()
+        logger.info("This process refills the shared starter pool")
+        return True
+
+    def release(self):
+        if self._lock_file is not None and self._lock_pid == os.getpid():
+            self._lock_file.close()
+        self._lock_file = self._lock_pid = None
+
+
+class StarterPool:
+    """
+    Per-(grade_level, genre) queues of starters refilled in the background.
+
+    generate(grade_level, genre) must return moderated starter text, or None
+    if the attempt should be discarded.
+    """
+
+    def __init__(self, generate, grade_levels=None, genres=None, size=None, ttl=None, workers=None, idle=None,
+                 path=None):
+        self._generate = generate
+        self.size = int(size if size is not None else os.getenv("STARTER_POOL_SIZE", "3"))
+        self.ttl = float(ttl if ttl is not None else os.getenv("STARTER_POOL_TTL", "3600"))
+        self.workers = int(workers if workers is not None else os.getenv("STARTER_POOL_WORKERS", "2"))
+        self.idle = float(idle if idle is not None else os.getenv("STARTER_POOL_IDLE", "7200"))
+        grade_levels = grade_levels or _env_list("STARTER_POOL_GRADES", "K-2,3-5,6-8,9-12")
+        genres = genres or _env_list("STARTER_POOL_GENRES", "adventure")
+
+        keys = [(g, genre) for g in grade_levels for genre in genres]
+        self._keys = set(keys)
+        path = path or os.getenv("STARTER_POOL_PATH")
+        self._store = SQLiteStarters(keys, path) if path and self.enabled else MemoryStarters(keys)
+        self._in_flight = {key: 0 for key in keys}
+        self._failures = {key: 0 for key in keys}
+        self._retry_at = {key: 0.0 for key in keys}
+        # Prefill every pair once; after that a pair is refilled while it is being asked for
+        self._started_at = time.time()
+        self._cond = threading.Condition()
+        self._threads = []
+        self._stopped = False
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self):
+        return self.size > 0
+
+    def start(self):
+        if not self.enabled or self._threads:
+            return
+        self._stopped = False
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"starter-pool-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info("Starter pool started for %d grade/genre pairs", len(self._keys))
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        self._threads = []
+        # Let another worker take over refilling a shared pool
+        self._store.release()
+
+    def pop(self, grade_level, genre):
+        """Return a fresh starter for the pair, or None if none is ready."""
+        if not self.enabled:
+            return None
+        key = (grade_level, genre)
+        if key not in self._keys:
+            # Not a configured pair: never pooled, whatever the client sends
+            self.misses += 1
+            return None
+        with self._cond:
+            starter = self._store.take(key, time.time() - self.ttl)
+            if starter is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            self._cond.notify()
+            return starter
+
+    def stats(self):
+        with self._cond:
+            counts = self._store.counts(time.time() - self.ttl) if self.enabled else {}
+            wanted = self._store.wanted(self._started_at) if self.enabled else {}
+            return {
+                "enabled": self.enabled,
+                "shared": self._store.shared,
+                "hits": self.hits,
+                "misses": self.misses,
+                "ready": {f"{g}/{genre}": count for (g, genre), count in counts.items()},
+                "dormant": [f"{g}/{genre}" for (g, genre), at in wanted.items() if self._dormant(at)],
+            }
+
+    def _dormant(self, wanted_at):
+        return time.time() - wanted_at > self.idle
+
+    def _next_key(self):
+        # Pick the emptiest pair so every pair gets a starter before any gets a second
+        best, best_count = None, None
+        now = time.monotonic()
+        counts = self._store.counts(time.time() - self.ttl)
+        for key, wanted_at in self._store.wanted(self._started_at).items():
+            if self._dormant(wanted_at):
+                if counts[key]:
+                    self._store.clear(key)
+                continue
+            if now < self._retry_at[key]:
+                continue
+            count = counts[key] + self._in_flight[key]
+            if count < self.size and (best_count is None or count < best_count):
+                best, best_count = key, count
+        return best
+
+    def _wait_timeout(self):
+        # Wake up periodically so stale starters get replaced, and when the next backoff ends
+        timeout = min(60.0, self.ttl / 4)
+        if self._store.shared:
+            # Other workers take starters without notifying this one
+            timeout = min(timeout, SHARED_POLL_INTERVAL)
+        now = time.monotonic()
+        retries = [at - now for at in self._retry_at.values() if at > now]
+        return max(0.05, min([timeout] + retries))
+
+    def _run(self):
+        while True:
+            with self._cond:
+                key = None
+                while not self._stopped:
+                    try:
+                        if self._store.lead():
+                            key = self._next_key()
+                    except sqlite3.Error as e:
+                        logger.error("Starter pool store failed: %s", e)
+                    if key is not None:
+                        break
+                    self._cond.wait(timeout=self._wait_timeout())
+                if self._stopped:
+                    return
+                self._in_flight[key] += 1
+
+            starter = None
+            try:
+                starter = self._generate(*key)
+            except Exception as e:
+                logger.error("Failed to pre-generate starter for %s: %s", key, e)
+            finally:
+                with self._cond:
+                    self._in_flight[key] -= 1
+                    if starter:
+                        try:
+                            self._store.add(key, starter)
+                        except sqlite3.Error as e:
+                            logger.error("Failed to store starter for %s: %s", key, e)
+                        self._failures[key] = 0
+                    else:
+                        delay = min(RETRY_CAP, RETRY_BASE * 2 ** self._failures[key])
+                        self._failures[key] += 1
+                        self._retry_at[key] = time.monotonic() + delay
+                        logger.warning("No starter for %s; retrying in %.0fs", key, delay)
@@ -1,12 +1,15 @@
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 import yaml
-from crewai import Crew, Agent, Task
 import os
 from openai import OpenAI
 import json
-import re
 from dotenv import load_dotenv
+from fallbacks import generate_fallback_story
+from usage import usage_tracker, FALLBACK
+from resilience import chat as chat_upstream, upstream_states
+from text_analysis import limit_sentences
+from N2G.direct import complete_sentences, estimate_messages_usage
 
 # Load environment variables
 load_dotenv()
@@ -14,8 +17,8 @@ load_dotenv()
 app = Flask(__name__)
 CORS(app, resources={r"/api/*": {"origins": "http://localhost:8000"}})
 
-# Initialize OpenAI client
-client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+# Initialize OpenAI client (retries and deadlines are handled by resilience.py)
+client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'), max_retries=0)
 
 # Load configuration
 def load_config():
@@ -55,45 +58,37 @@ if not agents_config or not tasks_config:
         }
     }
 
-# Create agents
-creative_writer = Agent(
-    role=agents_config['creative_writer']['role'],
-    goal=agents_config['creative_writer']['goal'],
-    backstory=agents_config['creative_writer']['backstory']
-)
-
-story_partner = Agent(
-    role=agents_config['story_partner']['role'],
-    goal=agents_config['story_partner']['goal'],
-    backstory=agents_config['story_partner']['backstory']
-)
-
-def count_sentences(text):
-    """Count the number of sentences in a text."""
-    # Split by common sentence endings followed by space or end of string
-    sentences = re.split(r'[.!?]+(?:\s|$)', text)
-    # Filter out empty strings
-    sentences = [s.strip() for s in sentences if s.strip()]
-    return len(sentences)
-
-def limit_sentences(text, max_sentences=2):
-    """Limit text to a maximum number of sentences."""
-    sentences = re.split(r'([.!?]+(?:\s|$))', text)
-    result = []
-    count = 0
-    
-    for i in range(0, len(sentences)-1, 2):
-        if count >= max_sentences:
-            break
-        sentence = sentences[i].strip()
-        if sentence:
-            result.append(sentence + sentences[i+1])
-            count += 1
-    
-    return ''.join(result).strip()
+# Story turns are two sentences; the stream is cancelled as soon as they are in
+MAX_SENTENCES = 2
+STORY_MODEL = "gpt-3.5-turbo"
+
+def complete_story(prompt, endpoint):
+    """Stream a completion for prompt, stopping once MAX_SENTENCES sentences are in."""
+    messages = [
+        {"role": "system", "content": "You are a creative writing assistant that helps students write stories."},
+        {"role": "user", "content": prompt}
+    ]
+    story = chat_upstream.call(
+        complete_sentences,
+        client,
+        messages,
+        MAX_SENTENCES,
+        model=STORY_MODEL,
+        max_tokens=150,
+        temperature=0.7
+    )
+    # A cancelled stream reports no usage, so count what was sent and kept
+    usage_tracker.record(STORY_MODEL, *estimate_messages_usage(messages, story), endpoint=endpoint)
+    return limit_sentences(story, MAX_SENTENCES)
 
 def generate_story_with_openai(grade_level, challenge, story_so_far=None):
     """Generate story content using OpenAI API."""
+    # Already on the cheapest model, so over budget there is nothing to downgrade to
+    if usage_tracker.plan() == FALLBACK:
+        return generate_fallback_story(grade_level, challenge, story_so_far)
+    # While the breaker is open, answer straight away instead of waiting on a dead upstream
+    if not chat_upstream.available():
+        return generate_fallback_story(grade_level, challenge, story_so_far)
     try:
         if not story_so_far:
             # Generate story starter
@@ -104,18 +99,7 @@ def generate_story_with_openai(grade_level, challenge, story_so_far=None):
             Grade level: {grade_level}
             Challenge type: {challenge}"""
             
-            response = client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": "You are a creative writing assistant that helps students write stories."},
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=150,
-                temperature=0.7
-            )
-            
-            story = response.choices[0].message.content.strip()
-            return limit_sentences(story, 2)
+            return complete_story(prompt, "start_story")
         else:
             # Generate story continuation
             prompt = f"""Continue the story in a creative and engaging way.
@@ -125,32 +109,12 @@ def generate_story_with_openai(grade_level, challenge, story_so_far=None):
             Grade level: {grade_level}
             Challenge type: {challenge}"""
             
-            response = client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": "You are a creative writing assistant that helps students write stories."},
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=150,
-                temperature=0.7
-            )
-            
-            continuation = response.choices[0].message.content.strip()
-            return limit_sentences(continuation, 2)
+            return complete_story(prompt, "continue_story")
             
     except Exception as e:
         print(f"Error generating story: {str(e)}")
         return generate_fallback_story(grade_level, challenge, story_so_far)
 
-def generate_fallback_story(grade_level, challenge, story_so_far=None):
-    """Generate a fallback story if OpenAI API fails."""
-    if not story_so_far:
-        # Return a simple starter
-        return "Once upon a time, there was a magical forest. The trees whispered secrets to anyone who would listen."
-    else:
-        # Return a simple continuation
-        return "The forest creatures gathered to hear the trees' stories. They learned about the magic that lived in their home."
-
 @app.route('/api/start-story', methods=['POST'])
 def start_story():
     try:
@@ -184,13 +148,20 @@ def continue_story():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/usage', methods=['GET'])
+def usage():
+    return jsonify(usage_tracker.summary())
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
+    upstreams = upstream_states()
     return jsonify({
-        'status': 'healthy',
+        'status': 'degraded' if any(u['state'] == 'open' for u in upstreams.values()) else 'healthy',
+        'upstreams': upstreams,
         'endpoints': {
             '/api/start-story': 'POST - Start a new story',
-            '/api/continue-story': 'POST - Continue an existing story'
+            '/api/continue-story': 'POST - Continue an existing story',
+            '/api/usage': 'GET - Token and cost totals'
         }
     })
 
@@ -0,0 +1,62 @@
+import timeit
+
+import pytest
+
+from content_filter import KEYWORDS_PATH, KeywordFilter, load_keywords
+
+matcher = KeywordFilter(KEYWORDS_PATH, reload_interval=3600)
+
+
+@pytest.mark.parametrize("text, keyword", [
+    ("The raping of the village", "rape"),
+    ("He was strangling the guard.", "strangle"),
+    ("A sexy outfit", "sexy"),
+    ("Some porno magazine", "porno"),
+    ("A gunshot rang out.", "gunshot"),
+    ("That is bullshit!", "bullshit"),
+    ("You motherfucker", "motherfucker"),
+    ("Shut up, fuckface.", "fuckface"),
+    ("Total BULLSHITS", "bullshit"),
+    ("They were fucking around", "fuck"),
+    ("He tried to kill them.", "kill"),
+    ("They started self-harming", "self-harm"),
+    ("No more self harm talk", "self-harm"),
+])
+def test_blocks_listed_and_inflected_forms(text, keyword):
+    assert matcher.find(text) == keyword
+
+
+@pytest.mark.parametrize("text", [
+    "They sailed past the cliffs of Essex.",
+    "She counted the cumulus clouds.",
+    "The scunthorpe bus was late.",
+    "He ate a shotgun-shaped cookie.",
+    "The pussycat read Dickens by the fire.",
+    "A spicy soup for the shiitake lovers.",
+    "She added spices to the soup.",
+    "The apples were spiced with cinnamon.",
+    "He hung his coat on a coat hanger.",
+    "They watched the killer whales jump.",
+    "The self-portrait was lovely.",
+])
+def test_allows_innocent_words(text):
+    assert matcher.find(text) is None
+
+
+def test_reports_first_offending_word():
+    assert matcher.find("A gunshot and then a stabbing") == "gunshot"
+    assert matcher.find("Fuckface said bullshit") == "fuckface"
+    assert matcher.find("Was it skill or did they kill?") == "kill"
+
+
+def test_not_slower_than_substring_scan():
+    keywords = sorted(load_keywords(KEYWORDS_PATH))
+    text = "Pip the little fox found a glowing acorn under the old oak tree. " * 300
+
+    def legacy():
+        text_lower = text.lower()
+        return next((word for word in keywords if word in text_lower), None)
+
+    legacy_seconds = min(timeit.repeat(legacy, number=20, repeat=3))
+    compiled_seconds = min(timeit.repeat(lambda: matcher.find(text), number=20, repeat=3))
+    assert compiled_seconds <= legacy_seconds
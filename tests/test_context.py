@@ -0,0 +1,65 @@
+from types import SimpleNamespace
+
+from N2G.context import ContextCompactor, count_tokens, make_openai_summarizer
+from resilience import Upstream
+
+STORY = " ".join(f"Pip the fox walked to tree number {i} and sang a song." for i in range(60))
+
+
+class FakeClient:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.timeouts = []
+        self.chat = SimpleNamespace(completions=self)
+
+    def create(self, timeout=None, **kwargs):
+        self.timeouts.append(timeout)
+        if self.fail:
+            raise TimeoutError("summary timed out")
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=" Pip walked far. "))])
+
+
+def test_summary_call_goes_through_upstream_with_capped_timeout():
+    client = FakeClient()
+    upstream = Upstream("test-summary", timeout=30, deadline=45, retries=0)
+    summarize = make_openai_summarizer(client, upstream=upstream, timeout=2)
+    assert summarize(None, "Pip walked.") == "Pip walked far."
+    assert client.timeouts == [2]
+
+
+def test_failed_summary_falls_back_to_truncation():
+    client = FakeClient(fail=True)
+    upstream = Upstream("test-summary-fail", timeout=30, deadline=45, retries=1, failure_threshold=100)
+    compactor = ContextCompactor(make_openai_summarizer(client, upstream=upstream, timeout=2), token_budget=100)
+    prompt = compactor.compact(STORY)
+    assert len(client.timeouts) == 2
+    assert count_tokens(prompt) <= 100
+    assert STORY.endswith(prompt)
+
+
+def counting_summarizer(calls):
+    def summarize(previous, new_text):
+        calls.append(new_text)
+        return f"summary {len(calls)}"
+    return summarize
+
+
+def game(opening, name, turns):
+    return opening + " " + " ".join(f"{name} walked to tree {i}." for i in range(turns))
+
+
+def test_stateless_games_with_the_same_opening_do_not_share_summaries():
+    calls = []
+    compactor = ContextCompactor(counting_summarizer(calls), token_budget=60, keep_sentences=4, summary_chunk=6)
+    opening = "Pip the fox found a glowing acorn under the old oak tree."
+    first = compactor.compact(game(opening, "Pip", 20))
+    second = compactor.compact(game(opening, "Tom", 20))
+    assert len(calls) == 2
+    assert first != second
+    # Each game extends its own summary; neither is evicted by the other
+    compactor.compact(game(opening, "Pip", 21))
+    compactor.compact(game(opening, "Tom", 21))
+    assert len(calls) == 2
+    compactor.compact(game(opening, "Pip", 26))
+    assert len(calls) == 3
+    assert calls[2] == " ".join(f"Pip walked to tree {i}." for i in range(16, 22))
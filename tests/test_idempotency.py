@@ -0,0 +1,74 @@
+import asyncio
+import threading
+
+from idempotency import IdempotencyStore
+
+
+def chunks():
+    yield "data: one\n\n"
+    yield 'data: {"type": "done"}\n\n'
+
+
+def test_stream_closed_before_it_starts_releases_the_key():
+    store = IdempotencyStore(wait=1)
+    assert store.begin("k", "fp") == (None, None)
+    body = store.record_stream("k", chunks(), lambda chunk: "done" in chunk)
+    release = store.release_on_close("k")
+
+    # The client is gone before the first chunk: the body is closed, never iterated
+    body.close()
+    release()
+    assert store.stats()["in_flight"] == 0
+    assert store.begin("k", "fp") == (None, None)
+
+
+def test_late_release_leaves_a_retry_in_flight():
+    store = IdempotencyStore(wait=1)
+    store.begin("k", "fp")
+    release = store.release_on_close("k")
+    release()
+    assert store.begin("k", "fp") == (None, None)
+
+    release()
+    stored, flight = store.begin("k", "fp")
+    assert stored is None and flight is not None
+
+
+def test_finished_stream_is_replayed():
+    store = IdempotencyStore(wait=1)
+    store.begin("k", "fp")
+    release = store.release_on_close("k")
+    assert list(store.record_stream("k", chunks(), lambda chunk: "done" in chunk))[-1].endswith("\n\n")
+    release()
+    stored, flight = store.begin("k", "fp")
+    assert flight is None and b"done" in stored.body
+
+
+def test_async_stream_closed_before_it_starts_releases_the_key():
+    async def achunks():
+        for chunk in chunks():
+            yield chunk
+
+    async def scenario():
+        store = IdempotencyStore(wait=1)
+        store.begin("k", "fp")
+        body = store.arecord_stream("k", achunks(), lambda chunk: "done" in chunk)
+        release = store.release_on_close("k")
+        await body.aclose()
+        release()
+        return store.begin("k", "fp")
+
+    assert asyncio.run(scenario()) == (None, None)
+
+
+def test_claim_runs_a_retry_after_an_abandoned_flight():
+    store = IdempotencyStore(wait=5)
+    assert store.claim("k", "fp") == (None, None)
+    claimed = []
+    waiter = threading.Thread(target=lambda: claimed.append(store.claim("k", "fp")))
+    waiter.start()
+    store.abandon("k")
+    waiter.join(5)
+    # The first request stored nothing, so the duplicate runs it itself
+    assert claimed == [(None, None)]
+    assert store.stats()["in_flight"] == 1
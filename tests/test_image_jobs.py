@@ -0,0 +1,39 @@
+import pytest
+
+from image_jobs import ImageJobQueue, InvalidWebhook
+
+
+@pytest.fixture
+def jobs(tmp_path, monkeypatch):
+    monkeypatch.delenv("IMAGE_WEBHOOK_HOSTS", raising=False)
+    return ImageJobQueue(lambda story: ("image.png", None), path=str(tmp_path / "jobs.db"))
+
+
+@pytest.mark.parametrize("url", [
+    "http://127.0.0.1/hook",
+    "http://localhost:8080/hook",
+    "http://169.254.169.254/latest/meta-data/",
+    "http://10.1.2.3/hook",
+    "http://192.168.0.10/hook",
+    "http://100.64.0.1/hook",
+    "http://0.0.0.0/hook",
+    "http://[::1]/hook",
+    "http://[::ffff:127.0.0.1]/hook",
+    "http://[fe80::1]/hook",
+    "ftp://example.com/hook",
+])
+def test_rejects_internal_webhooks(jobs, url):
+    with pytest.raises(InvalidWebhook):
+        jobs.submit("A fox story", "http://localhost/", webhook_url=url)
+
+
+def test_accepts_public_webhook(jobs):
+    assert jobs.submit("A fox story", "http://localhost/", webhook_url="https://93.184.216.34/hook")
+
+
+def test_allowlisted_host_may_be_internal(tmp_path, monkeypatch):
+    monkeypatch.setenv("IMAGE_WEBHOOK_HOSTS", "localhost")
+    jobs = ImageJobQueue(lambda story: ("image.png", None), path=str(tmp_path / "jobs.db"))
+    assert jobs.submit("A fox story", "http://localhost/", webhook_url="http://localhost:9000/hook")
+    with pytest.raises(InvalidWebhook):
+        jobs.submit("A fox story", "http://localhost/", webhook_url="https://93.184.216.34/hook")
@@ -0,0 +1,25 @@
+import os
+import stat
+
+from image_store import IMAGE_FILE_MODE, download_image, etag_matches
+
+ETAG = '"18f2a3b4c5d6e7f8-1a2b"'
+
+
+def test_etag_must_match_a_listed_tag_exactly():
+    assert etag_matches(ETAG, ETAG)
+    assert etag_matches(f'"other", W/{ETAG}', ETAG)
+    assert etag_matches("*", ETAG)
+    assert not etag_matches(None, ETAG)
+    assert not etag_matches('"18f2a3b4c5d6e7f8-1a2"', ETAG)
+    # A substring of a longer tag is not a match
+    assert not etag_matches(f'"x{ETAG[1:-1]}x"', ETAG)
+
+
+def test_downloaded_image_is_world_readable(tmp_path):
+    source = tmp_path / "source.png"
+    source.write_bytes(b"\x89PNG fake")
+    target = tmp_path / "story_image.png"
+    download_image(source.as_uri(), str(target))
+    assert target.read_bytes() == b"\x89PNG fake"
+    assert stat.S_IMODE(os.stat(target).st_mode) == IMAGE_FILE_MODE
@@ -0,0 +1,18 @@
+from moderation_cache import ModerationCache, cache_key
+
+
+def test_shared_hit_keeps_the_stored_expiry(tmp_path, monkeypatch):
+    path = str(tmp_path / "verdicts.db")
+    clock = [1000.0]
+    monkeypatch.setattr("moderation_cache.time.time", lambda: clock[0])
+    writer = ModerationCache(ttl=100, path=path)
+    reader = ModerationCache(ttl=100, path=path)
+    writer.put("A fox story", (False, None))
+
+    clock[0] = 1090.0
+    assert reader.get("A fox story") == (False, None)
+    assert reader.shared_hits == 1
+    assert reader._entries[cache_key("A fox story")][0] == 1100.0
+
+    clock[0] = 1101.0
+    assert reader.get("A fox story") is None
@@ -0,0 +1,47 @@
+"""
+Start-up regression check: importing the server must stay fast and must not
+pull in the dependencies that are meant to load on first use.
+
+Each import runs in a fresh interpreter against the mock backend, with the
+state files in a temporary directory. STARTUP_MAX_SECONDS sets the limit on
+the median import time (default 2). bench/bench_startup.py profiles the
+imports when this fails.
+"""
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Imported on first use (N2G/crew.py, N2G/context.py), never at startup
+DEFERRED = ("crewai", "crewai_tools", "langchain_openai", "langchain_core", "tiktoken")
+MAX_SECONDS = float(os.getenv("STARTUP_MAX_SECONDS", "2"))
+RUNS = 3
+
+PROBE = (
+    "import importlib, sys; importlib.import_module(sys.argv[1]); "
+    f"print(','.join(sorted({{m.split('.')[0] for m in sys.modules}} & set({DEFERRED!r}))))"
+)
+
+
+def import_once(module, state_dir):
+    env = dict(os.environ, STORY_QUEST_BACKEND="mock", STORY_QUEST_STATE_DIR=str(state_dir))
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, "-c", PROBE, module], cwd=ROOT, env=env, capture_output=True, text=True)
+    seconds = time.perf_counter() - start
+    assert proc.returncode == 0, proc.stderr[-2000:]
+    return seconds, [m for m in proc.stdout.strip().split(",") if m]
+
+
+@pytest.mark.parametrize("module", ["server", "asgi"])
+def test_import_is_fast_and_defers_heavy_dependencies(module, tmp_path):
+    results = [import_once(module, tmp_path) for _ in range(RUNS)]
+    assert results[-1][1] == [], f"deferred dependencies imported at startup: {results[-1][1]}"
+    median = statistics.median(seconds for seconds, _ in results)
+    assert median <= MAX_SECONDS, f"import {module} took {median:.2f}s (limit {MAX_SECONDS:.2f}s)"
+    # State files go to the state directory, not the source tree
+    assert (tmp_path / "image_jobs.db").exists()
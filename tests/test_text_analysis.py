@@ -0,0 +1,30 @@
+import pytest
+
+from text_analysis import count_sentences, count_syllables, text_analyzer, WORD_RE
+
+SHORT_TEXTS = ["a", "I", "A.", "ok", "Go!", "I am.", "a b", "Hi, I am Al. Go on", "I\na"]
+
+
+@pytest.mark.parametrize("text", SHORT_TEXTS)
+def test_batch_handles_one_and_two_letter_words(text):
+    columns = text_analyzer.analyze_batch([text], "K-2")
+    words = WORD_RE.findall(text.lower())
+    assert columns["words"][0] == len(words)
+    assert columns["syllables"][0] == sum(map(count_syllables, words))
+    assert columns["sentences"][0] == count_sentences(text)
+
+
+def test_batch_of_short_texts_matches_single_analysis():
+    columns = text_analyzer.analyze_batch(SHORT_TEXTS, "3-5")
+    for i, text in enumerate(SHORT_TEXTS):
+        stats = text_analyzer.analyze(text, "3-5")
+        assert columns["words"][i] == stats.words
+        assert columns["syllables"][i] == stats.syllables
+        assert columns["vocabulary_points"][i] == stats.vocabulary_points
+
+
+def test_analyze_single_letter_turn():
+    stats = text_analyzer.analyze("I", "K-2")
+    assert stats.words == 1
+    assert stats.syllables == 1
+    assert stats.grade_fit == "unjudged"
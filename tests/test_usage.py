@@ -0,0 +1,12 @@
+from usage import UsageTracker
+
+
+def test_global_budget_is_split_across_workers(monkeypatch):
+    monkeypatch.setenv("WEB_WORKERS", "4")
+    assert UsageTracker(global_budget=20).global_budget == 5
+    assert UsageTracker(global_budget=20, workers=1).global_budget == 20
+
+
+def test_single_process_keeps_whole_budget(monkeypatch):
+    monkeypatch.delenv("WEB_WORKERS", raising=False)
+    assert UsageTracker(global_budget=20).global_budget == 20
@@ -0,0 +1,378 @@
+"""
+Readability and grade-level analysis of story text, without an LLM call.
+
+For each text: word, sentence and syllable counts, the Flesch-Kincaid grade,
+hits on the grade's basic and advanced vocabulary (scored like game.js), and
+whether the reading level fits the requested grade. Grade targets and the
+vocabulary tiers live in N2G/config/grade_levels.yaml, which is re-read when
+it changes, and are compiled into one lookup table: a row of tier codes per
+grade, a column per vocabulary word.
+
+analyze() scores one text (a story turn) with plain Python. analyze_batch()
+scores a list of texts in one pass with NumPy: the texts are scanned as one
+byte buffer, words are looked up in the table by hash, and per-text totals
+are bincounts. Both give the same numbers.
+"""
+import os
+import re
+from collections import namedtuple
+from functools import lru_cache
+
+import numpy as np
+
+from metrics import Counter
+from N2G.config_loader import CONFIG_DIR, load_yaml
+
+GRADE_LEVELS_PATH = os.path.join(CONFIG_DIR, "grade_levels.yaml")
+
+# A sentence ends at a run of . ! or ? followed by whitespace or the end of the text
+SENTENCE_END_RE = re.compile(r"[.!?]+(?:\s|$)")
+WORD_RE = re.compile(r"[a-z]+(?:'[a-z]+)*")
+VOWEL_GROUP_RE = re.compile(r"[aeiouy]+")
+SILENT_ENDING_RE = re.compile(r"(?:[^laeiouy]es|ed|[^laeiouy]e)$")
+
+# Tier codes in the lookup table
+NONE, BASIC, ADVANCED = 0, 1, 2
+# Vocabulary words shorter than this are ignored, as in game.js
+MIN_VOCAB_LENGTH = 3
+# Flesch-Kincaid is noise on a sentence or two, so shorter texts are not judged
+MIN_WORDS_TO_JUDGE = 12
+
+OK, TOO_EASY, TOO_HARD, UNJUDGED = "ok", "too_easy", "too_hard", "unjudged"
+
+TextStats = namedtuple("TextStats", [
+    "words", "sentences", "syllables", "reading_grade",
+    "basic_words", "advanced_words", "vocabulary_points", "grade_fit",
+])
+
+READING_LEVEL = Counter(
+    "storyquest_reading_level_total",
+    "Generated story turns by how their Flesch-Kincaid grade fits the requested grade level.",
+    ["grade_level", "fit"],
+)
+
+
+# --- Single-text helpers ---
+def split_sentences(text):
+    """The sentences of text, each with its closing punctuation."""
+    parts = SENTENCE_END_RE.split(text)
+    ends = SENTENCE_END_RE.findall(text) + [""]
+    return [(part.strip() + end).strip() for part, end in zip(parts, ends) if part.strip()]
+
+
+def count_sentences(text):
+    """Count the number of sentences in a text."""
+    return sum(1 for part in SENTENCE_END_RE.split(text) if part.strip())
+
+
+def limit_sentences(text, max_sentences=2):
+    """Limit text to its first max_sentences complete sentences."""
+    sentences = []
+    position = 0
+    for match in SENTENCE_END_RE.finditer(text):
+        if len(sentences) >= max_sentences:
+            break
+        sentence = text[position:match.start()].strip()
+        if sentence:
+            sentences.append(sentence + match.group())
+        position = match.end()
+    return "".join(sentences).strip()
+
+
+@lru_cache(maxsize=65536)
+def count_syllables(word):
+    """Estimated syllables in a lowercase word (vowel groups, less a silent ending)."""
+    if len(word) <= 3:
+        return 1
+    word = SILENT_ENDING_RE.sub("", word)
+    if word.startswith("y"):
+        word = word[1:]
+    return max(1, len(VOWEL_GROUP_RE.findall(word)))
+
+
+# --- Batch scanning ---
+# The batch is joined into one lowercase byte buffer and scanned with array
+# operations: word and syllable boundaries are boolean masks over the buffer,
+# sentence breaks are found from the (few) punctuation positions, and
+# per-word or per-text totals are sums between boundaries. The rules are the
+# regexes above; unicode whitespace is the one place they differ (the scan
+# counts only ASCII whitespace as a space).
+HASH_BASE = np.uint64(1099511628211)
+
+
+def _any_of(chars, values):
+    mask = chars == ord(values[0])
+    for value in values[1:]:
+        mask |= chars == ord(value)
+    return mask
+
+
+def _in_range(chars, low, high):
+    return (chars >= ord(low)) & (chars <= ord(high))
+
+
+def _prev(mask):
+    return np.concatenate(([False], mask[:-1]))
+
+
+def _next(mask):
+    return np.concatenate((mask[1:], [False]))
+
+
+class Scan:
+    """Texts joined into one lowercase byte buffer, with the start and end of every word."""
+
+    def __init__(self, texts):
+        encoded = [text.encode("utf-8") for text in texts]
+        raw = np.frombuffer(b"\n".join(encoded), dtype=np.uint8)
+        self.chars = raw + _in_range(raw, "A", "Z").view(np.uint8) * np.uint8(32)
+        lengths = np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded))
+        # Byte offset where each text starts and ends, counting the newline between texts
+        self.text_starts = np.cumsum(lengths + 1) - lengths - 1
+        self.text_ends = self.text_starts + lengths
+
+        letter = _in_range(self.chars, "a", "z")
+        # An apostrophe joins letters into one word (don't, rock'n'roll), as WORD_RE does
+        in_word = letter | ((self.chars == ord("'")) & _prev(letter) & _next(letter))
+        self.starts = np.flatnonzero(in_word & ~_prev(in_word))
+        self.ends = np.flatnonzero(in_word & ~_next(in_word))
+        self.lengths = self.ends - self.starts + 1
+
+    def owner(self, positions):
+        """The text each buffer position belongs to."""
+        return np.searchsorted(self.text_starts, positions, side="right") - 1
+
+    def syllables(self):
+        """Syllables per word, by the same rules as count_syllables()."""
+        chars, starts, ends = self.chars, self.starts, self.ends
+        if not len(starts):
+            return np.zeros(0, dtype=np.int64)
+        vowel = _any_of(chars, "aeiouy")
+        # A leading y is a consonant
+        vowel[starts[chars[starts] == ord("y")]] = False
+        group = vowel & ~_prev(vowel)
+        total = np.cumsum(group, dtype=np.int32)
+        groups = total[ends] - total[starts] + group[starts]
+        # The silent endings of SILENT_ENDING_RE each drop one vowel group, if their e starts one
+        # Clamped so a word at the start of the buffer cannot index before it; only words
+        # over three letters use these, and for those the clamp never applies
+        before_end, third_end = np.maximum(ends - 1, 0), np.maximum(ends - 2, 0)
+        last, before, third = chars[ends], chars[before_end], chars[third_end]
+        silent = (
+            ((last == ord("s")) & (before == ord("e")) & (third != ord("l")) & group[before_end])
+            | ((last == ord("d")) & (before == ord("e")) & group[before_end])
+            | ((last == ord("e")) & (before != ord("l")) & group[ends])
+        )
+        return np.where(self.lengths <= 3, 1, np.maximum(1, groups - silent))
+
+    def sentences(self):
+        """Sentences per text, by the same rules as count_sentences()."""
+        chars = self.chars
+        count = len(self.text_starts)
+        space = (chars == ord(" ")) | _in_range(chars, "\t", "\r") | _in_range(chars, "\x1c", "\x1f")
+        # -1 first, so a search that finds no earlier non-space position lands on it
+        solid = np.concatenate(([-1], np.flatnonzero(~space)))
+
+        # Runs of . ! ? that whitespace or the end of the text follows end a sentence
+        punct = np.flatnonzero(_any_of(chars, ".!?"))
+        run_starts = punct[np.diff(punct, prepend=-2) > 1]
+        run_ends = punct[np.diff(punct, append=len(chars) + 1) > 1]
+        after = run_ends + 1
+        breaks = (after >= len(chars)) | space[np.minimum(after, len(chars) - 1)]
+        run_starts, run_ends = run_starts[breaks], run_ends[breaks]
+
+        def last_solid(before, text_start):
+            """The last non-space position before each of before, or -1 if its text has none."""
+            position = solid[np.searchsorted(solid, before) - 1]
+            return np.where(position >= text_start, position, -1)
+
+        def is_break(positions):
+            found = np.searchsorted(run_ends, positions)
+            return np.append(run_ends, -1)[found] == positions
+
+        # A break ends a sentence if something other than whitespace and an
+        # earlier break comes before it in its text
+        owner = self.owner(run_starts)
+        previous = last_solid(run_starts, self.text_starts[owner])
+        ended = (previous >= 0) & ~is_break(previous)
+        # So does the end of a text that has anything after its last break
+        trailing = last_solid(self.text_ends, self.text_starts)
+        unfinished = (trailing >= 0) & ~is_break(trailing)
+        return np.bincount(owner[ended], minlength=count) + unfinished
+
+    def hashes(self, words):
+        """A 64-bit polynomial hash of each of the words (indexes), for lookups in GradeTables."""
+        lengths = self.lengths[words]
+        if not len(lengths):
+            return np.zeros(0, dtype=np.uint64)
+        firsts = np.cumsum(lengths) - lengths
+        offset = np.arange(int(lengths.sum())) - np.repeat(firsts, lengths)
+        positions = np.repeat(self.starts[words], lengths) + offset
+        powers = np.cumprod(np.full(int(lengths.max()), HASH_BASE, dtype=np.uint64))
+        terms = self.chars[positions].astype(np.uint64) * powers[offset]
+        return np.add.reduceat(terms, firsts)
+
+
+# --- Grade tables ---
+class GradeTables:
+    """grade_levels.yaml compiled into a vocabulary lookup table and per-grade targets."""
+
+    def __init__(self, config):
+        self.grades = list(config)
+        self.row = {grade: i for i, grade in enumerate(self.grades)}
+        words = sorted({
+            word.lower()
+            for settings in config.values()
+            for tier in ("basic", "advanced")
+            for word in settings.get(tier) or []
+            if len(word) >= MIN_VOCAB_LENGTH and WORD_RE.fullmatch(word.lower())
+        })
+        # Columns are in hash order, so a batch's word hashes are looked up with one searchsorted
+        scan = Scan(words)
+        word_hashes = scan.hashes(np.arange(len(words)))
+        self.longest = max(map(len, words), default=0)
+        order = np.argsort(word_hashes)
+        self.hashes = word_hashes[order]
+        self.words = [words[i] for i in order]
+        column = {word: i for i, word in enumerate(self.words)}
+        # The extra last column is for words outside every grade's vocabulary
+        self.unknown = len(words)
+        self.tiers = np.zeros((len(self.grades), len(words) + 1), dtype=np.int8)
+        for grade, settings in config.items():
+            row = self.tiers[self.row[grade]]
+            # Basic is written last so a word in both tiers counts as basic, as in game.js
+            for tier, code in (("advanced", ADVANCED), ("basic", BASIC)):
+                for word in settings.get(tier) or []:
+                    if word.lower() in column:
+                        row[column[word.lower()]] = code
+        # The same tiers as word -> code per grade, for analyzing a single text without arrays
+        self.vocabulary = {
+            grade: {word: int(code) for word, code in zip(self.words, self.tiers[i]) if code}
+            for grade, i in self.row.items()
+        }
+        self.readability = {
+            grade: tuple(settings.get("readability") or (None, None)) for grade, settings in config.items()
+        }
+        self.min_words = {grade: settings.get("min_words") for grade, settings in config.items()}
+
+    def columns(self, word_hashes):
+        """The table column of each word hash; unknown for words not in any vocabulary."""
+        if not len(self.hashes):
+            return np.full(len(word_hashes), self.unknown)
+        found = np.minimum(np.searchsorted(self.hashes, word_hashes), len(self.hashes) - 1)
+        return np.where(self.hashes[found] == word_hashes, found, self.unknown)
+
+
+@lru_cache(maxsize=4)
+def _compile(path, mtime):
+    # mtime is part of the cache key so an edited file is recompiled on next use
+    return GradeTables(load_yaml(path))
+
+
+class TextAnalyzer:
+    """Readability and vocabulary statistics for one text or a batch."""
+
+    def __init__(self, path=GRADE_LEVELS_PATH):
+        self.path = path
+
+    def tables(self):
+        return _compile(self.path, os.path.getmtime(self.path))
+
+    def grade_levels(self):
+        return list(self.tables().grades)
+
+    def min_words(self, grade_level):
+        return self.tables().min_words.get(grade_level)
+
+    def analyze_batch(self, texts, grade_level=None):
+        """
+        Statistics for many texts at once, as {field: array} with one entry
+        per text; the fields are those of TextStats. reading_grade is NaN for
+        a text with no words. Vocabulary is scored against grade_level, and
+        grade_fit is UNJUDGED for a grade not in grade_levels.yaml.
+        """
+        tables = self.tables()
+        count = len(texts)
+        scan = Scan(texts)
+        # Which text each word came from, so per-text sums are one bincount
+        owner = scan.owner(scan.starts)
+        words = np.bincount(owner, minlength=count)
+        sentences = scan.sentences()
+        syllables = np.bincount(owner, weights=scan.syllables(), minlength=count).astype(np.int64)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            reading_grade = np.where(
+                words > 0,
+                0.39 * words / np.maximum(sentences, 1) + 11.8 * syllables / words - 15.59,
+                np.nan,
+            )
+
+        basic = np.zeros(count, dtype=np.int64)
+        advanced = np.zeros(count, dtype=np.int64)
+        if grade_level in tables.row and len(owner):
+            # Only words of a length some vocabulary word has are looked up
+            candidates = np.flatnonzero((scan.lengths >= MIN_VOCAB_LENGTH) & (scan.lengths <= tables.longest))
+            tiers = tables.tiers[tables.row[grade_level]][tables.columns(scan.hashes(candidates))]
+            owner = owner[candidates]
+            basic = np.bincount(owner, weights=tiers == BASIC, minlength=count).astype(np.int64)
+            advanced = np.bincount(owner, weights=tiers == ADVANCED, minlength=count).astype(np.int64)
+
+        return {
+            "words": words,
+            "sentences": sentences,
+            "syllables": syllables,
+            "reading_grade": reading_grade,
+            "basic_words": basic,
+            "advanced_words": advanced,
+            # 1 point per basic word, 3 per advanced word, as in game.js
+            "vocabulary_points": basic + 3 * advanced,
+            "grade_fit": self._fit(reading_grade, words, grade_level),
+        }
+
+    def _fit(self, reading_grade, words, grade_level):
+        fit = np.full(len(words), UNJUDGED, dtype=object)
+        low, high = self.tables().readability.get(grade_level, (None, None))
+        if low is None and high is None:
+            return fit
+        judged = words >= MIN_WORDS_TO_JUDGE
+        fit[judged] = OK
+        if low is not None:
+            fit[judged & (reading_grade < low)] = TOO_EASY
+        if high is not None:
+            fit[judged & (reading_grade > high)] = TOO_HARD
+        return fit
+
+    def analyze(self, text, grade_level=None):
+        """
+        TextStats for one text. Gives the same numbers as analyze_batch(),
+        but with plain Python, which is faster than arrays for a single turn.
+        """
+        words = WORD_RE.findall(text.lower())
+        sentences = count_sentences(text)
+        syllables = sum(map(count_syllables, words))
+        vocabulary = self.tables().vocabulary.get(grade_level, {})
+        tiers = [vocabulary.get(word, NONE) for word in words]
+        basic, advanced = tiers.count(BASIC), tiers.count(ADVANCED)
+        reading_grade = np.nan
+        if words:
+            reading_grade = 0.39 * len(words) / max(sentences, 1) + 11.8 * syllables / len(words) - 15.59
+        fit = self._fit(np.array([reading_grade]), np.array([len(words)]), grade_level)
+        return TextStats(
+            words=len(words),
+            sentences=sentences,
+            syllables=syllables,
+            reading_grade=None if not words else round(reading_grade, 2),
+            basic_words=basic,
+            advanced_words=advanced,
+            vocabulary_points=basic + 3 * advanced,
+            grade_fit=fit[0],
+        )
+
+    def check(self, text, grade_level):
+        """analyze() a generated story turn and count how its reading level fits grade_level."""
+        stats = self.analyze(text, grade_level)
+        known = grade_level in self.tables().row
+        READING_LEVEL.inc(grade_level=grade_level if known else "other", fit=stats.grade_fit)
+        return stats
+
+
+text_analyzer = TextAnalyzer()
@@ -0,0 +1,222 @@
+"""
+Token and cost accounting for OpenAI calls, with spend budgets.
+
+Every chat, summary and image call records its usage here. Totals are kept
+per model, per endpoint and per session and served at /api/usage. Budgets
+keep load spikes from turning into runaway spend: once a session (or the
+process as a whole, within the current window) has spent its budget, story
+turns switch to the cheaper BUDGET_MODEL, and past USAGE_HARD_LIMIT times
+the budget they get the canned fallback story instead of an LLM call.
+Spend is tracked per process, so the global budget is for the host and each
+of the WEB_WORKERS processes gets an even share of it.
+
+    USAGE_SESSION_BUDGET_USD   spend per session before downgrading (default 0.25, 0 disables)
+    USAGE_GLOBAL_BUDGET_USD    spend per window across all requests on the host (default 20, 0 disables)
+    USAGE_GLOBAL_WINDOW        length of the global budget window in seconds (default 3600)
+    USAGE_HARD_LIMIT           multiple of a budget at which turns fall back (default 2)
+    USAGE_MAX_SESSIONS         sessions whose usage is kept (default 10000)
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from metrics import Counter, current_endpoint
+
+logger = logging.getLogger(__name__)
+
+# USD per 1K tokens (prompt, completion); dated model names match by prefix
+TOKEN_PRICES = {
+    "gpt-4-turbo": (0.01, 0.03),
+    "gpt-4o-mini": (0.00015, 0.0006),
+    "gpt-4o": (0.005, 0.015),
+    "gpt-4": (0.03, 0.06),
+    "gpt-3.5-turbo": (0.0005, 0.0015),
+}
+# USD per 1024x1024 standard image
+IMAGE_PRICES = {
+    "dall-e-3": 0.04,
+    "dall-e-2": 0.02,
+}
+
+
+class BudgetExceeded(Exception):
+    """Raised by background work that should not run while over budget."""
+
+
+FULL = "full"
+DOWNGRADE = "downgrade"
+FALLBACK = "fallback"
+
+BUDGET_DECISIONS = Counter(
+    "storyquest_budget_decisions_total",
+    "Story turns served on a cheaper model or the fallback story because of a usage budget.",
+    ["plan"],
+)
+
+
+def _price(table, model):
+    if model in table:
+        return table[model]
+    matches = [name for name in table if model and model.startswith(name)]
+    return table[max(matches, key=len)] if matches else None
+
+
+def token_cost(model, prompt_tokens, completion_tokens):
+    price = _price(TOKEN_PRICES, model)
+    if price is None:
+        return 0.0
+    return (prompt_tokens * price[0] + completion_tokens * price[1]) / 1000.0
+
+
+def image_cost(model, images):
+    return (_price(IMAGE_PRICES, model) or 0.0) * images
+
+
+def crew_tokens(crew, output=None):
+    """(prompt, completion) tokens CrewAI reports for a crew, or None if it reports nothing."""
+    metrics = getattr(output, "token_usage", None) or getattr(crew, "usage_metrics", None)
+    if not metrics:
+        return None
+    get = metrics.get if isinstance(metrics, dict) else (lambda key, default: getattr(metrics, key, default))
+    return int(get("prompt_tokens", 0) or 0), int(get("completion_tokens", 0) or 0)
+
+
+def _bucket():
+    return {"requests": 0, "prompt_tokens": 0, "completion_tokens": 0, "images": 0, "cost_usd": 0.0}
+
+
+def _add(bucket, prompt_tokens, completion_tokens, images, cost):
+    bucket["requests"] += 1
+    bucket["prompt_tokens"] += prompt_tokens
+    bucket["completion_tokens"] += completion_tokens
+    bucket["images"] += images
+    bucket["cost_usd"] += cost
+
+
+class UsageTracker:
+    """Aggregates usage and decides whether a turn still fits its budget."""
+
+    def __init__(self, session_budget=None, global_budget=None, window=None, hard_limit=None, max_sessions=None,
+                 workers=None):
+        self.session_budget = float(os.getenv("USAGE_SESSION_BUDGET_USD", "0.25") if session_budget is None else session_budget)
+        global_budget = float(os.getenv("USAGE_GLOBAL_BUDGET_USD", "20") if global_budget is None else global_budget)
+        workers = max(1, int(workers or os.getenv("WEB_WORKERS") or 1))
+        # The budget is for the host; each worker process gets its share
+        self.global_budget = global_budget / workers
+        self.window = float(window or os.getenv("USAGE_GLOBAL_WINDOW", "3600"))
+        self.hard_limit = float(hard_limit or os.getenv("USAGE_HARD_LIMIT", "2"))
+        self.max_sessions = int(max_sessions or os.getenv("USAGE_MAX_SESSIONS", "10000"))
+        self._lock = threading.Lock()
+        self._total = _bucket()
+        self._by_model = {}
+        self._by_endpoint = {}
+        self._sessions = OrderedDict()
+        self._window_start = time.time()
+        self._window_cost = 0.0
+
+    def _roll_window(self, now):
+        if now - self._window_start >= self.window:
+            self._window_start = now
+            self._window_cost = 0.0
+
+    def record(self, model, prompt_tokens=0, completion_tokens=0, images=0, session_id=None, endpoint=None):
+        """Add one call's usage; returns its cost in USD."""
+        cost = token_cost(model, prompt_tokens, completion_tokens) + image_cost(model, images)
+        endpoint = endpoint or current_endpoint()
+        with self._lock:
+            self._roll_window(time.time())
+            self._window_cost += cost
+            _add(self._total, prompt_tokens, completion_tokens, images, cost)
+            _add(self._by_model.setdefault(model, _bucket()), prompt_tokens, completion_tokens, images, cost)
+            _add(self._by_endpoint.setdefault(endpoint, _bucket()), prompt_tokens, completion_tokens, images, cost)
+            if session_id:
+                session_id = str(session_id)
+                bucket = self._sessions.get(session_id)
+                if bucket is None:
+                    bucket = self._sessions[session_id] = _bucket()
+                    while len(self._sessions) > self.max_sessions:
+                        self._sessions.popitem(last=False)
+                self._sessions.move_to_end(session_id)
+                _add(bucket, prompt_tokens, completion_tokens, images, cost)
+        return cost
+
+    def record_response(self, response, model=None, session_id=None, endpoint=None):
+        """Record a chat-completions response from its usage field, if it has one."""
+        usage = getattr(response, "usage", None)
+        if usage is None:
+            return 0.0
+        return self.record(
+            model or getattr(response, "model", None) or "unknown",
+            getattr(usage, "prompt_tokens", 0) or 0,
+            getattr(usage, "completion_tokens", 0) or 0,
+            session_id=session_id,
+            endpoint=endpoint,
+        )
+
+    def record_crew(self, model, before, after, session_id=None, endpoint=None):
+        """
+        Record one kickoff from crew_tokens() read before and after it.
+
+        CrewAI's counters are running totals over the life of a crew's agents,
+        so for a pooled crew one kickoff is the difference between the two.
+        """
+        if after is None:
+            return 0.0
+        prompt_tokens, completion_tokens = after
+        if before is not None and before[0] <= prompt_tokens and before[1] <= completion_tokens:
+            prompt_tokens -= before[0]
+            completion_tokens -= before[1]
+        return self.record(model, prompt_tokens, completion_tokens, session_id=session_id, endpoint=endpoint)
+
+    def _spent(self, session_id=None):
+        """Largest fraction of an applicable budget already spent."""
+        spent = []
+        with self._lock:
+            self._roll_window(time.time())
+            if self.global_budget > 0:
+                spent.append(self._window_cost / self.global_budget)
+            if self.session_budget > 0 and session_id:
+                bucket = self._sessions.get(str(session_id))
+                if bucket is not None:
+                    spent.append(bucket["cost_usd"] / self.session_budget)
+        return max(spent, default=0.0)
+
+    def within_budget(self, session_id=None):
+        return self._spent(session_id) < 1.0
+
+    def plan(self, session_id=None):
+        """FULL, DOWNGRADE or FALLBACK for the next story turn."""
+        ratio = self._spent(session_id)
+        if ratio < 1.0:
+            return FULL
+        decision = FALLBACK if ratio >= self.hard_limit else DOWNGRADE
+        BUDGET_DECISIONS.inc(plan=decision)
+        logger.warning("Usage budget reached (%.0f%%), serving turn as %s", ratio * 100, decision)
+        return decision
+
+    def session(self, session_id):
+        with self._lock:
+            bucket = self._sessions.get(str(session_id))
+            return dict(bucket) if bucket is not None else None
+
+    def summary(self):
+        with self._lock:
+            self._roll_window(time.time())
+            return {
+                "total": dict(self._total),
+                "by_model": {name: dict(b) for name, b in self._by_model.items()},
+                "by_endpoint": {name: dict(b) for name, b in self._by_endpoint.items()},
+                "sessions_tracked": len(self._sessions),
+                "budget": {
+                    "session_usd": self.session_budget,
+                    "global_usd": self.global_budget,
+                    "window_seconds": self.window,
+                    "window_spent_usd": self._window_cost,
+                    "hard_limit": self.hard_limit,
+                },
+            }
+
+
+usage_tracker = UsageTracker()